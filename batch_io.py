@@ -0,0 +1,493 @@
+"""
+Record Batch I/O
+
+Streams CSV, JSONL, Parquet and Arrow IPC files as pyarrow record batches and writes record batches back out in
+bulk, so conversions run in constant memory whatever the file size.
+
+- Parquet is read one row group slice at a time
+- CSV is read in fixed-size blocks with pyarrow's streaming reader
+- JSONL is read in blocks of lines
+- Arrow IPC (Feather v2) files are memory-mapped and their record batches used in place, without copying
+  or decoding anything (see compile_arrow.py)
+
+CSV and JSONL types are inferred as the file is read, so a later batch can hold a wider type than the
+earlier ones (e.g. a 1.5 after a column of integers, or a field that first appears halfway through). The
+schema is then widened, never narrowed: integers to floats, differing types to text (nested values as JSON),
+structs to the union of their fields, and writers rewrite what they have already written into the wider
+schema. Values are never cast lossily; when they cannot be kept (e.g. an integer above 2^53 widened to a
+float) reading fails with Arrow's error instead.
+
+CSV and JSONL files may be compressed (e.g. train.jsonl.zst, table.csv.gz), see compressed_io.py. The
+format is taken from the extension before the compression extension.
+
+Example:
+from batch_io import iter_record_batches, open_batch_writer
+
+with open_batch_writer("output.parquet") as writer:
+    for batch in iter_record_batches("input.jsonl"):
+        writer.write_batch(batch)
+"""
+
+import datetime
+import decimal
+import json
+import os
+import re
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from compressed_io import is_compressed, open_file, strip_compression_extension
+
+FORMATS = ("csv", "jsonl", "parquet", "arrow")
+
+DEFAULT_BATCH_SIZE = 10_000
+CSV_BLOCK_SIZE = 16 << 20
+
+# Integers above this do not survive a cast to float64
+MAX_SAFE_INTEGER = 2 ** 53
+
+# Extra JSONL blocks read ahead to resolve columns that are all null in the first block
+MAX_SCHEMA_BLOCKS = 8
+
+EXTENSIONS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".json": "jsonl",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+
+
+def detect_format(path: str) -> str:
+    """Returns the file format implied by the file extension, ignoring a compression extension."""
+    suffix = Path(strip_compression_extension(path)).suffix.lower()
+    if suffix not in EXTENSIONS:
+        raise ValueError(f"Cannot infer file format from extension of {path}, expected one of {FORMATS}")
+    return EXTENSIONS[suffix]
+
+
+def is_arrow_file(path: str) -> bool:
+    """Returns whether the path has an Arrow IPC extension, for tools that otherwise read any file as JSONL."""
+    return EXTENSIONS.get(Path(path).suffix.lower()) == "arrow"
+
+
+def open_arrow(path: str) -> pa.ipc.RecordBatchFileReader:
+    """Opens an Arrow IPC file memory-mapped, so its batches are read zero-copy straight from the page cache."""
+    return pa.ipc.open_file(pa.memory_map(path, 'r'))
+
+
+def read_arrow_table(path: str, columns: Optional[List[str]] = None) -> pa.Table:
+    """Returns a whole Arrow IPC file as a table backed by the memory map, nothing is read until it is used."""
+    table = open_arrow(path).read_all()
+    return table.select(columns) if columns is not None else table
+
+
+def json_default(obj):
+    """Serializes the Python values pyarrow produces that json does not handle."""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def widen_type(a: pa.DataType, b: pa.DataType) -> pa.DataType:
+    """Returns the narrowest type holding the values of both types without loss, text when no other does."""
+    if a == b:
+        return a
+    if pa.types.is_null(a):
+        return b
+    if pa.types.is_null(b):
+        return a
+    if pa.types.is_integer(a) and pa.types.is_integer(b) and pa.types.is_signed_integer(a) == pa.types.is_signed_integer(b):
+        return a if a.bit_width >= b.bit_width else b
+    if (pa.types.is_integer(a) or pa.types.is_floating(a)) and (pa.types.is_integer(b) or pa.types.is_floating(b)):
+        return pa.float64()
+    if _is_text(a) and _is_text(b):
+        return pa.large_string() if pa.types.is_large_string(a) or pa.types.is_large_string(b) else pa.string()
+    if pa.types.is_struct(a) and pa.types.is_struct(b):
+        return pa.struct(_widen_fields(list(a), list(b)))
+    if _is_list(a) and _is_list(b):
+        value_type = widen_type(a.value_type, b.value_type)
+        return pa.large_list(value_type) if pa.types.is_large_list(a) or pa.types.is_large_list(b) else pa.list_(value_type)
+    return pa.string()
+
+
+def _is_text(t):
+    return pa.types.is_string(t) or pa.types.is_large_string(t)
+
+
+def _is_list(t):
+    return pa.types.is_list(t) or pa.types.is_large_list(t)
+
+
+def _widen_fields(fields, others):
+    # Fields keep their order, fields only the other side has follow
+    others = {field.name: field for field in others}
+    widened = [field.with_type(widen_type(field.type, others.pop(field.name).type)) if field.name in others else field
+               for field in fields]
+    return widened + list(others.values())
+
+
+def widen_schema(schema: pa.Schema, other: pa.Schema) -> pa.Schema:
+    """Returns a schema holding the rows of both schemas (see widen_type), the schema itself if it already does."""
+    widened = pa.schema(_widen_fields(list(schema), list(other)))
+    return schema if widened.equals(schema) else widened.with_metadata(schema.metadata)
+
+
+def cast_column(column, target: pa.DataType):
+    """Casts a column to a type it widens to, nested values to text as JSON. Lossy casts raise."""
+    if column.type == target:
+        return column
+    if _is_text(target) and pa.types.is_nested(column.type):
+        return pa.array([None if value is None else json.dumps(value, default=json_default)
+                         for value in column.to_pylist()], type=target)
+    if pa.types.is_struct(target) and pa.types.is_struct(column.type):
+        if isinstance(column, pa.ChunkedArray):
+            column = column.combine_chunks()
+        names = [field.name for field in column.type]
+        children = [cast_column(column.field(field.name), field.type) if field.name in names
+                    else pa.nulls(len(column), field.type) for field in target]
+        return pa.StructArray.from_arrays(children, fields=list(target), mask=column.is_null())
+    if _is_list(target) and _is_list(column.type) and column.type.value_type != target.value_type:
+        if isinstance(column, pa.ChunkedArray):
+            column = column.combine_chunks()
+        values = cast_column(column.values, target.value_type)
+        array_type = pa.LargeListArray if pa.types.is_large_list(target) else pa.ListArray
+        offsets = column.offsets.cast(pa.int64() if pa.types.is_large_list(target) else pa.int32())
+        return array_type.from_arrays(offsets, values, mask=column.is_null())
+    return column.cast(target)
+
+
+def cast_batch(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    """Returns the batch in a schema its own widens to (see widen_schema), columns it lacks filled with nulls."""
+    if batch.schema.equals(schema):
+        return batch
+    names = batch.schema.names
+    columns = [cast_column(batch.column(field.name), field.type) if field.name in names
+               else pa.nulls(batch.num_rows, field.type) for field in schema]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def rows_to_batch(rows: List[dict]) -> pa.RecordBatch:
+    """
+    Returns rows as a record batch with the fields of every row, a column whose values have no common
+    Arrow type (e.g. true and "true") stored as text, with non-text values as JSON.
+    """
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    columns = []
+    for name in names:
+        values = [row.get(name) for row in rows]
+        try:
+            column = pa.array(values)
+            # pyarrow rounds integers into a float column, keep integers floats cannot hold as text instead
+            if pa.types.is_floating(column.type) and any(
+                    type(value) is int and abs(value) > MAX_SAFE_INTEGER for value in values):
+                raise pa.ArrowInvalid("integers beyond float precision")
+            columns.append(column)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns.append(pa.array([value if value is None or isinstance(value, str)
+                                     else json.dumps(value, default=json_default) for value in values], pa.string()))
+    return pa.RecordBatch.from_arrays(columns, names=names)
+
+
+def iter_record_batches(path: str, file_format: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                        columns: Optional[List[str]] = None,
+                        filter: Optional[pc.Expression] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Yields the file as record batches of at most batch_size rows (CSV batches follow its block size).
+
+    filter, if given, keeps only the rows it selects and is pushed down to the Parquet reader, which skips
+    the row groups whose statistics rule it out and may filter on columns that are not read. CSV and JSONL
+    files have no statistics to skip rows with, so filter is only supported for Parquet.
+    """
+    file_format = file_format or detect_format(path)
+    if filter is not None and file_format != "parquet":
+        raise ValueError(f"Filters can only be pushed down to Parquet files, not {file_format}")
+    if file_format == "parquet":
+        if filter is not None:
+            yield from ds.dataset(path, format="parquet").to_batches(columns=columns, filter=filter,
+                                                                      batch_size=batch_size)
+        else:
+            yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns)
+    elif file_format == "csv":
+        yield from _iter_csv_batches(path, columns)
+    elif file_format == "jsonl":
+        yield from _iter_jsonl_batches(path, batch_size, columns)
+    elif file_format == "arrow":
+        yield from _iter_arrow_batches(path, batch_size, columns)
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+
+def _iter_csv_batches(path, columns):
+    # pyarrow infers the column types from the first block, when a later value does not convert the file is
+    # reopened after the rows already read, with the types read so far and the failing column widened
+    column_types = {}
+    rows_read = 0
+    while True:
+        read_options = pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE, skip_rows_after_names=rows_read)
+        convert_options = pa_csv.ConvertOptions(include_columns=columns, strings_can_be_null=True,
+                                                column_types=column_types)
+        # pyarrow reads plain files natively, compressed ones go through the shared codecs
+        source = open_file(path, 'rb') if is_compressed(path) else path
+        try:
+            with pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options) as reader:
+                column_types.update(zip(reader.schema.names, reader.schema.types))
+                for batch in reader:
+                    if batch.num_rows:
+                        yield batch
+                        rows_read += batch.num_rows
+            return
+        except pa.ArrowInvalid as e:
+            match = re.match(r"In CSV column #(\d+): .*CSV conversion error to ", str(e))
+            if match is None:
+                raise
+            name = _csv_column_names(path)[int(match.group(1))]
+            if _is_text(column_types.get(name, pa.string())):
+                raise
+            column_types[name] = pa.float64() if pa.types.is_integer(column_types[name]) else pa.string()
+        finally:
+            if not isinstance(source, str):
+                source.close()
+
+
+def _csv_column_names(path):
+    source = open_file(path, 'rb') if is_compressed(path) else path
+    try:
+        with pa_csv.open_csv(source, read_options=pa_csv.ReadOptions(block_size=1 << 16),
+                             convert_options=pa_csv.ConvertOptions(column_types={})) as reader:
+            return reader.schema.names
+    finally:
+        if not isinstance(source, str):
+            source.close()
+
+
+def _iter_arrow_batches(path, batch_size, columns):
+    reader = open_arrow(path)
+    for index in range(reader.num_record_batches):
+        batch = reader.get_batch(index)
+        if columns is not None:
+            batch = batch.select(columns)
+        # Slices share the mapped buffers
+        for start in range(0, batch.num_rows, batch_size):
+            yield batch.slice(start, batch_size)
+
+
+def _iter_jsonl_blocks(path, batch_size, columns):
+    with open_file(path) as f:
+        while True:
+            lines = list(islice(f, batch_size))
+            if not lines:
+                return
+            rows = [json.loads(line) for line in lines if line.strip()]
+            if columns is not None:
+                rows = [{column: row.get(column) for column in columns} for row in rows]
+            if rows:
+                yield rows
+
+
+def _iter_jsonl_batches(path, batch_size, columns):
+    blocks = (rows_to_batch(rows) for rows in _iter_jsonl_blocks(path, batch_size, columns))
+
+    # Infer the schema from the first block, reading ahead while some columns are still all null
+    buffered = []
+    schema = None
+    for batch in blocks:
+        buffered.append(batch)
+        schema = batch.schema if schema is None else widen_schema(schema, batch.schema)
+        if not any(pa.types.is_null(field.type) for field in schema) or len(buffered) > MAX_SCHEMA_BLOCKS:
+            break
+
+    for batch in buffered:
+        yield cast_batch(batch, schema)
+
+    # Later blocks widen the schema when they do not fit it
+    for batch in blocks:
+        schema = widen_schema(schema, batch.schema)
+        yield cast_batch(batch, schema)
+
+
+def encode_jsonl(batch: pa.RecordBatch, ensure_ascii: bool = True) -> str:
+    """Returns the rows of a batch as JSONL text, one line per row."""
+    if not batch.num_rows:
+        return ""
+    lines = [json.dumps(row, ensure_ascii=ensure_ascii, default=json_default) for row in batch.to_pylist()]
+    return "\n".join(lines) + "\n"
+
+
+class BatchWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.rows_written = 0
+
+    def write_batch(self, batch: pa.RecordBatch):
+        self._write(batch)
+        self.rows_written += batch.num_rows
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JsonlBatchWriter(BatchWriter):
+    def __init__(self, path: str, ensure_ascii: bool = True, compression_level: Optional[int] = None):
+        super().__init__(path)
+        self.ensure_ascii = ensure_ascii
+        self.file = open_file(path, 'w', compression_level)
+
+    def _write(self, batch):
+        self.file.write(encode_jsonl(batch, self.ensure_ascii))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetBatchWriter(BatchWriter):
+    def __init__(self, path: str, schema: Optional[pa.Schema] = None):
+        super().__init__(path)
+        self.writer = pq.ParquetWriter(path, schema) if schema is not None else None
+
+    def _write(self, batch):
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, batch.schema)
+        schema = widen_schema(self.writer.schema, batch.schema)
+        if not schema.equals(self.writer.schema):
+            self.writer.close()
+            self.writer = _rewrite(self.path, lambda path: pq.ParquetFile(path).iter_batches(),
+                                   lambda: pq.ParquetWriter(self.path, schema), schema)
+        self.writer.write_batch(cast_batch(batch, self.writer.schema))
+
+    def close(self):
+        if self.writer is None:
+            # Nothing was written, still leave a valid (empty) file behind
+            self.writer = pq.ParquetWriter(self.path, pa.schema([]))
+        self.writer.close()
+
+
+class ArrowBatchWriter(BatchWriter):
+    """Writes an uncompressed Arrow IPC file, so readers can memory-map it and use its buffers in place."""
+
+    def __init__(self, path: str, schema: Optional[pa.Schema] = None):
+        super().__init__(path)
+        self.schema = schema
+        self.writer = pa.ipc.new_file(path, schema) if schema is not None else None
+
+    def _write(self, batch):
+        if self.writer is None:
+            self.schema = batch.schema
+            self.writer = pa.ipc.new_file(self.path, self.schema)
+        schema = widen_schema(self.schema, batch.schema)
+        if not schema.equals(self.schema):
+            self.writer.close()
+            self.writer = _rewrite(self.path, _iter_arrow_file, lambda: pa.ipc.new_file(self.path, schema), schema)
+            self.schema = schema
+        self.writer.write_batch(cast_batch(batch, self.schema))
+
+    def close(self):
+        if self.writer is None:
+            self.writer = pa.ipc.new_file(self.path, pa.schema([]))
+        self.writer.close()
+
+
+class CsvBatchWriter(BatchWriter):
+    """Writes CSV, storing nested values (lists, structs, maps) as JSON strings."""
+
+    def __init__(self, path: str, compression_level: Optional[int] = None):
+        super().__init__(path)
+        self.compression_level = compression_level
+        self.writer = None
+        self.schema = None
+        self.file = open_file(path, 'wb', compression_level)
+
+    def _write(self, batch):
+        batch = _nested_to_json(batch)
+        if self.writer is None:
+            self.schema = batch.schema
+            self.writer = pa_csv.CSVWriter(self.file, self.schema)
+        schema = widen_schema(self.schema, batch.schema)
+        if not schema.equals(self.schema):
+            self.writer.close()
+            self.file.close()
+            self.writer = _rewrite(self.path, self._read_back, lambda: self._open_writer(schema), schema)
+            self.schema = schema
+        self.writer.write_batch(cast_batch(batch, self.schema))
+
+    def _open_writer(self, schema):
+        self.file = open_file(self.path, 'wb', self.compression_level)
+        return pa_csv.CSVWriter(self.file, schema)
+
+    def _read_back(self, path):
+        convert_options = pa_csv.ConvertOptions(column_types=self.schema, strings_can_be_null=True)
+        with open_file(path, 'rb') as source:
+            yield from pa_csv.open_csv(source, convert_options=convert_options)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.file.close()
+
+
+def _iter_arrow_file(path):
+    reader = open_arrow(path)
+    for index in range(reader.num_record_batches):
+        yield reader.get_batch(index)
+
+
+def _rewrite(path, read_batches, open_writer, schema):
+    """Rewrites the file at path into a wider schema, returns the open writer to carry on writing with."""
+    previous = path + ".narrow"
+    os.replace(path, previous)
+    writer = open_writer()
+    for batch in read_batches(previous):
+        writer.write_batch(cast_batch(batch, schema))
+    os.remove(previous)
+    return writer
+
+
+def _nested_to_json(batch):
+    columns = []
+    for column in batch.columns:
+        if pa.types.is_nested(column.type):
+            column = pa.array([None if value is None else json.dumps(value, default=json_default)
+                               for value in column.to_pylist()], type=pa.string())
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+
+def open_batch_writer(path: str, file_format: Optional[str] = None,
+                      compression_level: Optional[int] = None) -> BatchWriter:
+    """
+    Returns a writer for the file format implied by the path (or given explicitly).
+    compression_level applies to compressed CSV and JSONL outputs.
+    """
+    file_format = file_format or detect_format(path)
+    if file_format == "jsonl":
+        return JsonlBatchWriter(path, compression_level=compression_level)
+    if file_format == "parquet":
+        return ParquetBatchWriter(path)
+    if file_format == "csv":
+        return CsvBatchWriter(path, compression_level)
+    if file_format == "arrow":
+        return ArrowBatchWriter(path)
+    raise ValueError(f"Unsupported file format: {file_format}")
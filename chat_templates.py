@@ -0,0 +1,247 @@
+r"""
+Chat Template Renderer
+
+Renders conversations (or flat records) as training text through named templates, compiled once per
+process. One pass over a dataset can render it into several templates at once: each line is parsed once
+and rendered by every template, blocks of lines are rendered in worker processes and written back in file
+order, one large write per block and output.
+
+A template is written in JSON-like notation:
+- conversation templates render the 'messages' of a row: "message" maps a role to the text of one message
+  (with {role}, {content} and {index} fields, "*" for any role without its own entry, roles without an
+  entry are left out), "prefix" and "suffix" wrap the whole conversation
+- record templates render the fields of a row: "record" is one text with a {field} per field
+- "separator" is written after every rendered row (default: a blank line, "\n")
+
+Built-in templates:
+- human_assistant: {"message": {"user": "Human: {content}\n", "assistant": "Assistant: {content}\n"}}
+- chatml: {"message": {"*": "<|im_start|>{role}\n{content}<|im_end|>\n"}}
+- llama3: {"prefix": "<|begin_of_text|>", "message": {"*": "<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>"}}
+- alpaca: {"message": {"system": "{content}\n\n", "user": "### Instruction:\n{content}\n\n", "assistant": "### Response:\n{content}\n\n"}}
+- kto: {"record": "Query: {query}\nResponse: {response}\nLabel: {label}\n"}
+
+Message contents that are null render as empty text. Lines that are not valid JSON, and rows without the
+fields a template needs, are skipped and reported.
+
+Usage: python chat_templates.py <input_file> <template>=<output_file> [<template>=<output_file> ...] [--workers <workers>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input_file: Path to the input JSONL file
+- template=output_file: Built-in template name or path to a JSON template file, and the path to save the text rendered with it
+- workers: Optional number of worker processes (default: 1)
+- compression_level: Optional compression level of compressed outputs such as .txt.gz or .txt.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python chat_templates.py train.jsonl chatml=train_chatml.txt llama3=train_llama3.txt my_template.json=train_custom.txt --workers 16
+
+Input JSONL Example:
+{"messages": [{"content": "You are a helpful assistant.", "role": "system"}, {"content": "Hello", "role": "user"}, {"content": "Hi there!", "role": "assistant"}]}
+
+Output Text Example (chatml):
+<|im_start|>system
+You are a helpful assistant.<|im_end|>
+<|im_start|>user
+Hello<|im_end|>
+<|im_start|>assistant
+Hi there!<|im_end|>
+
+Python Example:
+from chat_templates import get_template
+
+template = get_template("llama3")
+template.render({"messages": [{"role": "user", "content": "Hello"}]})
+"""
+
+import argparse
+import json
+import string
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Tuple
+
+from compressed_io import add_compression_arguments, open_file
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_blocks, split_lines
+
+TEMPLATES = {
+    "human_assistant": {"message": {"user": "Human: {content}\n", "assistant": "Assistant: {content}\n"}},
+    "chatml": {"message": {"*": "<|im_start|>{role}\n{content}<|im_end|>\n"}},
+    "llama3": {"prefix": "<|begin_of_text|>",
+               "message": {"*": "<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>"}},
+    "alpaca": {"message": {"system": "{content}\n\n", "user": "### Instruction:\n{content}\n\n",
+                           "assistant": "### Response:\n{content}\n\n"}},
+    "kto": {"record": "Query: {query}\nResponse: {response}\nLabel: {label}\n"},
+}
+
+MESSAGE_FIELDS = {"role", "content", "index"}
+TEMPLATE_KEYS = {"message", "prefix", "suffix", "record", "separator"}
+
+
+def _template_fields(text, where):
+    fields = set()
+    for _, field, _, _ in string.Formatter().parse(text):
+        if field is None:
+            continue
+        if not field.isidentifier():
+            raise ValueError(f"Invalid field {{{field}}} in {where}, expected a field name")
+        fields.add(field)
+    return fields
+
+
+class ChatTemplate:
+    def __init__(self, spec: Dict[str, Any], name: str = "template"):
+        if not isinstance(spec, dict):
+            raise ValueError(f"Template {name} must be an object")
+        unknown = set(spec) - TEMPLATE_KEYS
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)} in template {name}")
+        if ("record" in spec) == ("message" in spec):
+            raise ValueError(f"Template {name} needs either 'message' or 'record'")
+
+        self.name = name
+        self.separator = spec.get("separator", "\n")
+        self.prefix = spec.get("prefix", "")
+        self.suffix = spec.get("suffix", "")
+        for key in ("prefix", "suffix"):
+            if _template_fields(getattr(self, key), f"{name} {key}"):
+                raise ValueError(f"The {key} of template {name} cannot have fields")
+            # Literal braces are written as {{ and }} in every template text
+            setattr(self, key, getattr(self, key).format())
+
+        # Each template text is checked once and kept as its bound format method
+        self.record = None
+        self.messages = {}
+        if "record" in spec:
+            self.fields = sorted(_template_fields(spec["record"], f"{name} record"))
+            self.record = spec["record"].format
+        else:
+            for role, text in spec["message"].items():
+                fields = _template_fields(text, f"{name} message of {role}")
+                if fields - MESSAGE_FIELDS:
+                    raise ValueError(f"Unknown fields {sorted(fields - MESSAGE_FIELDS)} in {name} message of {role}, "
+                                     f"expected {sorted(MESSAGE_FIELDS)}")
+                self.messages[role] = text.format
+        self.default = self.messages.pop("*", None)
+
+    def render_parts(self, row: Dict[str, Any]) -> List[str]:
+        """Returns the texts a row renders to (prefix, one per message, suffix), without the separator."""
+        if self.record is not None:
+            return [self.record(**{field: row[field] for field in self.fields})]
+        parts = [self.prefix] if self.prefix else []
+        for index, message in enumerate(row['messages']):
+            role = message['role']
+            render = self.messages.get(role, self.default)
+            if render is not None:
+                parts.append(render(role=role, content=message.get('content') or "", index=index))
+        if self.suffix:
+            parts.append(self.suffix)
+        return parts
+
+    def render(self, row: Dict[str, Any]) -> str:
+        """Returns the text of a row, without the separator."""
+        return "".join(self.render_parts(row))
+
+
+@lru_cache(maxsize=None)
+def get_template(name: str) -> ChatTemplate:
+    """Returns the compiled template for a built-in template name or a path to a JSON template file."""
+    if name in TEMPLATES:
+        return ChatTemplate(TEMPLATES[name], name)
+    with open(name, 'r') as f:
+        return ChatTemplate(json.load(f), name)
+
+
+def render_lines(lines: List[str], template_names: Tuple[str, ...]) -> Tuple[List[str], List[Tuple[int, str]]]:
+    """
+    Renders JSONL lines with every template, returns (the text of each template, (position, problem) of
+    each line that was skipped). Empty lines are skipped silently.
+    """
+    templates = [get_template(name) for name in template_names]
+    texts = [[] for _ in templates]
+    skipped = []
+    for position, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            skipped.append((position, "invalid JSON"))
+            continue
+        try:
+            rendered = [template.render(row) + template.separator for template in templates]
+        except (KeyError, TypeError, AttributeError) as e:
+            skipped.append((position, f"missing or invalid field {e}"))
+            continue
+        for text, output in zip(texts, rendered):
+            text.append(output)
+    return ["".join(text) for text in texts], skipped
+
+
+def render_block(data: bytes, template_names: Tuple[str, ...]):
+    """Returns (the text of each template, line count, skipped lines) of a block of JSONL lines."""
+    lines = split_lines(data)
+    texts, skipped = render_lines(lines, template_names)
+    return texts, len(lines), skipped
+
+
+def render_templates(input_file: str, outputs: Dict[str, str], workers: int = 1, compression_level: int = None,
+                     metrics: Metrics = None) -> Dict[str, int]:
+    """Renders the dataset with each template into its output file in one pass, returns the row counts."""
+    metrics = metrics or Metrics("chat_templates", [input_file])
+    # Compile up front so a bad template fails before any work is sent to the workers
+    template_names = tuple(outputs)
+    for name in template_names:
+        get_template(name)
+
+    counts = {"rows": 0, "skipped": 0}
+    files = [open_file(path, 'w', compression_level) for path in outputs.values()]
+    try:
+        line_number = 0
+        results = map_blocks(input_file, partial(render_block, template_names=template_names), workers,
+                             on_range=metrics.add_bytes)
+        for texts, line_count, skipped in metrics.timed(results, "render"):
+            for position, problem in skipped:
+                print(f"Skipping line {line_number + position + 1}: {problem}")
+            # One write per block and output
+            with metrics.phase("write"):
+                for f, text in zip(files, texts):
+                    f.write(text)
+            rows = line_count - len(skipped)
+            counts["rows"] += rows
+            counts["skipped"] += len(skipped)
+            line_number += line_count
+            metrics.add(rows=rows)
+    finally:
+        for f in files:
+            f.close()
+
+    for name, count in counts.items():
+        metrics.count(name, count)
+    metrics.finish()
+    return counts
+
+
+def parse_output(value):
+    template, separator, path = value.partition('=')
+    if not separator or not template.strip() or not path.strip():
+        raise argparse.ArgumentTypeError(f"Expected <template>=<output_file>, got {value!r}")
+    return template.strip(), path.strip()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a JSONL dataset into one or more chat templates")
+    parser.add_argument(
+        "input_file", help="Path to input JSONL file")
+    parser.add_argument(
+        "outputs", type=parse_output, nargs="+", help="<template>=<output_file> pairs, template being a built-in name or a JSON template file")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("chat_templates", [args.input_file], args.metrics_out, args.profile)
+    counts = render_templates(args.input_file, dict(args.outputs), args.workers, args.compression_level, metrics)
+    print(f"Rendered {counts['rows']} rows ({counts['skipped']} skipped) into "
+          + ", ".join(f"{path} ({name})" for name, path in args.outputs))
@@ -3,47 +3,131 @@ JSONL Message Order Checker
 
 Checks the order of messages in a JSONL dataset and logs specific patterns.
 
-Usage: python check_message_order.py <input_file>
+All patterns are compiled into one automaton (see role_patterns.py), so each conversation's roles are
+scanned once however many patterns are checked. Without --pattern, the two built-in checks run: two or
+three assistant messages in a row followed by a user message. A count of matches per pattern is printed
+at the end.
 
-Input: Path to the input JSONL file
+Arrow IPC files compiled with compile_arrow.py are read memory-mapped and only the roles of the typed
+'messages' column are touched, so no JSON is decoded and the message contents are never read.
+
+Usage: python check_message_order.py <input_file> [--pattern <name>=<pattern> ...] [--counts_only] [--workers <workers>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input: Path to the input JSONL file (or Arrow IPC file, see compile_arrow.py)
+Pattern: Optional named role-sequence pattern, may be repeated (e.g. 'double_assistant=assistant{2,}user')
+Counts Only: Optional flag to print only the match counts, not every match
+Workers: Optional number of worker processes (default: 1)
+Metrics Out: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+Profile: Optional path prefix to save cProfile stats of each phase
 
 Example:
 python check_message_order.py persona-based-chat-messages-1k-augmented-cleaned.jsonl
+python check_message_order.py train.jsonl --pattern 'starts_with_user=^user' --pattern 'user_twice=user user' --counts_only --workers 32
+python check_message_order.py train.arrow --counts_only --workers 32
 
 Input JSONL Example:
 {"messages": [{"content": "...", "role": "system"}, {"content": "...", "role": "user"}, {"content": ".....", "role": "assistant"}, {"content": "...", "role": "user"}, {"content": "....", "role": "assistant"}, {"content": "....", "role": "assistant"}]}
 
 Output:
 Row 682, Index 4: Assistant message followed by another assistant message and then user message.
+...
+
+Pattern counts:
+assistant{2}user: 12 matches in 11 rows
+assistant{3}user: 3 matches in 3 rows
+
+To pull a reported row back out: python jsonl_index.py get <input_file> 682
 """
 
 import json
 import argparse
+from functools import lru_cache, partial
+from batch_io import is_arrow_file
+from compile_arrow import batch_messages
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_arrow_rows, map_lines
+from role_patterns import RolePatternSet
+
+# Built-in checks, keyed by pattern, with the message printed for each match
+DEFAULT_PATTERNS = {
+    "assistant{2}user": "Assistant message followed by another assistant message and then user message.",
+    "assistant{3}user": "Assistant message followed by two more assistant messages and then user message.",
+}
+
+@lru_cache(maxsize=None)
+def compile_patterns(patterns):
+    return RolePatternSet(dict(patterns))
+
+def find_pattern_matches(line, patterns):
+    """Returns (pattern name, index) for each pattern match in one JSONL row."""
+    messages = json.loads(line)['messages']
+    return compile_patterns(patterns).scan([message['role'] for message in messages])
+
+def find_batch_matches(batch, patterns):
+    """find_pattern_matches over the rows of an Arrow record batch."""
+    pattern_set = compile_patterns(patterns)
+    return [pattern_set.scan([message['role'] for message in messages or []])
+            for messages in batch_messages(batch, ("role",))]
 
-def check_message_order(input_file: str):
-    # Load the JSONL data
-    with open(input_file, 'r') as f:
-        data = [json.loads(line) for line in f]
-
-    # Iterate through the data
-    for i, row in enumerate(data):
-        messages = row['messages']
-
-        # Iterate through the messages
-        for j in range(len(messages) - 2):
-            # Check if the order is Assistant -> Assistant -> User
-            if messages[j]['role'] == 'assistant' and messages[j+1]['role'] == 'assistant' and messages[j+2]['role'] == 'user':
-                print(
-                    f"Row {i+1}, Index {j}: Assistant message followed by another assistant message and then user message.")
-            # Check if the order is Assistant -> Assistant -> Assistant -> User
-            elif messages[j]['role'] == 'assistant' and messages[j+1]['role'] == 'assistant' and messages[j+2]['role'] == 'assistant' and messages[j+3]['role'] == 'user':
-                print(
-                    f"Row {i+1}, Index {j}: Assistant message followed by two more assistant messages and then user message.")
+def check_message_order(input_file: str, patterns=None, counts_only: bool = False, workers: int = 1,
+                        metrics: Metrics = None):
+    metrics = metrics or Metrics("check_message_order", [input_file])
+    if patterns is None:
+        patterns = {pattern: pattern for pattern in DEFAULT_PATTERNS}
+        descriptions = DEFAULT_PATTERNS
+    else:
+        descriptions = {name: f"Matches pattern '{name}' ({pattern})." for name, pattern in patterns.items()}
+
+    # Compile once here so invalid patterns fail before any work is sent to the workers
+    patterns = tuple(patterns.items())
+    compile_patterns(patterns)
+
+    match_counts = {name: 0 for name, _ in patterns}
+    row_counts = {name: 0 for name, _ in patterns}
+    if is_arrow_file(input_file):
+        results = map_arrow_rows(input_file, partial(find_batch_matches, patterns=patterns), workers, ["messages"],
+                                 on_range=metrics.add_bytes)
+    else:
+        results = map_lines(input_file, partial(find_pattern_matches, patterns=patterns), workers,
+                            on_range=metrics.add_bytes)
+    for row_number, matches in metrics.timed(results, "process"):
+        metrics.add(rows=1)
+        if not matches:
+            continue
+        with metrics.phase("write"):
+            for name in {name for name, _ in matches}:
+                row_counts[name] += 1
+            for name, j in matches:
+                match_counts[name] += 1
+                if not counts_only:
+                    print(f"Row {row_number}, Index {j}: {descriptions[name]}")
+
+    print("\nPattern counts:")
+    for name, _ in patterns:
+        print(f"{name}: {match_counts[name]} matches in {row_counts[name]} rows")
+        metrics.count(f"matches:{name}", match_counts[name])
+    metrics.finish()
+    return match_counts
+
+def parse_pattern(value):
+    name, separator, pattern = value.partition('=')
+    if not separator or not name.strip() or not pattern.strip():
+        raise argparse.ArgumentTypeError(f"Expected <name>=<pattern>, got {value!r}")
+    return name.strip(), pattern.strip()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Check message order in JSONL dataset")
     parser.add_argument(
-        "input_file", help="Path to input JSONL file")
+        "input_file", help="Path to input JSONL file (or Arrow IPC file)")
+    parser.add_argument(
+        "--pattern", type=parse_pattern, action="append", help="Named role-sequence pattern as <name>=<pattern>, may be repeated")
+    parser.add_argument(
+        "--counts_only", action="store_true", help="Only print the match counts per pattern")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    check_message_order(args.input_file)
\ No newline at end of file
+    patterns = dict(args.pattern) if args.pattern else None
+    metrics = Metrics("check_message_order", [args.input_file], args.metrics_out, args.profile)
+    check_message_order(args.input_file, patterns, args.counts_only, args.workers, metrics)
@@ -0,0 +1,276 @@
+"""
+Resumable Runs
+
+Checkpoints the progress of a long run so it can pick up where it stopped, and commits its outputs
+atomically so a half-written output never looks complete to downstream jobs.
+
+- Outputs are written to hidden temporary files next to them ('.partial.<name>') and renamed over the
+  final paths only when the run finishes
+- Every interval, the outputs are flushed to disk (compressed outputs end their current frame) and the
+  input offset, the size of each output and the tool's running counters are saved to '.<name>.checkpoint'
+  next to the first output
+- On restart with the same inputs, outputs and settings, each output is truncated back to its checkpointed
+  size and the tool carries on from the checkpointed input offset, so at most one interval of work is
+  redone. Anything else (changed input, other settings, --restart) starts over
+
+Parquet outputs cannot be cut and appended to, so they are written as one part per checkpoint interval and
+the parts are merged (row group by row group) into the final file when the run finishes.
+
+Example:
+from checkpoint import ResumableRun
+
+with ResumableRun("tool", [input_file], [output_file], state={"rows": 0}) as run:
+    output = run.open_text(output_file)
+    for result in map_blocks(input_file, func, start=run.offset, on_offset=run.advance):
+        output.write(result)
+        run.state["rows"] += 1
+    run.commit()
+"""
+
+import json
+import os
+import time
+from functools import reduce
+from typing import IO, Any, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from batch_io import BatchWriter, ParquetBatchWriter, cast_batch, widen_schema
+from compressed_io import open_file, sync_file
+
+DEFAULT_INTERVAL = 60
+
+
+def partial_path(path: str) -> str:
+    """Returns the hidden temporary path an output is written to until the run commits."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".partial.{name}")
+
+
+def checkpoint_path(path: str) -> str:
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.checkpoint")
+
+
+def add_checkpoint_arguments(parser):
+    """Adds the --checkpoint_interval and --restart options shared by the resumable tools."""
+    parser.add_argument(
+        "--checkpoint_interval", type=float, default=DEFAULT_INTERVAL,
+        help="Seconds between checkpoints of a run that can be resumed after a crash")
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore any checkpoint of an earlier run and start over")
+
+
+def _input_fingerprint(path):
+    if not os.path.isfile(path):
+        # e.g. a Hugging Face dataset name
+        return {"path": path}
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _fsync_directory(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class _ParquetParts(BatchWriter):
+    """Writes a Parquet output as a series of part files, one per checkpoint interval."""
+
+    def __init__(self, path: str, schema: Optional[pa.Schema] = None, parts: int = 0):
+        super().__init__(path)
+        self.schema = schema
+        self.parts = parts
+        self.writer = None
+
+    def part_path(self, index):
+        return f"{partial_path(self.path)}.{index:05d}"
+
+    def _write(self, batch):
+        if self.writer is None:
+            self.writer = ParquetBatchWriter(self.part_path(self.parts), self.schema)
+        self.writer.write_batch(batch)
+
+    def sync(self) -> int:
+        """Closes the current part so it is complete on disk, returns the number of complete parts."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            with open(self.part_path(self.parts), 'rb') as f:
+                os.fsync(f.fileno())
+            self.parts += 1
+        return self.parts
+
+    def remove_parts(self, start=0):
+        index = start
+        while os.path.exists(self.part_path(index)):
+            os.remove(self.part_path(index))
+            index += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def commit(self):
+        self.sync()
+        if self.parts == 1:
+            os.replace(self.part_path(0), self.path)
+            return
+        writer = None
+        parts = [pq.ParquetFile(self.part_path(index)) for index in range(self.parts)]
+        # Parts written after a JSONL input widened its schema hold wider types than the earlier ones
+        schema = reduce(widen_schema, [part.schema_arrow for part in parts[1:]], parts[0].schema_arrow) if parts else None
+        for part in parts:
+            if writer is None:
+                writer = pq.ParquetWriter(partial_path(self.path), schema)
+            for batch in part.iter_batches():
+                writer.write_batch(cast_batch(batch, writer.schema))
+        if writer is None:
+            ParquetBatchWriter(partial_path(self.path), self.schema).close()
+        else:
+            writer.close()
+        os.replace(partial_path(self.path), self.path)
+        self.remove_parts()
+
+
+class ResumableRun:
+    def __init__(self, tool: str, input_paths: List[str], output_paths: List[str], config: Dict[str, Any] = None,
+                 state: Dict[str, Any] = None, interval: float = DEFAULT_INTERVAL, restart: bool = False):
+        """
+        config holds the settings that change the output (a checkpoint taken with other settings is not
+        resumed) and state the tool's running counters, which are restored along with the input offset.
+        """
+        self.tool = tool
+        self.output_paths = list(output_paths)
+        self.checkpoint_file = checkpoint_path(self.output_paths[0])
+        self.fingerprint = {
+            "tool": tool,
+            "inputs": [_input_fingerprint(path) for path in input_paths],
+            "outputs": [os.path.abspath(path) for path in self.output_paths],
+            "config": config or {},
+        }
+        self.interval = interval
+        self.offset = 0
+        self.state = dict(state or {})
+        self.checkpoints = 0
+        self._sizes = {}
+        self._outputs = {}
+        self._committed = False
+
+        saved = None if restart else self._load()
+        self.resumed = saved is not None
+        if saved is not None:
+            self.offset = saved["offset"]
+            self.state.update(saved["state"])
+            self._sizes = saved["outputs"]
+            print(f"Resuming {tool} from its checkpoint at input offset {self.offset}")
+        else:
+            self._clear()
+        self._last_save = time.monotonic()
+
+    def _load(self):
+        try:
+            with open(self.checkpoint_file) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get("fingerprint") != json.loads(json.dumps(self.fingerprint)):
+            print(f"Ignoring the checkpoint in {self.checkpoint_file}, it was taken with other inputs or settings")
+            return None
+        for path, size in saved["outputs"].items():
+            if isinstance(size, dict):
+                parts = _ParquetParts(path)
+                complete = all(os.path.exists(parts.part_path(index)) for index in range(size["parts"]))
+            else:
+                complete = os.path.exists(partial_path(path)) and os.path.getsize(partial_path(path)) >= size
+            if not complete:
+                print(f"Ignoring the checkpoint in {self.checkpoint_file}, the partial output of {path} is incomplete")
+                return None
+        return saved
+
+    def _clear(self):
+        _remove(self.checkpoint_file)
+        for path in self.output_paths:
+            _remove(partial_path(path))
+            _ParquetParts(path).remove_parts()
+
+    def open_text(self, path: str, compression_level: int = None) -> IO:
+        """Opens an output for writing text (compressed from its extension), positioned at the checkpoint."""
+        partial = partial_path(path)
+        if os.path.abspath(path) in self._sizes:
+            os.truncate(partial, self._sizes[os.path.abspath(path)])
+            f = open_file(partial, 'a', compression_level)
+        else:
+            f = open_file(partial, 'w', compression_level)
+        self._outputs[path] = f
+        return f
+
+    def open_parquet(self, path: str, schema: Optional[pa.Schema] = None) -> BatchWriter:
+        """Opens a Parquet output for writing record batches, positioned at the checkpoint."""
+        writer = _ParquetParts(path, schema, self._sizes.get(os.path.abspath(path), {}).get("parts", 0))
+        writer.remove_parts(writer.parts)
+        self._outputs[path] = writer
+        return writer
+
+    def advance(self, offset: int):
+        """Records that the input was processed up to offset, checkpointing when the interval is up."""
+        self.offset = offset
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        """Flushes the outputs to disk and saves the checkpoint."""
+        sizes = {}
+        for path, output in self._outputs.items():
+            if isinstance(output, _ParquetParts):
+                sizes[os.path.abspath(path)] = {"parts": output.sync()}
+            else:
+                sync_file(output)
+                sizes[os.path.abspath(path)] = os.path.getsize(partial_path(path))
+
+        checkpoint = {"fingerprint": self.fingerprint, "offset": self.offset, "state": self.state, "outputs": sizes}
+        temporary = self.checkpoint_file + ".tmp"
+        with open(temporary, 'w') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_file)
+        _fsync_directory(self.checkpoint_file)
+        self.checkpoints += 1
+        self._last_save = time.monotonic()
+
+    def commit(self):
+        """Closes the outputs, renames them to their final paths and removes the checkpoint."""
+        for path, output in self._outputs.items():
+            if isinstance(output, _ParquetParts):
+                output.commit()
+            else:
+                sync_file(output)
+                output.close()
+                os.replace(partial_path(path), path)
+        for path in self.output_paths:
+            _fsync_directory(path)
+        _remove(self.checkpoint_file)
+        self._committed = True
+
+    def close(self):
+        """Closes the outputs of an unfinished run, leaving them and the checkpoint to resume from."""
+        if not self._committed:
+            for output in self._outputs.values():
+                output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
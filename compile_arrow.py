@@ -0,0 +1,208 @@
+"""
+Arrow Working Format Compiler
+
+Compiles a JSONL, CSV or Parquet dataset once into an Arrow IPC (Feather v2) file, the working format for
+repeated analysis. The 'messages' column is stored typed, as a list of role/content structs (other message
+fields are kept after them), and the file is left uncompressed so tools memory-map it and use its buffers
+in place: later passes start at once and never decode JSON again.
+
+The analysis tools read .arrow files directly: validate_jsonl.py, check_message_order.py,
+convert_format_and_count_tokens.py, extract_random_samples.py and filter_csv_columns.py (see batch_io.py
+and jsonl_executor.py for the readers).
+
+JSONL files are parsed block by block with Arrow's JSON reader against the schema of their first rows,
+one block per worker process. A block that does not fit that schema (a wider value, a field or message
+field that first appears later) is parsed with its own types and widens the schema of the file, nothing is
+cast lossily (see batch_io.py). Messages stored as JSON strings (e.g. in a CSV written by
+convert_file_format.py) are parsed into the typed column.
+
+Only flat ChatML rows are compiled: rows whose 'messages' is not a list of messages, such as the nested
+{"messages": {"messages": [...]}} layout of transform_dataset.py, are rejected before they are written,
+and the partial output file is removed.
+
+Usage: python compile_arrow.py <input_file> <output_file> [--workers <workers>] [--batch_size <batch_size>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input_file: Path to the input file (JSONL, CSV, or Parquet, JSONL and CSV may be compressed)
+- output_file: Path to save the Arrow IPC file (.arrow or .feather)
+- workers: Optional number of worker processes parsing JSONL blocks (default: 1)
+- batch_size: Optional number of rows the schema is inferred from and rows per record batch of CSV and Parquet inputs (default: 10000)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python compile_arrow.py train.jsonl.zst train.arrow --workers 16
+python validate_jsonl.py train.arrow --schema chatml
+python check_message_order.py train.arrow --counts_only --workers 16
+
+Input JSONL Example:
+{"id": 7, "messages": [{"role": "user", "content": "Hello"}, {"content": "Hi there!", "role": "assistant"}]}
+
+Output Arrow Schema:
+id: int64
+messages: list<item: struct<role: string, content: string>>
+"""
+
+import argparse
+import io
+import json
+import os
+from functools import partial
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+
+from batch_io import DEFAULT_BATCH_SIZE, ArrowBatchWriter, detect_format, iter_record_batches, rows_to_batch
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_blocks, split_lines
+
+MESSAGE_TYPE = pa.struct([("role", pa.string()), ("content", pa.string())])
+MESSAGES_TYPE = pa.list_(MESSAGE_TYPE)
+
+
+def normalize_messages(column, json_strings: bool = False) -> pa.Array:
+    """
+    Returns a messages column as a list of role/content structs, any other message fields following them.
+    With json_strings, a column of strings is parsed as JSON first. Columns of any other layout (e.g. the
+    nested {"messages": {"messages": [...]}}) are returned as they are, see check_messages_type.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if json_strings and (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+        column = pa.array([None if text is None else json.loads(text) for text in column.to_pylist()])
+    if pa.types.is_null(column.type):
+        return pa.nulls(len(column), MESSAGES_TYPE)
+    if not (pa.types.is_list(column.type) or pa.types.is_large_list(column.type)) \
+            or not pa.types.is_struct(column.type.value_type):
+        return column
+
+    values = column.flatten()
+    names = [field.name for field in column.type.value_type]
+    fields = []
+    for name in ("role", "content"):
+        fields.append((name, pc.struct_field(values, name).cast(pa.string()) if name in names
+                       else pa.nulls(len(values), pa.string())))
+    fields += [(name, pc.struct_field(values, name)) for name in names if name not in ("role", "content")]
+    messages = pa.StructArray.from_arrays([array for _, array in fields], names=[name for name, _ in fields],
+                                          mask=values.is_null())
+
+    lengths = pc.fill_null(pc.list_value_length(column), 0).cast(pa.int32())
+    offsets = pa.concat_arrays([pa.array([0], pa.int32()), pc.cumulative_sum(lengths)])
+    return pa.ListArray.from_arrays(offsets, messages, mask=column.is_null())
+
+
+def normalize_batch(batch: pa.RecordBatch, json_strings: bool = False) -> pa.RecordBatch:
+    """Returns the batch with its messages column (if any) in the typed working layout."""
+    if "messages" not in batch.schema.names:
+        return batch
+    index = batch.schema.get_field_index("messages")
+    return batch.set_column(index, "messages", normalize_messages(batch.column(index), json_strings))
+
+
+def batch_messages(batch: pa.RecordBatch, fields=("role", "content")) -> List[Optional[List[Dict]]]:
+    """
+    Returns the messages of each row of a batch as lists of dicts of the given fields (None for a null
+    row), reading just those fields of the typed column.
+    """
+    messages = batch.column("messages")
+    values = messages.flatten()
+    columns = [pc.struct_field(values, name).to_pylist() for name in fields]
+    lengths = pc.fill_null(pc.list_value_length(messages), 0).to_numpy()
+    is_null = messages.is_null().to_numpy(zero_copy_only=False)
+    rows = []
+    position = 0
+    for length, null in zip(lengths.tolist(), is_null.tolist()):
+        rows.append(None if null else [dict(zip(fields, items))
+                                       for items in zip(*(column[position:position + length] for column in columns))])
+        position += length
+    return rows
+
+
+def parse_jsonl_block(data, schema):
+    """Returns the record batches of a block of JSONL lines parsed against the schema."""
+    try:
+        table = pa_json.read_json(
+            io.BytesIO(data),
+            read_options=pa_json.ReadOptions(use_threads=False, block_size=len(data) + 1),
+            parse_options=pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior="error"))
+    except pa.ArrowInvalid:
+        # e.g. fields that are missing from the first rows or values wider than their type, the writer widens
+        # the schema of the file to the types of this block
+        rows = [json.loads(line) for line in split_lines(data) if line.strip()]
+        return [normalize_batch(rows_to_batch(rows))] if rows else []
+    return [normalize_batch(batch) for batch in table.to_batches() if batch.num_rows]
+
+
+def check_messages_type(schema: pa.Schema):
+    """Raises unless the messages column of a schema (if any) is a list of messages, the flat ChatML layout."""
+    if "messages" not in schema.names:
+        return
+    messages = schema.field("messages").type
+    if pa.types.is_struct(messages) and messages.get_field_index("messages") >= 0:
+        raise ValueError("Rows hold the nested {\"messages\": {\"messages\": [...]}} layout, only flat ChatML rows "
+                         "with a list of messages can be compiled")
+    if not (pa.types.is_list(messages) or pa.types.is_large_list(messages)) \
+            or not pa.types.is_struct(messages.value_type):
+        raise ValueError(f"Rows hold 'messages' that are not lists of messages, they cannot be stored as the "
+                         f"typed messages column ({messages})")
+
+
+def compile_arrow(input_file, output_file, workers=1, batch_size=DEFAULT_BATCH_SIZE, metrics=None):
+    metrics = metrics or Metrics("compile_arrow", [input_file], unit="rows")
+    input_format = detect_format(input_file)
+    if input_format == "arrow":
+        raise ValueError(f"{input_file} is already an Arrow IPC file")
+
+    try:
+        with ArrowBatchWriter(output_file) as writer:
+            if input_format == "jsonl":
+                # The schema of the first rows, with the typed messages column, is what every block is parsed to
+                with metrics.phase("read"):
+                    first = next(iter_record_batches(input_file, input_format, batch_size), None)
+                if first is not None:
+                    schema = normalize_batch(first).schema
+                    check_messages_type(schema)
+                    results = map_blocks(input_file, partial(parse_jsonl_block, schema=schema), workers,
+                                         on_range=metrics.add_bytes)
+                    for batches in metrics.timed(results, "parse"):
+                        with metrics.phase("write"):
+                            for batch in batches:
+                                check_messages_type(batch.schema)
+                                writer.write_batch(batch)
+                        metrics.add(rows=sum(batch.num_rows for batch in batches))
+            else:
+                for batch in metrics.timed(iter_record_batches(input_file, input_format, batch_size), "read"):
+                    with metrics.phase("parse"):
+                        # CSV files hold nested values as JSON strings (see batch_io.py)
+                        batch = normalize_batch(batch, input_format == "csv")
+                        check_messages_type(batch.schema)
+                    with metrics.phase("write"):
+                        writer.write_batch(batch)
+                    metrics.add(rows=batch.num_rows)
+    except BaseException:
+        for path in (output_file, output_file + ".narrow"):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    print(f"Compiled {writer.rows_written} rows into {output_file}")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a JSONL, CSV or Parquet dataset into an Arrow IPC file")
+    parser.add_argument(
+        "input_file", help="Path to input file (JSONL, CSV, or Parquet)")
+    parser.add_argument(
+        "output_file", help="Path to save the Arrow IPC file (.arrow or .feather)")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes parsing JSONL blocks")
+    parser.add_argument(
+        "--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows the schema is inferred from, and rows per record batch of CSV and Parquet inputs")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("compile_arrow", [args.input_file], args.metrics_out, args.profile, unit="rows")
+    compile_arrow(args.input_file, args.output_file, args.workers, args.batch_size, metrics)
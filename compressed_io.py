@@ -0,0 +1,472 @@
+"""
+Compressed File I/O
+
+Opens plain, gzip, zstd, xz and bzip2 files through one call, so every tool reads and writes compressed
+datasets (e.g. train.jsonl.zst, train.jsonl.gz, table.csv.gz) directly, without decompressing them to
+disk first.
+
+- Reading picks the codec from the magic bytes at the start of the file (falling back to the extension)
+- Writing picks the codec from the extension: .gz/.bgz, .zst/.zstd, .xz, .bz2
+- Data streams through the codec in large buffered blocks
+
+Compressed outputs are written as a series of independent frames compressed in a thread pool: BGZF blocks
+for gzip (as written by bgzip, readable by any gzip reader), zstd frames, and concatenated xz and bzip2
+streams. bgzip files and zstd files whose frames are at most 64 MB (such as the ones written here) are
+decompressed frame by frame in a thread pool as well. Other files are decompressed in a background
+thread, so decompression overlaps with the parsing done by the tool.
+
+Example:
+from compressed_io import open_file
+
+with open_file("train.jsonl.zst") as f:
+    for line in f:
+        ...
+
+with open_file("output.jsonl.gz", "w", compression_level=9) as f:
+    f.write(line)
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Callable, Iterator, Optional, Tuple
+
+import pyarrow as pa
+
+COMPRESSIONS = ("gzip", "zstd", "xz", "bz2")
+
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip",
+    ".bgz": "gzip",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+    ".xz": "xz",
+    ".bz2": "bz2",
+}
+
+MAGIC_BYTES = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"BZh", "bz2"),
+)
+
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3, "xz": 6, "bz2": 9}
+
+DEFAULT_THREADS = os.cpu_count() or 1
+BUFFER_SIZE = 1 << 20
+DEFAULT_BLOCK_BYTES = 8 << 20
+
+# Frames decoded in one piece by the thread pool; zstd files with larger frames are streamed instead
+MAX_FRAME_BYTES = 64 << 20
+
+BGZF_BLOCK_SIZE = 65280
+BGZF_HEADER = struct.Struct("<4sIBBHBBHH")  # magic and flags, mtime, xfl, os, xlen, 'B', 'C', slen, block size - 1
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def compression_from_extension(path: str) -> Optional[str]:
+    """Returns the codec implied by the last extension of path, or None for uncompressed files."""
+    return COMPRESSION_EXTENSIONS.get(Path(path).suffix.lower())
+
+
+def strip_compression_extension(path: str) -> str:
+    """Returns path without its compression extension, e.g. train.jsonl for train.jsonl.zst."""
+    if compression_from_extension(path) is None:
+        return path
+    return str(Path(path).with_suffix(""))
+
+
+def detect_compression(path: str) -> Optional[str]:
+    """Returns the codec of an existing file from its magic bytes, or from its extension if it has none."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(8)
+    except OSError:
+        head = b""
+    if not head:
+        return compression_from_extension(path)
+    for magic, compression in MAGIC_BYTES:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def is_compressed(path: str) -> bool:
+    return detect_compression(path) is not None
+
+
+def add_compression_arguments(parser):
+    """Adds the --compression_level option shared by the tools writing JSONL, CSV or text files."""
+    parser.add_argument(
+        "--compression_level", type=int,
+        help="Compression level of compressed outputs (.gz, .zst, .xz, .bz2), defaults to the codec's default")
+
+
+def open_file(path: str, mode: str = 'r', compression_level: int = None, threads: int = None,
+              encoding: str = 'utf-8', errors: str = None, newline: str = None) -> IO:
+    """
+    Opens a plain or compressed file like open(), in text mode unless mode contains 'b'.
+
+    mode is one of 'r', 'w', 'a' or 'x', plus 'b' or 't'. compression_level only applies to compressed
+    outputs, and threads (default: one per core) bounds the threads used by the codec.
+    """
+    binary = 'b' in mode
+    base_mode = mode.replace('b', '').replace('t', '')
+    if base_mode not in ('r', 'w', 'a', 'x'):
+        raise ValueError(f"Unsupported mode: {mode}")
+    threads = threads or DEFAULT_THREADS
+
+    compression = detect_compression(path) if base_mode == 'r' else compression_from_extension(path)
+    if compression is None:
+        if binary:
+            return open(path, base_mode + 'b', buffering=BUFFER_SIZE)
+        return open(path, base_mode, buffering=BUFFER_SIZE, encoding=encoding, errors=errors, newline=newline)
+
+    fileobj = open(path, base_mode + 'b', buffering=BUFFER_SIZE)
+    if base_mode == 'r':
+        stream = io.BufferedReader(_open_reader(fileobj, compression, threads), BUFFER_SIZE)
+    else:
+        stream = io.BufferedWriter(_open_writer(fileobj, compression, compression_level, threads), BUFFER_SIZE)
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding, errors=errors, newline=newline)
+
+
+def iter_line_blocks(path: str, block_bytes: int = DEFAULT_BLOCK_BYTES,
+                     threads: int = None) -> Iterator[Tuple[bytes, int]]:
+    """
+    Yields the decompressed content of a file in blocks of about block_bytes that end on a line boundary,
+    each with the number of bytes of the file read since the previous block.
+    """
+    threads = threads or DEFAULT_THREADS
+    compression = detect_compression(path)
+    fileobj = open(path, 'rb', buffering=BUFFER_SIZE)
+    if compression is None:
+        stream = fileobj
+    else:
+        stream = io.BufferedReader(_open_reader(fileobj, compression, threads), BUFFER_SIZE)
+
+    with stream:
+        position = 0
+        while True:
+            data = stream.read(block_bytes)
+            if not data:
+                break
+            if not data.endswith(b"\n"):
+                data += stream.readline()
+            # Read-ahead makes this approximate for compressed files, the total is still exact
+            consumed = fileobj.tell() - position
+            position += consumed
+            yield data, consumed
+        if os.path.getsize(path) > position:
+            yield b"", os.path.getsize(path) - position
+
+
+def sync_file(f: IO):
+    """
+    Flushes a file opened for writing by open_file all the way to disk. Compressed files end their current
+    frame first, so the file can be cut at its current size and appended to later (see checkpoint.py).
+    """
+    f.flush()
+    raw = getattr(getattr(f, 'buffer', f), 'raw', None)
+    if isinstance(raw, _FrameWriter):
+        raw.flush()
+    os.fsync(f.fileno())
+
+
+def _open_reader(fileobj, compression, threads):
+    if compression == "gzip":
+        if _is_bgzf(fileobj.peek(BGZF_HEADER.size)) and threads > 1:
+            return _FrameReader(fileobj, _read_bgzf_block, _inflate_bgzf_block, threads)
+        return _PrefetchReader(gzip.GzipFile(fileobj=fileobj, mode='rb'), fileobj)
+    if compression == "zstd":
+        head = fileobj.peek(18)
+        content_size = _zstd_content_size(head) if head.startswith(ZSTD_MAGIC) else None
+        if content_size is not None and content_size <= MAX_FRAME_BYTES and threads > 1:
+            return _FrameReader(fileobj, _read_zstd_frame, _decompress_zstd_frame, threads)
+        return _PrefetchReader(pa.CompressedInputStream(fileobj, "zstd"), fileobj)
+    if compression == "xz":
+        return _PrefetchReader(lzma.LZMAFile(fileobj, 'rb'), fileobj)
+    if compression == "bz2":
+        return _PrefetchReader(bz2.BZ2File(fileobj, 'rb'), fileobj)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+def _open_writer(fileobj, compression, compression_level, threads):
+    level = DEFAULT_LEVELS[compression] if compression_level is None else compression_level
+    if compression == "gzip":
+        return _FrameWriter(fileobj, lambda data: _deflate_bgzf_block(data, level), BGZF_BLOCK_SIZE, threads,
+                            trailer=BGZF_EOF)
+    if compression == "zstd":
+        codec = pa.Codec("zstd", compression_level=level)
+        return _FrameWriter(fileobj, lambda data: codec.compress(data, asbytes=True), 4 << 20, threads)
+    if compression == "xz":
+        return _FrameWriter(fileobj, lambda data: lzma.compress(data, preset=level), 16 << 20, threads)
+    if compression == "bz2":
+        return _FrameWriter(fileobj, lambda data: bz2.compress(data, level), 8 << 20, threads)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+class _PrefetchReader(io.RawIOBase):
+    """Reads a decompressing stream in a background thread, a few blocks ahead of the reader."""
+
+    def __init__(self, stream, fileobj, depth: int = 4):
+        self.stream = stream
+        self.fileobj = fileobj
+        self._queue = queue.Queue(depth)
+        self._stop = threading.Event()
+        self._block = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            while not self._stop.is_set():
+                block = self.stream.read(BUFFER_SIZE)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._block:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._block = memoryview(item)
+        size = min(len(buffer), len(self._block))
+        buffer[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self.stream.close()
+            self.fileobj.close()
+        super().close()
+
+
+class _FrameReader(io.RawIOBase):
+    """Decompresses the independent frames of a file in a thread pool, one batch of frames ahead."""
+
+    def __init__(self, fileobj, read_frame: Callable, decode_frame: Callable, threads: int):
+        self.fileobj = fileobj
+        self.read_frame = read_frame
+        self.decode_frame = decode_frame
+        self.frames_per_batch = threads * 4
+        self._executor = ThreadPoolExecutor(threads)
+        self._chunks = self._iter_chunks()
+        self._chunk = memoryview(b"")
+
+    def _read_batch(self):
+        frames = []
+        while len(frames) < self.frames_per_batch:
+            frame = self.read_frame(self.fileobj)
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
+
+    def _iter_chunks(self):
+        pending = self._executor.map(self.decode_frame, self._read_batch())
+        while True:
+            frames = self._read_batch()
+            following = self._executor.map(self.decode_frame, frames) if frames else None
+            yield b"".join(pending)
+            if following is None:
+                return
+            pending = following
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(cancel_futures=True)
+            self.fileobj.close()
+        super().close()
+
+
+class _FrameWriter(io.RawIOBase):
+    """Compresses fixed-size frames in a thread pool and writes them out in order."""
+
+    def __init__(self, fileobj, encode_frame: Callable, frame_size: int, threads: int, trailer: bytes = b""):
+        self.fileobj = fileobj
+        self.encode_frame = encode_frame
+        self.frame_size = frame_size
+        self.trailer = trailer
+        self.max_pending = threads * 2
+        self._executor = ThreadPoolExecutor(threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self.frame_size:
+            end = len(self._buffer) - len(self._buffer) % self.frame_size
+            with memoryview(self._buffer) as view:
+                for start in range(0, end, self.frame_size):
+                    self._submit(bytes(view[start:start + self.frame_size]))
+            del self._buffer[:end]
+        return len(data)
+
+    def _submit(self, frame):
+        self._pending.append(self._executor.submit(self.encode_frame, frame))
+        while len(self._pending) > self.max_pending:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def flush(self):
+        """Ends the current frame and writes out every frame, so the file can be cut (and appended to) here."""
+        if not self.closed and not self.fileobj.closed:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+            self.fileobj.flush()
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.flush()
+                self.fileobj.write(self.trailer)
+            finally:
+                self._executor.shutdown(cancel_futures=True)
+                self.fileobj.close()
+        super().close()
+
+
+def _is_bgzf(header):
+    return (len(header) >= BGZF_HEADER.size and header.startswith(b"\x1f\x8b\x08\x04")
+            and header[10:16] == b"\x06\x00BC\x02\x00")
+
+
+def _read_bgzf_block(f):
+    header = f.read(BGZF_HEADER.size)
+    if not header:
+        return None
+    if not _is_bgzf(header):
+        raise ValueError("Not a BGZF block, the gzip file mixes bgzip blocks with regular gzip members")
+    block_size = BGZF_HEADER.unpack(header)[-1] + 1
+    return header + f.read(block_size - BGZF_HEADER.size)
+
+
+def _inflate_bgzf_block(block):
+    data = zlib.decompress(block[BGZF_HEADER.size:-8], -15)
+    crc, size = struct.unpack("<II", block[-8:])
+    if zlib.crc32(data) != crc or len(data) != size:
+        raise ValueError("Corrupt BGZF block: CRC or size mismatch")
+    return data
+
+
+def _deflate_bgzf_block(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    body = compressor.compress(data) + compressor.flush()
+    header = BGZF_HEADER.pack(b"\x1f\x8b\x08\x04", 0, 0, 255, 6, 66, 67, 2, len(body) + BGZF_HEADER.size + 8 - 1)
+    return header + body + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def _zstd_header(descriptor):
+    """Returns (header size after the descriptor byte, frame content size field size, has checksum)."""
+    single_segment = descriptor >> 5 & 1
+    fcs_size = (single_segment, 2, 4, 8)[descriptor >> 6]
+    dict_id_size = (0, 1, 2, 4)[descriptor & 3]
+    return (1 - single_segment) + dict_id_size + fcs_size, fcs_size, descriptor >> 2 & 1
+
+
+def _zstd_content_size(frame):
+    """Returns the decompressed size recorded in a zstd frame header, or None if it is not recorded."""
+    descriptor = frame[4]
+    header_size, fcs_size, _ = _zstd_header(descriptor)
+    if not fcs_size:
+        return None
+    start = 5 + header_size - fcs_size
+    content_size = int.from_bytes(frame[start:start + fcs_size], 'little')
+    return content_size + 256 if fcs_size == 2 else content_size
+
+
+def _read_zstd_frame(f):
+    magic = f.read(4)
+    if not magic:
+        return None
+    # Skippable frames (e.g. pzstd's frame size hints) carry no data
+    if magic[1:] == b"\x2a\x4d\x18" and magic[0] & 0xF0 == 0x50:
+        f.read(int.from_bytes(f.read(4), 'little'))
+        return b""
+    if magic != ZSTD_MAGIC:
+        raise ValueError("Not a zstd frame")
+
+    descriptor = f.read(1)
+    header_size, _, has_checksum = _zstd_header(descriptor[0])
+    parts = [magic, descriptor, f.read(header_size)]
+    # Walk the block headers to find the end of the frame without decompressing it
+    while True:
+        block_header = f.read(3)
+        value = int.from_bytes(block_header, 'little')
+        block_type = value >> 1 & 3
+        parts.append(block_header)
+        parts.append(f.read(1 if block_type == 1 else value >> 3))
+        if value & 1:
+            break
+    if has_checksum:
+        parts.append(f.read(4))
+    return b"".join(parts)
+
+
+def _decompress_zstd_frame(frame):
+    if not frame:
+        return b""
+    content_size = _zstd_content_size(frame)
+    if content_size is None or content_size > MAX_FRAME_BYTES:
+        return pa.CompressedInputStream(pa.BufferReader(frame), "zstd").read()
+    return pa.Codec("zstd").decompress(frame, decompressed_size=content_size, asbytes=True)
@@ -3,16 +3,41 @@ Dataset Conversion Tool
 
 Converts 'conversations' to 'messages' in datasets, supporting local JSONL and Hugging Face formats.
 
-Usage: python convert_dataset.py <input> <output>
+The dataset is converted and written one batch at a time, so memory stays flat however large it is.
+Hugging Face datasets are read as Arrow batches (from the local cache, or downloaded as they are consumed
+with --streaming) and their conversations column is converted over a whole batch at once; local JSONL files
+are converted block by block. Batches are spread over worker processes with --workers.
+
+The output only appears once the whole dataset was converted, and an interrupted run carries on from its
+last checkpoint when it is rerun.
+
+Usage: python convert_dataset.py <input> <output> [--streaming] [--workers <workers>] [--batch_size <batch_size>] [--checkpoint_interval <seconds>] [--restart] [--shard_rows <rows>] [--shard_bytes <size>] [--splits <splits>] [--split_key <column>] [--split_seed <seed>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
 
 Input: Local JSONL file or Hugging Face dataset name
 Output: Converted JSONL file
+Streaming: Optional flag to stream a Hugging Face dataset instead of downloading and caching it first
+Workers: Optional number of worker processes (default: 1)
+Batch Size: Optional number of rows of a Hugging Face dataset converted per batch (default: 10000)
+Checkpoint Interval: Optional seconds between checkpoints, an interrupted run resumes from its last checkpoint when rerun (default: 60, see checkpoint.py)
+Restart: Optional flag to ignore the checkpoint of an interrupted run and start over
+Shard Rows: Optional maximum number of rows per output shard, writes numbered shards and a manifest instead of a single file, without checkpoints (see sharded_writer.py)
+Shard Bytes: Optional maximum size of each output shard before compression (e.g. 512MB)
+Splits: Optional split fractions, each row is assigned by a stable hash (e.g. train=0.98,val=0.01,test=0.01)
+Split Key: Optional field hashed to assign splits (default: the whole row)
+Split Seed: Optional seed mixed into the split hash
+Compression Level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+Metrics Out: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+Profile: Optional path prefix to save cProfile stats of each phase
 
 Example: 
 # For local file
 python convert_dataset.py input.jsonl output.jsonl
 # For Hugging Face dataset
 python convert_dataset.py username/dataset_name output.jsonl
+# For a large Hugging Face dataset, without caching it locally
+python convert_dataset.py username/dataset_name output.jsonl.zst --streaming --workers 16
+# Into train/val shards of at most 1GB each
+python convert_dataset.py username/dataset_name out/data.jsonl.zst --streaming --shard_bytes 1GB --splits train=0.99,val=0.01
 
 Before:
 {
@@ -35,24 +60,37 @@ After:
 import json
 import argparse
 import os
+from functools import partial
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from datasets import load_dataset
 
+from batch_io import encode_jsonl
+from checkpoint import DEFAULT_INTERVAL, ResumableRun, add_checkpoint_arguments
+from compressed_io import add_compression_arguments
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_blocks, map_items, split_lines
+from sharded_writer import ShardedWriter, add_shard_arguments, shard_options
+
+ROLE_MAPPING = {
+    "system": "system",
+    "human": "user",
+    "gpt": "assistant"
+}
+DEFAULT_BATCH_SIZE = 10000
 
-def convert_conversation(conversation):
-    role_mapping = {
-        "system": "system",
-        "human": "user",
-        "gpt": "assistant"
-    }
 
+def convert_conversation(conversation):
     if isinstance(conversation, list):
         return {
-            "role": role_mapping.get(conversation[0], conversation[0]),
+            "role": ROLE_MAPPING.get(conversation[0], conversation[0]),
             "content": conversation[1]
         }
     elif isinstance(conversation, dict):
         return {
-            "role": role_mapping.get(conversation.get("from"), conversation.get("from")),
+            "role": ROLE_MAPPING.get(conversation.get("from"), conversation.get("from")),
             "content": conversation.get("value")
         }
     else:
@@ -73,32 +111,133 @@ def process_dataset(data):
     return data
 
 
-def convert_dataset(input_path, output_path):
-    if os.path.isfile(input_path):
-        # Load local file
-        with open(input_path, 'r', encoding='utf-8') as f:
-            data = [json.loads(line) for line in f]
+def map_roles(speakers):
+    roles = speakers
+    for speaker, role in ROLE_MAPPING.items():
+        if speaker != role:
+            roles = pc.if_else(pc.equal(speakers, speaker), role, roles)
+    return roles
+
+
+def convert_conversations_array(conversations):
+    """
+    convert_conversation over a whole array of conversations, either lists of from/value structs or lists
+    of [from, value] pairs. Returns None for any other type, which has to be converted row by row.
+    """
+    if not pa.types.is_list(conversations.type):
+        return None
+    flat = conversations.flatten()
+    item_type = conversations.type.value_type
+    if pa.types.is_struct(item_type) and item_type.get_field_index("from") >= 0 and item_type.get_field_index("value") >= 0:
+        speakers, content = pc.struct_field(flat, "from"), pc.struct_field(flat, "value")
+    elif pa.types.is_list(item_type) and pa.types.is_string(item_type.value_type):
+        speakers, content = pc.list_element(flat, 0), pc.list_element(flat, 1)
     else:
+        return None
+    if not pa.types.is_string(speakers.type):
+        return None
+
+    messages = pa.StructArray.from_arrays([map_roles(speakers), content], names=["role", "content"])
+    lengths = pc.fill_null(pc.list_value_length(conversations), 0).to_numpy()
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+    return pa.ListArray.from_arrays(pa.array(offsets), messages, mask=conversations.is_null())
+
+
+def convert_table(table):
+    """Returns (JSONL text, row count) of a converted table of rows."""
+    messages = None
+    if "conversations" in table.column_names:
+        messages = convert_conversations_array(table.column("conversations").combine_chunks())
+    if messages is None:
+        # Nested or irregular conversations go through process_dataset one row at a time
+        lines = [json.dumps(process_dataset(row), ensure_ascii=False) + '\n' for row in table.to_pylist()]
+        return "".join(lines), len(lines)
+    table = table.drop_columns(["conversations"]).append_column("messages", messages)
+    return encode_jsonl(table, ensure_ascii=False), table.num_rows
+
+
+def convert_dataset_range(dataset, bounds):
+    start, stop = bounds
+    return convert_table(dataset.with_format("arrow")[start:stop])
+
+
+def convert_block(data):
+    """Returns (JSONL text, row count) of a block of JSONL lines, empty lines are skipped."""
+    lines = [json.dumps(process_dataset(json.loads(line)), ensure_ascii=False) + '\n'
+             for line in split_lines(data) if line.strip()]
+    return "".join(lines), len(lines)
+
+
+def convert_results(input_path, dataset, streaming, workers, batch_size, start=0, on_offset=None, on_range=None):
+    """
+    Yields (JSONL text, row count) of each converted batch, starting at the byte offset start of a local
+    file (dataset is None) or at the row start of a Hugging Face dataset.
+    """
+    if dataset is None:
+        # Local file, converted block by block
+        return map_blocks(input_path, convert_block, workers, on_range=on_range, start=start, on_offset=on_offset)
+    if streaming:
+        # Batches are downloaded and decoded lazily, only the batches in flight are held in memory
+        batches = dataset.skip(start).with_format("arrow").iter(batch_size=batch_size)
+        return map_items(convert_table, batches, workers)
+    # Each worker reads its own rows from the memory-mapped Arrow cache
+    ranges = ((row, min(row + batch_size, len(dataset))) for row in range(start, len(dataset), batch_size))
+    return map_items(partial(convert_dataset_range, dataset), ranges, workers)
+
+
+def convert_dataset(input_path, output_path, streaming=False, workers=1, batch_size=DEFAULT_BATCH_SIZE,
+                    checkpoint_interval=DEFAULT_INTERVAL, restart=False, shards=None, compression_level=None,
+                    metrics=None):
+    metrics = metrics or Metrics("convert_dataset", [input_path])
+    local = os.path.isfile(input_path)
+    dataset = None
+    if not local:
         # Try loading as a Hugging Face dataset
         try:
-            dataset = load_dataset(input_path, split="train")
-            data = [item for item in dataset]
+            with metrics.phase("read"):
+                dataset = load_dataset(input_path, split="train", streaming=streaming)
         except Exception as e:
             print(f"Error loading dataset: {e}")
             return
 
-    converted_data = [process_dataset(item) for item in data]
-
     # Create the directory if it doesn't exist
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-    # Save the converted data
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for item in converted_data:
-            json.dump(item, f, ensure_ascii=False)
-            f.write('\n')
+    if shards:
+        # Sharded outputs are written in one go, without checkpoints
+        results = convert_results(input_path, dataset, streaming, workers, batch_size, on_range=metrics.add_bytes)
+        with ShardedWriter(output_path, "jsonl", compression_level, **shards) as writer:
+            for text, count in metrics.timed(results, "transform"):
+                with metrics.phase("write"):
+                    writer.write_jsonl(text)
+                metrics.add(rows=count)
+        print(f"Converted {writer.rows_written} rows, saved as shards listed in {writer.manifest_path}")
+        metrics.finish()
+        return
 
-    print(f"Converted dataset saved to {output_path}")
+    # The checkpointed offset is in bytes of a local file and in rows of a Hugging Face dataset
+    with ResumableRun("convert_dataset", [input_path], [output_path], state={"rows": 0},
+                      interval=checkpoint_interval, restart=restart) as run:
+        counts = run.state
+        results = convert_results(input_path, dataset, streaming, workers, batch_size, run.offset,
+                                  run.advance if local else None, metrics.add_bytes)
+
+        # Save the converted data as each batch is done
+        f = run.open_text(output_path, compression_level)
+        for text, count in metrics.timed(results, "transform"):
+            with metrics.phase("write"):
+                f.write(text)
+            counts["rows"] += count
+            metrics.add(rows=count)
+            if not local:
+                run.advance(counts["rows"])
+
+        with metrics.phase("write"):
+            run.commit()
+
+    print(f"Converted {counts['rows']} rows, saved to {output_path}")
+    metrics.finish()
 
 
 if __name__ == "__main__":
@@ -107,6 +246,18 @@ if __name__ == "__main__":
         "input_path", help="Path to input dataset (local file or Hugging Face dataset)")
     parser.add_argument(
         "output_path", help="Path to save the converted dataset")
+    parser.add_argument(
+        "--streaming", action="store_true", help="Stream the Hugging Face dataset instead of downloading and caching it first")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument(
+        "--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows of a Hugging Face dataset converted per batch")
+    add_checkpoint_arguments(parser)
+    add_shard_arguments(parser)
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    convert_dataset(args.input_path, args.output_path)
+    metrics = Metrics("convert_dataset", [args.input_path], args.metrics_out, args.profile)
+    convert_dataset(args.input_path, args.output_path, args.streaming, args.workers, args.batch_size,
+                    args.checkpoint_interval, args.restart, shard_options(args), args.compression_level, metrics)
@@ -3,18 +3,33 @@ File Format Converter
 
 Converts between CSV, JSONL, and Parquet formats.
 
-Usage: python convert_file_format.py <input_file> <output_file> <conversion_type>
+Files are streamed as record batches (Parquet row groups, CSV blocks, JSONL line blocks), so memory stays
+flat whatever the file size. Nested values (e.g. 'messages' lists) are written to CSV as JSON strings.
+
+Usage: python convert_file_format.py <input_file> <output_file> <conversion_type> [--batch_size <batch_size>] [--shard_rows <rows>] [--shard_bytes <size>] [--splits <splits>] [--split_key <column>] [--split_seed <seed>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
 
 Input:
 - input_file: Path to the input file (CSV, JSONL, or Parquet)
 - output_file: Path to save the converted file (CSV, JSONL, or Parquet)
-- conversion_type: Type of conversion ('csv_to_jsonl', 'parquet_to_jsonl', 'jsonl_to_parquet', 'jsonl_to_csv')
+- conversion_type: Type of conversion ('csv_to_jsonl', 'parquet_to_jsonl', 'jsonl_to_parquet', 'jsonl_to_csv', 'parquet_to_csv', 'csv_to_parquet')
+- batch_size: Optional number of rows per record batch (default: 10000)
+- shard_rows: Optional maximum number of rows per output shard, writes numbered shards and a manifest instead of a single file (see sharded_writer.py)
+- shard_bytes: Optional maximum size of each output shard before compression (e.g. 512MB)
+- splits: Optional split fractions, each row is assigned by a stable hash (e.g. train=0.98,val=0.01,test=0.01)
+- split_key: Optional column hashed to assign splits (default: the whole row)
+- split_seed: Optional seed mixed into the split hash
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
 
 Example:
 python convert_file_format.py input.csv output.jsonl csv_to_jsonl
 python convert_file_format.py input.parquet output.jsonl parquet_to_jsonl
 python convert_file_format.py input.jsonl output.parquet jsonl_to_parquet
 python convert_file_format.py input.jsonl output.csv jsonl_to_csv
+python convert_file_format.py input.parquet output.csv parquet_to_csv
+python convert_file_format.py input.csv output.parquet csv_to_parquet
+python convert_file_format.py input.parquet out/train.jsonl.zst parquet_to_jsonl --shard_bytes 512MB --splits train=0.98,val=0.01,test=0.01 --split_key id
 
 Input CSV Example:
 column1,column2
@@ -34,90 +49,53 @@ column1,column2
 value1,value2
 """
 
-import pandas as pd
-import json
-from pathlib import Path
-import numpy as np
 import argparse
+from batch_io import DEFAULT_BATCH_SIZE, iter_record_batches, open_batch_writer
+from compressed_io import add_compression_arguments
+from instrumentation import Metrics, add_metrics_arguments
+from sharded_writer import ShardedWriter, add_shard_arguments, shard_options
+
+FORMAT_NAMES = {'csv': 'CSV', 'jsonl': 'JSONL', 'parquet': 'Parquet'}
+
+CONVERSION_TYPES = ['csv_to_jsonl', 'parquet_to_jsonl', 'jsonl_to_parquet', 'jsonl_to_csv', 'parquet_to_csv', 'csv_to_parquet']
+
+def convert_file(input_file, output_file, input_format, output_format, batch_size=DEFAULT_BATCH_SIZE,
+                 shards=None, compression_level=None, metrics=None):
+    metrics = metrics or Metrics("convert_file_format", [input_file], unit="rows")
+    # Stream record batches from the reader straight into the writer
+    if shards:
+        writer = ShardedWriter(output_file, output_format, compression_level, **shards)
+    else:
+        writer = open_batch_writer(output_file, output_format, compression_level)
+    with writer:
+        for batch in metrics.timed(iter_record_batches(input_file, input_format, batch_size), "read"):
+            with metrics.phase("write"):
+                writer.write_batch(batch)
+            metrics.add(rows=batch.num_rows)
+
+    if shards:
+        print(f"Conversion complete. {FORMAT_NAMES[output_format]} shards listed in {writer.manifest_path}")
+    else:
+        print(f"Conversion complete. {FORMAT_NAMES[output_format]} file saved as {output_file}")
+    metrics.finish()
+
+def csv_to_jsonl(input_file, output_file, batch_size=DEFAULT_BATCH_SIZE):
+    convert_file(input_file, output_file, 'csv', 'jsonl', batch_size)
 
-def numpy_to_python(obj):
-    if isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, pd.Timestamp):
-        return obj.isoformat()
-    return obj
-
-def csv_to_jsonl(input_file, output_file):
-    # Read the CSV file
-    df = pd.read_csv(input_file)
-
-    # Open the output file in write mode
-    with open(output_file, 'w') as f:
-        # Iterate over each row in the DataFrame
-        for _, row in df.iterrows():
-            # Convert the row to a dictionary, handling NumPy types
-            row_dict = {k: numpy_to_python(v)
-                        for k, v in row.to_dict().items()}
-            # Convert to JSON string
-            json_str = json.dumps(row_dict)
-            # Write the JSON string to the file, followed by a newline
-            f.write(json_str + '\n')
-
-    print(f"Conversion complete. JSONL file saved as {output_file}")
-
-def parquet_to_jsonl(input_file, output_file):
-    # Read the Parquet file
-    df = pd.read_parquet(input_file)
-
-    # Open the output file in write mode
-    with open(output_file, 'w') as f:
-        # Iterate over each row in the DataFrame
-        for _, row in df.iterrows():
-            # Convert the row to a dictionary, handling NumPy types
-            row_dict = {k: numpy_to_python(v)
-                        for k, v in row.to_dict().items()}
-            # Convert to JSON string
-            json_str = json.dumps(row_dict)
-            # Write the JSON string to the file, followed by a newline
-            f.write(json_str + '\n')
-
-    print(f"Conversion complete. JSONL file saved as {output_file}")
-
-def jsonl_to_parquet(input_file, output_file):
-    # Read the JSONL file
-    with open(input_file, 'r') as f:
-        lines = f.readlines()
-
-    # Convert each line to a dictionary
-    data = [json.loads(line) for line in lines]
-
-    # Convert the list of dictionaries to a DataFrame
-    df = pd.DataFrame(data)
-
-    # Write the DataFrame to a Parquet file
-    df.to_parquet(output_file, index=False)
-
-    print(f"Conversion complete. Parquet file saved as {output_file}")
-
-def jsonl_to_csv(input_file, output_file):
-    # Read the JSONL file
-    with open(input_file, 'r') as f:
-        lines = f.readlines()
-
-    # Convert each line to a dictionary
-    data = [json.loads(line) for line in lines]
-
-    # Convert the list of dictionaries to a DataFrame
-    df = pd.DataFrame(data)
-
-    # Write the DataFrame to a CSV file
-    df.to_csv(output_file, index=False)
-
-    print(f"Conversion complete. CSV file saved as {output_file}")
+def parquet_to_jsonl(input_file, output_file, batch_size=DEFAULT_BATCH_SIZE):
+    convert_file(input_file, output_file, 'parquet', 'jsonl', batch_size)
+
+def jsonl_to_parquet(input_file, output_file, batch_size=DEFAULT_BATCH_SIZE):
+    convert_file(input_file, output_file, 'jsonl', 'parquet', batch_size)
+
+def jsonl_to_csv(input_file, output_file, batch_size=DEFAULT_BATCH_SIZE):
+    convert_file(input_file, output_file, 'jsonl', 'csv', batch_size)
+
+def parquet_to_csv(input_file, output_file, batch_size=DEFAULT_BATCH_SIZE):
+    convert_file(input_file, output_file, 'parquet', 'csv', batch_size)
+
+def csv_to_parquet(input_file, output_file, batch_size=DEFAULT_BATCH_SIZE):
+    convert_file(input_file, output_file, 'csv', 'parquet', batch_size)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert between CSV, JSONL, and Parquet formats")
@@ -126,14 +104,15 @@ if __name__ == "__main__":
     parser.add_argument(
         "output_file", help="Path to save the converted file (CSV, JSONL, or Parquet)")
     parser.add_argument(
-        "conversion_type", choices=['csv_to_jsonl', 'parquet_to_jsonl', 'jsonl_to_parquet', 'jsonl_to_csv'], help="Type of conversion")
+        "conversion_type", choices=CONVERSION_TYPES, help="Type of conversion")
+    parser.add_argument(
+        "--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Number of rows per record batch")
+    add_shard_arguments(parser)
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    if args.conversion_type == 'csv_to_jsonl':
-        csv_to_jsonl(args.input_file, args.output_file)
-    elif args.conversion_type == 'parquet_to_jsonl':
-        parquet_to_jsonl(args.input_file, args.output_file)
-    elif args.conversion_type == 'jsonl_to_parquet':
-        jsonl_to_parquet(args.input_file, args.output_file)
-    elif args.conversion_type == 'jsonl_to_csv':
-        jsonl_to_csv(args.input_file, args.output_file)
+    input_format, output_format = args.conversion_type.split('_to_')
+    metrics = Metrics("convert_file_format", [args.input_file], args.metrics_out, args.profile, unit="rows")
+    convert_file(args.input_file, args.output_file, input_format, output_format, args.batch_size,
+                 shard_options(args), args.compression_level, metrics)
@@ -3,11 +3,20 @@ JSONL to Text Converter
 
 Converts a JSONL file to a text file with a specific format.
 
-Usage: python convert_jsonl_to_text.py <input_file> <output_file>
+Rows are rendered through a chat template (see chat_templates.py), the KTO Query/Response/Label layout by
+default, in worker processes, and written back in file order one block at a time. Lines that are not
+valid JSON or lack a field of the template are skipped and reported.
+
+Usage: python convert_jsonl_to_text.py <input_file> <output_file> [--template <template>] [--workers <workers>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
 
 Input:
 - input_file: Path to the input JSONL file
 - output_file: Path to save the converted text file
+- template: Optional built-in template name or path to a JSON template file (default: kto)
+- workers: Optional number of worker processes (default: 1)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
 
 Example:
 python convert_jsonl_to_text.py preferences_kto.jsonl preferences_kto.txt
@@ -21,23 +30,14 @@ Response: I am an AI assistant.
 Label: true
 """
 
-import json
 import argparse
+from chat_templates import render_templates
+from compressed_io import add_compression_arguments
+from instrumentation import Metrics, add_metrics_arguments
 
-def convert_jsonl_to_text(input_file, output_file):
-    # Open the output file in write mode
-    with open(output_file, 'w') as output_file:
-        # Read the JSONL file
-        with open(input_file, 'r') as input_file:
-            for line in input_file:
-                data = json.loads(line)
-
-                # Convert to desired format
-                formatted_output = f"Query: {data['query']}\nResponse: {data['response']}\nLabel: {data['label']}\n\n"
-
-                # Write the formatted output to the file
-                output_file.write(formatted_output)
-
+def convert_jsonl_to_text(input_file, output_file, workers=1, template="kto", compression_level=None, metrics=None):
+    metrics = metrics or Metrics("convert_kto_jsonl_to_txt", [input_file])
+    render_templates(input_file, {template: output_file}, workers, compression_level, metrics)
     print(f"Conversion complete. Output saved to {output_file}")
 
 if __name__ == "__main__":
@@ -46,6 +46,13 @@ if __name__ == "__main__":
         "input_file", help="Path to input JSONL file")
     parser.add_argument(
         "output_file", help="Path to save the converted text file")
+    parser.add_argument(
+        "--template", default="kto", help="Built-in template name or path to a JSON template file")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    convert_jsonl_to_text(args.input_file, args.output_file)
\ No newline at end of file
+    metrics = Metrics("convert_kto_jsonl_to_txt", [args.input_file], args.metrics_out, args.profile)
+    convert_jsonl_to_text(args.input_file, args.output_file, args.workers, args.template, args.compression_level, metrics)
@@ -0,0 +1,367 @@
+"""
+Preference Data Converter
+
+Converts preference datasets between the KTO, DPO and ChatML layouts, working on whole Arrow record batches:
+
+- dpo_to_kto: every prompt/chosen/rejected row becomes two query/response/label rows, the chosen response
+  labeled true and the rejected one false
+- kto_to_dpo: query/response/label rows are grouped by query, and desirable and undesirable responses to
+  the same query are paired into prompt/chosen/rejected rows
+- chatml_to_kto, chatml_to_dpo: the last assistant message of each conversation is the response and the
+  user message before it the query (or the whole conversation before it rendered through a chat template,
+  see chat_templates.py), labeled by a 'label' field or --label, then grouped as above for DPO
+
+With the zip pairing, the n-th desirable response to a query is paired with its n-th undesirable response
+(in input order) and the rest are left unpaired, with the all pairing every desirable response is paired
+with every undesirable one.
+
+Grouping is a hash join: query/response/label rows are spilled to hash-partitioned Arrow files on disk, and
+each partition is read back and paired on its own with Arrow's join, so datasets larger than RAM can be
+grouped as long as one partition fits (raise --partitions otherwise). DPO rows come out one partition after
+another, in input order within each partition. Rows without the fields a conversion needs are skipped and
+counted.
+
+Arrow files are read without decoding any JSON (see compile_arrow.py), the fastest input for large sets.
+
+Usage: python convert_preferences.py <input_file> <output_file> <conversion_type> [--pairing <pairing>] [--prompt_template <template>] [--label <label>] [--batch_size <batch_size>] [--partitions <partitions>] [--tmp_dir <tmp_dir>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input_file: Path to the input file (JSONL, CSV, Parquet, or Arrow)
+- output_file: Path to save the converted file (JSONL, CSV, Parquet, or Arrow)
+- conversion_type: Type of conversion ('dpo_to_kto', 'kto_to_dpo', 'chatml_to_kto', 'chatml_to_dpo')
+- pairing: Optional 'zip' or 'all', how responses to the same query are paired into DPO rows (default: zip)
+- prompt_template: Optional built-in template name or path to a JSON template file the messages before the last assistant message are rendered with into the query of ChatML rows (default: the content of the last user message)
+- label: Optional 'true' or 'false', the label of ChatML rows without a 'label' field (default: true)
+- batch_size: Optional number of rows per record batch (default: 10000)
+- partitions: Optional number of partitions rows are spilled to when grouping (default: 64)
+- tmp_dir: Optional directory for the spill files (default: system temp directory)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python convert_preferences.py preferences_dpo.jsonl preferences_kto.jsonl dpo_to_kto
+python convert_preferences.py preferences_kto.arrow preferences_dpo.parquet kto_to_dpo --partitions 256
+python convert_preferences.py rated_chats.jsonl preferences_dpo.jsonl chatml_to_dpo --prompt_template chatml
+
+Input DPO Example:
+{"prompt": "What is your name?", "chosen": "I am an AI assistant.", "rejected": "None of your business."}
+
+Input KTO Example:
+{"query": "What is your name?", "response": "I am an AI assistant.", "label": true}
+{"query": "What is your name?", "response": "None of your business.", "label": false}
+
+Input ChatML Example:
+{"messages": [{"role": "user", "content": "What is your name?"}, {"role": "assistant", "content": "I am an AI assistant."}], "label": true}
+"""
+
+import argparse
+import os
+import tempfile
+import zlib
+from typing import Iterator, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from batch_io import DEFAULT_BATCH_SIZE, detect_format, iter_record_batches, open_batch_writer
+from chat_templates import get_template
+from compile_arrow import batch_messages, normalize_batch
+from compressed_io import add_compression_arguments
+from instrumentation import Metrics, add_metrics_arguments
+
+CONVERSION_TYPES = ['dpo_to_kto', 'kto_to_dpo', 'chatml_to_kto', 'chatml_to_dpo']
+PAIRINGS = ['zip', 'all']
+DEFAULT_PARTITIONS = 64
+
+KTO_COLUMNS = ["query", "response", "label"]
+DPO_COLUMNS = ["prompt", "chosen", "rejected"]
+KTO_SCHEMA = pa.schema([("query", pa.string()), ("response", pa.string()), ("label", pa.bool_())])
+NUMBER_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)(e[+-]?\d+)?$"
+
+
+def partitions_of(column, num_partitions: int) -> np.ndarray:
+    """Returns the partition of every string of a column, from a CRC-32 of its bytes that is stable across runs."""
+    values = column.cast(pa.large_binary()).to_pylist()
+    return (np.fromiter(map(zlib.crc32, values), dtype=np.uint32, count=len(values)) % num_partitions).astype(np.int64)
+
+
+class BatchSpill:
+    """Appends tables to hash-partitioned Arrow stream files on disk, keeping the order of rows within each partition."""
+
+    def __init__(self, directory, schema, num_partitions=DEFAULT_PARTITIONS):
+        self.schema = schema
+        self.num_partitions = num_partitions
+        self.paths = [os.path.join(directory, f"partition-{i:04d}.arrows") for i in range(num_partitions)]
+        self.writers = {}
+
+    def write(self, table: pa.Table, partitions: np.ndarray):
+        order = np.argsort(partitions, kind="stable")
+        table = table.take(order)
+        bounds = np.searchsorted(partitions[order], np.arange(self.num_partitions + 1))
+        for partition in np.flatnonzero(np.diff(bounds)).tolist():
+            if partition not in self.writers:
+                self.writers[partition] = pa.ipc.new_stream(self.paths[partition], self.schema)
+            start, end = bounds[partition], bounds[partition + 1]
+            self.writers[partition].write_table(table.slice(start, end - start))
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def partitions(self) -> Iterator[pa.Table]:
+        """Yields the table of each partition written to, one at a time."""
+        for partition in sorted(self.writers):
+            with pa.memory_map(self.paths[partition]) as source:
+                yield pa.ipc.open_stream(source).read_all()
+
+
+def normalize_labels(column) -> pa.Array:
+    """Returns a label column as booleans, from booleans, numbers (non-zero is true) or strings of either.
+
+    Files mixing booleans and numbers are read with a string label column (see batch_io.py), holding
+    'true'/'false' next to numbers such as '0' or '1.0'.
+    """
+    if pa.types.is_boolean(column.type):
+        return column
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+        return pc.not_equal(column, 0)
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        labels = pc.utf8_lower(pc.utf8_trim_whitespace(column))
+        numeric = pc.match_substring_regex(labels, NUMBER_PATTERN)
+        numbers = pc.not_equal(pc.cast(pc.if_else(numeric, labels, "0"), pa.float64()), 0)
+        words = pc.if_else(pc.is_in(labels, value_set=pa.array(["true", "false"])), pc.equal(labels, "true"),
+                           pa.scalar(None, pa.bool_()))
+        return pc.if_else(numeric, numbers, words)
+    if pa.types.is_null(column.type):
+        return pa.nulls(len(column), pa.bool_())
+    raise ValueError(f"Unsupported label type {column.type}, expected booleans, numbers or 'true'/'false' strings")
+
+
+def _text_column(batch, name):
+    column = batch.column(name)
+    if pa.types.is_null(column.type):
+        return pa.nulls(len(column), pa.string())
+    if not (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+        raise ValueError(f"Column '{name}' holds {column.type}, expected text")
+    return column.cast(pa.string())
+
+
+def _valid_rows(table):
+    valid = pc.and_(pc.and_(pc.is_valid(table["query"]), pc.is_valid(table["response"])), pc.is_valid(table["label"]))
+    return table.filter(valid)
+
+
+def _require_columns(batch, columns):
+    missing = [column for column in columns if column not in batch.schema.names]
+    if missing:
+        raise ValueError(f"Missing columns {missing}, found {batch.schema.names}")
+
+
+def dpo_to_kto_batch(batch: pa.RecordBatch) -> pa.Table:
+    """Returns the KTO rows of a batch of DPO rows, the chosen row of each pair followed by its rejected row."""
+    _require_columns(batch, DPO_COLUMNS)
+    prompts = _text_column(batch, "prompt")
+    count = batch.num_rows
+    table = pa.Table.from_arrays([
+        pa.concat_arrays([prompts, prompts]),
+        pa.concat_arrays([_text_column(batch, "chosen"), _text_column(batch, "rejected")]),
+        pa.concat_arrays([pa.repeat(True, count), pa.repeat(False, count)]).cast(pa.bool_()),
+    ], schema=KTO_SCHEMA)
+    # Interleave, so each chosen row is followed by its rejected row
+    return _valid_rows(table.take(np.arange(2 * count).reshape(2, count).T.ravel()))
+
+
+def kto_batch(batch: pa.RecordBatch) -> pa.Table:
+    """Returns a batch of KTO rows in the working layout, rows with a missing field dropped."""
+    _require_columns(batch, KTO_COLUMNS)
+    table = pa.Table.from_arrays([_text_column(batch, "query"), _text_column(batch, "response"),
+                                  normalize_labels(batch.column("label"))], schema=KTO_SCHEMA)
+    return _valid_rows(table)
+
+
+def chatml_to_kto_batch(batch: pa.RecordBatch, prompt_template: Optional[str] = None,
+                        label: bool = True) -> pa.Table:
+    """
+    Returns the KTO rows of a batch of ChatML rows: the last assistant message is the response and the user
+    message before it the query, or with prompt_template, every message before it rendered. Rows that do
+    not end in a user and an assistant message are dropped.
+    """
+    _require_columns(batch, ["messages"])
+    messages = batch.column("messages")
+    if pa.types.is_null(messages.type):
+        return KTO_SCHEMA.empty_table()
+    values = messages.flatten()
+    roles = pc.struct_field(values, "role")
+    contents = pc.struct_field(values, "content")
+
+    # Positions of the last two messages of each row in the flattened message values
+    lengths = pc.fill_null(pc.list_value_length(messages), 0).to_numpy()
+    last = np.cumsum(lengths) - 1
+    valid = lengths >= 2
+    last_index = pa.array(np.where(valid, last, 0))
+    previous_index = pa.array(np.where(valid, last - 1, 0))
+    if len(values):
+        valid &= pc.fill_null(pc.and_(pc.equal(roles.take(last_index), "assistant"),
+                                      pc.equal(roles.take(previous_index), "user")), False).to_numpy(zero_copy_only=False)
+    mask = pa.array(valid)
+    if not valid.any():
+        return KTO_SCHEMA.empty_table()
+
+    responses = contents.take(pa.array(last[valid]))
+    if prompt_template is None:
+        queries = contents.take(pa.array(last[valid] - 1))
+    else:
+        template = get_template(prompt_template)
+        queries = pa.array([template.render({"messages": rows[:-1]})
+                            for rows, keep in zip(batch_messages(batch), valid) if keep], pa.string())
+    if "label" in batch.schema.names:
+        labels = normalize_labels(batch.column("label")).filter(mask)
+    else:
+        labels = pa.repeat(label, int(valid.sum())).cast(pa.bool_())
+    table = pa.Table.from_arrays([queries.cast(pa.string()), responses.cast(pa.string()), labels], schema=KTO_SCHEMA)
+    return _valid_rows(table)
+
+
+def pair_partition(table: pa.Table, pairing: str = "zip") -> pa.Table:
+    """
+    Returns the DPO rows of a table of KTO rows in input order, pairing desirable and undesirable responses
+    to the same query with a hash join, ordered by the position of the chosen response. The '_chosen' and
+    '_rejected' columns hold the positions of the paired rows in the table.
+    """
+    # Join on integer codes of the queries rather than on the strings
+    codes = pc.dictionary_encode(table["query"]).combine_chunks().indices.to_numpy()
+    labels = table["label"].to_numpy()
+    positions = np.arange(len(table))
+    columns = {"_query": codes, "_position": positions}
+    if pairing == "zip":
+        # Rank the responses of each query and label in input order, rank n pairs with rank n
+        order = np.lexsort((positions, labels, codes))
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = (codes[order][1:] != codes[order][:-1]) | (labels[order][1:] != labels[order][:-1])
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+        columns["_rank"] = ranks
+
+    keys = [name for name in columns if name != "_position"]
+    indices = pa.table(columns)
+    desirable = indices.filter(pa.array(labels)).rename_columns(
+        ["_chosen" if name == "_position" else name for name in columns])
+    undesirable = indices.filter(pa.array(~labels)).rename_columns(
+        ["_rejected" if name == "_position" else name for name in columns])
+    pairs = desirable.join(undesirable, keys=keys, join_type="inner", use_threads=False)
+    pairs = pairs.sort_by([("_chosen", "ascending"), ("_rejected", "ascending")])
+    return pa.table({
+        "prompt": table["query"].take(pairs["_chosen"]),
+        "chosen": table["response"].take(pairs["_chosen"]),
+        "rejected": table["response"].take(pairs["_rejected"]),
+        "_chosen": pairs["_chosen"],
+        "_rejected": pairs["_rejected"],
+    })
+
+
+def convert_preferences(input_file, output_file, conversion_type, pairing="zip", prompt_template=None, label=True,
+                        batch_size=DEFAULT_BATCH_SIZE, partitions=DEFAULT_PARTITIONS, tmp_dir=None,
+                        compression_level=None, metrics=None):
+    metrics = metrics or Metrics("convert_preferences", [input_file], unit="rows")
+    if conversion_type not in CONVERSION_TYPES:
+        raise ValueError(f"Unsupported conversion type: {conversion_type}")
+    source, target = conversion_type.split('_to_')
+    if prompt_template is not None:
+        # Compile up front so a bad template fails before any rows are read
+        get_template(prompt_template)
+
+    input_format = detect_format(input_file)
+    columns = {"dpo": DPO_COLUMNS, "kto": KTO_COLUMNS}.get(source)
+    counts = {"rows": 0, "skipped": 0}
+
+    def kto_tables():
+        for batch in metrics.timed(iter_record_batches(input_file, input_format, batch_size, columns), "read"):
+            metrics.add(rows=batch.num_rows)
+            with metrics.phase("convert"):
+                if source == "dpo":
+                    table = dpo_to_kto_batch(batch)
+                    counts["skipped"] += 2 * batch.num_rows - len(table)
+                elif source == "kto":
+                    table = kto_batch(batch)
+                    counts["skipped"] += batch.num_rows - len(table)
+                else:
+                    # CSV files hold nested values as JSON strings (see batch_io.py)
+                    table = chatml_to_kto_batch(normalize_batch(batch, input_format == "csv"), prompt_template, label)
+                    counts["skipped"] += batch.num_rows - len(table)
+            counts["rows"] += batch.num_rows
+            yield table
+
+    with open_batch_writer(output_file, compression_level=compression_level) as writer:
+        if target == "kto":
+            for table in kto_tables():
+                with metrics.phase("write"):
+                    for batch in table.to_batches():
+                        writer.write_batch(batch)
+            counts["kto_rows"] = writer.rows_written
+        else:
+            counts.update(kto_rows=0, pairs=0, unpaired=0)
+            with tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+                # Pass 1: spill the KTO rows to partitions by the hash of their query
+                spill = BatchSpill(directory, KTO_SCHEMA, partitions)
+                for table in kto_tables():
+                    with metrics.phase("spill"):
+                        counts["kto_rows"] += len(table)
+                        spill.write(table, partitions_of(table["query"], partitions))
+                spill.close()
+
+                # Pass 2: pair each partition on its own
+                for table in metrics.timed(spill.partitions(), "read_spill"):
+                    with metrics.phase("pair"):
+                        pairs = pair_partition(table, pairing)
+                        paired = pc.count_distinct(pairs["_chosen"]).as_py() + pc.count_distinct(pairs["_rejected"]).as_py()
+                        counts["unpaired"] += len(table) - paired
+                    with metrics.phase("write"):
+                        for batch in pairs.select(DPO_COLUMNS).combine_chunks().to_batches():
+                            writer.write_batch(batch)
+            counts["pairs"] = writer.rows_written
+
+    print(f"Converted {counts['rows']} rows ({counts['skipped']} skipped) into "
+          + (f"{counts['kto_rows']} KTO rows" if target == "kto"
+             else f"{counts['pairs']} DPO pairs from {counts['kto_rows']} responses ({counts['unpaired']} unpaired)"))
+    print(f"Converted preferences saved as {output_file}")
+    for name, count in counts.items():
+        metrics.count(name, count)
+    metrics.finish()
+    return counts
+
+
+def parse_label(value):
+    if value.lower() not in ("true", "false"):
+        raise argparse.ArgumentTypeError(f"Expected 'true' or 'false', got {value!r}")
+    return value.lower() == "true"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert preference data between KTO, DPO and ChatML")
+    parser.add_argument(
+        "input_file", help="Path to input file (JSONL, CSV, Parquet, or Arrow)")
+    parser.add_argument(
+        "output_file", help="Path to save the converted file (JSONL, CSV, Parquet, or Arrow)")
+    parser.add_argument(
+        "conversion_type", choices=CONVERSION_TYPES, help="Type of conversion")
+    parser.add_argument(
+        "--pairing", choices=PAIRINGS, default="zip", help="Pair the n-th responses of a query (zip) or every desirable with every undesirable one (all)")
+    parser.add_argument(
+        "--prompt_template", help="Chat template the messages before the last assistant message are rendered with into the query")
+    parser.add_argument(
+        "--label", type=parse_label, default=True, help="Label of ChatML rows without a 'label' field")
+    parser.add_argument(
+        "--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Number of rows per record batch")
+    parser.add_argument(
+        "--partitions", type=int, default=DEFAULT_PARTITIONS, help="Number of partitions rows are spilled to when grouping")
+    parser.add_argument(
+        "--tmp_dir", help="Directory for the spill files")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("convert_preferences", [args.input_file], args.metrics_out, args.profile, unit="rows")
+    convert_preferences(args.input_file, args.output_file, args.conversion_type, args.pairing, args.prompt_template,
+                        args.label, args.batch_size, args.partitions, args.tmp_dir, args.compression_level, metrics)
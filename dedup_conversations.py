@@ -0,0 +1,361 @@
+"""
+Conversation Deduplicator
+
+Removes exact and near-duplicate conversations from a JSONL file in the 'messages' format.
+
+- exact: conversations whose normalized messages (role plus content, Unicode NFKC, lowercased,
+  whitespace collapsed) hash to the same digest
+- near: additionally, conversations whose MinHash signatures collide in at least one LSH band and whose
+  estimated Jaccard similarity over word shingles reaches the threshold
+
+Fingerprints are computed across worker processes in one streaming pass. Digests and band keys are
+spilled to hash-partitioned files on disk and grouped one partition at a time, and per-row bookkeeping
+lives in memory-mapped arrays, so datasets larger than RAM can be deduplicated. The first row of every
+cluster is kept. Lines that are not valid JSON are skipped, counted and listed in the cluster report.
+
+Usage: python dedup_conversations.py <input_file> <output_file> [--mode <mode>] [--threshold <threshold>] [--num_perm <num_perm>] [--bands <bands>] [--shingle_size <shingle_size>] [--report <report_file>] [--workers <workers>] [--tmp_dir <tmp_dir>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input_file: Path to the input JSONL file
+- output_file: Path to save the deduplicated JSONL file
+- mode: Optional 'exact' or 'near' (default: near, which also removes exact duplicates)
+- threshold: Optional estimated Jaccard similarity at which conversations count as near-duplicates (default: 0.8)
+- num_perm: Optional number of MinHash permutations (default: 128)
+- bands: Optional number of LSH bands, must divide num_perm (default: 16)
+- shingle_size: Optional number of words per shingle (default: 5)
+- report_file: Optional path to save the cluster report (default: <output_file>.report.jsonl)
+- workers: Optional number of worker processes (default: 1)
+- tmp_dir: Optional directory for the spill files (default: system temp directory)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python dedup_conversations.py merged.jsonl merged_dedup.jsonl --workers 32
+
+Cluster Report Example (one line per dropped row, rows are 1-based line numbers):
+{"line": 17, "kept_line": 3, "reason": "exact"}
+{"line": 942, "kept_line": 88, "reason": "near_duplicate", "similarity": 0.87}
+{"line": 1203, "reason": "invalid_json"}
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import unicodedata
+import zlib
+from functools import partial
+
+import numpy as np
+
+from compressed_io import add_compression_arguments, open_file
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_line_batches
+
+NUM_PARTITIONS = 64
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+EXACT_RECORD = np.dtype([("digest", "V16"), ("line", "<i8")])
+BAND_RECORD = np.dtype([("key", "<u8"), ("line", "<i8")])
+
+KEEP = 0
+EXACT = 1
+NEAR = 2
+INVALID = 3
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text):
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip().lower()
+
+
+def conversation_parts(data):
+    """Returns the normalized (role, content) pairs of a conversation."""
+    messages = data.get("messages") if isinstance(data, dict) else None
+    if isinstance(messages, dict):
+        messages = messages.get("messages")
+    if not isinstance(messages, list):
+        # Not a conversation, compare the whole record instead
+        return [("", normalize(json.dumps(data, sort_keys=True, ensure_ascii=False)))]
+    return [(str(message.get("role", "")), normalize(str(message.get("content") or "")))
+            for message in messages if isinstance(message, dict)]
+
+
+def exact_digest(parts):
+    payload = "\x1e".join(f"{role}\x1f{content}" for role, content in parts)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+
+def minhash_permutations(num_perm, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def band_multipliers(rows_per_band, seed=2):
+    return np.random.RandomState(seed).randint(1, 1 << 62, size=rows_per_band, dtype=np.uint64) | np.uint64(1)
+
+
+def minhash_signature(parts, shingle_size, a, b):
+    words = " ".join(content for _, content in parts).split()
+    if len(words) > shingle_size:
+        shingles = {" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+    else:
+        shingles = {" ".join(words)}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    permuted = (hashes[:, None] * a + b) % MERSENNE_PRIME & MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature, bands):
+    rows = signature.reshape(bands, -1).astype(np.uint64)
+    keys = (rows * band_multipliers(rows.shape[1])).sum(axis=1, dtype=np.uint64)
+    # Mix in the band number so equal values in different bands do not collide
+    return keys ^ (np.arange(bands, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15))
+
+
+def fingerprint_lines(lines, near, num_perm, bands, shingle_size):
+    """Returns (exact digest, signature, band keys) for each line, None for an empty line or 'invalid_json'."""
+    a, b = minhash_permutations(num_perm)
+    results = []
+    for line in lines:
+        if not line.strip():
+            results.append(None)
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            results.append('invalid_json')
+            continue
+        parts = conversation_parts(data)
+        digest = exact_digest(parts)
+        if near:
+            signature = minhash_signature(parts, shingle_size, a, b)
+            results.append((digest, signature.tobytes(), band_keys(signature, bands).tobytes()))
+        else:
+            results.append((digest, None, None))
+    return results
+
+
+class PartitionSpill:
+    """Appends fixed-size records to hash-partitioned files on disk."""
+
+    def __init__(self, directory, prefix, dtype):
+        self.dtype = dtype
+        self.paths = [os.path.join(directory, f"{prefix}-{i:03d}.bin") for i in range(NUM_PARTITIONS)]
+        self.files = [open(path, "wb") for path in self.paths]
+
+    def write(self, records, partitions):
+        order = np.argsort(partitions, kind="stable")
+        records = records[order]
+        bounds = np.searchsorted(partitions[order], np.arange(NUM_PARTITIONS + 1))
+        for partition in range(NUM_PARTITIONS):
+            start, end = bounds[partition], bounds[partition + 1]
+            if start < end:
+                records[start:end].tofile(self.files[partition])
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def partitions(self):
+        for path in self.paths:
+            yield np.fromfile(path, dtype=self.dtype)
+
+
+def find_root(parent, line):
+    root = line
+    while parent[root] != root:
+        root = parent[root]
+    # Path compression
+    while parent[line] != root:
+        parent[line], line = root, parent[line]
+    return root
+
+
+def dedup_conversations(input_file, output_file, mode="near", threshold=0.8, num_perm=128, bands=16,
+                        shingle_size=5, report_file=None, workers=1, tmp_dir=None, compression_level=None, metrics=None):
+    metrics = metrics or Metrics("dedup_conversations", [input_file])
+    if num_perm % bands:
+        raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm})")
+    near = mode == "near"
+    report_file = report_file or output_file + ".report.jsonl"
+    batch_func = partial(fingerprint_lines, near=near, num_perm=num_perm, bands=bands, shingle_size=shingle_size)
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+        exact_spill = PartitionSpill(directory, "exact", EXACT_RECORD)
+        band_spill = PartitionSpill(directory, "bands", BAND_RECORD)
+        signature_path = os.path.join(directory, "signatures.bin")
+        empty_signature = bytes(4 * num_perm)
+
+        # Pass 1: fingerprint every line and spill digests and band keys to disk
+        line_count = 0
+        pending = []
+        invalid_lines = []
+        with open(signature_path, "wb") as signature_file:
+            results = map_line_batches(input_file, batch_func, workers, on_range=metrics.add_bytes)
+            for line_number, result in metrics.timed(results, "fingerprint"):
+                line_count = line_number
+                if result == 'invalid_json':
+                    print(f"Skipping invalid JSON at line {line_number}")
+                    invalid_lines.append(line_number)
+                    result = None
+                if near:
+                    signature_file.write(result[1] if result else empty_signature)
+                if result is not None:
+                    pending.append((line_number, result))
+                if len(pending) >= 65536:
+                    with metrics.phase("spill"):
+                        _spill(pending, exact_spill, band_spill, near, bands)
+                    pending = []
+            with metrics.phase("spill"):
+                _spill(pending, exact_spill, band_spill, near, bands)
+        metrics.add(rows=line_count)
+        exact_spill.close()
+        band_spill.close()
+
+        with metrics.phase("cluster"):
+            # Per-line state, memory-mapped so it does not have to fit in RAM
+            shape = (line_count + 1,)
+            status = np.memmap(os.path.join(directory, "status.bin"), dtype=np.uint8, mode="w+", shape=shape)
+            kept_line = np.memmap(os.path.join(directory, "kept.bin"), dtype=np.int64, mode="w+", shape=shape)
+            status[invalid_lines] = INVALID
+
+            # Pass 2a: exact duplicates share a digest, keep the first line of each group
+            for records in exact_spill.partitions():
+                if not len(records):
+                    continue
+                records = records[np.lexsort((records["line"], records["digest"].view("S16")))]
+                digests = records["digest"].view("S16")
+                first = np.concatenate(([True], digests[1:] != digests[:-1]))
+                group_first = np.maximum.accumulate(np.where(first, np.arange(len(records)), 0))
+                duplicates = ~first
+                status[records["line"][duplicates]] = EXACT
+                kept_line[records["line"][duplicates]] = records["line"][group_first[duplicates]]
+
+            similarity = np.memmap(os.path.join(directory, "similarity.bin"), dtype=np.float32, mode="w+", shape=shape)
+            if near and line_count:
+                signatures = np.memmap(signature_path, dtype=np.uint32, mode="r", shape=(line_count, num_perm))
+                parent = np.memmap(os.path.join(directory, "parent.bin"), dtype=np.int64, mode="w+", shape=shape)
+                parent[:] = np.arange(line_count + 1)
+
+                # Pass 2b: rows sharing a band key are candidates, verified against the threshold
+                for records in band_spill.partitions():
+                    if not len(records):
+                        continue
+                    records = records[status[records["line"]] == KEEP]
+                    records = records[np.lexsort((records["line"], records["key"]))]
+                    keys = records["key"]
+                    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+                    ends = np.append(starts[1:], len(records))
+                    for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+                        lines = records["line"][start:end]
+                        anchor = int(lines[0])
+                        estimates = (signatures[lines[1:] - 1] == signatures[anchor - 1]).mean(axis=1)
+                        for line, estimate in zip(lines[1:], estimates):
+                            if estimate < threshold:
+                                continue
+                            root_a, root_b = find_root(parent, anchor), find_root(parent, int(line))
+                            if root_a != root_b:
+                                parent[max(root_a, root_b)] = min(root_a, root_b)
+                            similarity[line] = max(similarity[line], estimate)
+
+                for line in np.flatnonzero(similarity).tolist():
+                    root = find_root(parent, line)
+                    if root != line:
+                        status[line] = NEAR
+                        kept_line[line] = root
+
+        # Pass 3: stream the input again, writing kept rows and the cluster report
+        counts = {"kept": 0, "exact": 0, "near_duplicate": 0, "invalid_json": 0, "empty": 0}
+        with metrics.phase("write"), open_file(input_file) as infile, \
+                open_file(output_file, "w", compression_level) as outfile, \
+                open_file(report_file, "w", compression_level) as report:
+            for line_number, line in enumerate(infile, 1):
+                if not line.strip():
+                    counts["empty"] += 1
+                elif status[line_number] == KEEP:
+                    outfile.write(line if line.endswith("\n") else line + "\n")
+                    counts["kept"] += 1
+                elif status[line_number] == EXACT:
+                    report.write(json.dumps({"line": line_number, "kept_line": int(kept_line[line_number]),
+                                             "reason": "exact"}) + "\n")
+                    counts["exact"] += 1
+                elif status[line_number] == INVALID:
+                    report.write(json.dumps({"line": line_number, "reason": "invalid_json"}) + "\n")
+                    counts["invalid_json"] += 1
+                else:
+                    # Similarity to the row this one was linked through, which may differ from the kept row
+                    report.write(json.dumps({"line": line_number, "kept_line": int(kept_line[line_number]),
+                                             "reason": "near_duplicate",
+                                             "similarity": round(float(similarity[line_number]), 4)}) + "\n")
+                    counts["near_duplicate"] += 1
+
+        del status, kept_line, similarity
+        if near and line_count:
+            del signatures, parent
+
+    print(f"Kept {counts['kept']} rows, dropped {counts['exact']} exact and {counts['near_duplicate']} near duplicates")
+    if counts["invalid_json"]:
+        print(f"Skipped {counts['invalid_json']} lines of invalid JSON")
+    print(f"Deduplicated dataset saved to {output_file}, cluster report saved to {report_file}")
+    for name, count in counts.items():
+        metrics.count(name, count)
+    metrics.finish()
+    return counts
+
+
+def _spill(pending, exact_spill, band_spill, near, bands):
+    if not pending:
+        return
+    lines = np.fromiter((line for line, _ in pending), dtype=np.int64, count=len(pending))
+
+    exact = np.empty(len(pending), dtype=EXACT_RECORD)
+    exact["digest"] = np.frombuffer(b"".join(result[0] for _, result in pending), dtype="V16")
+    exact["line"] = lines
+    exact_spill.write(exact, np.frombuffer(exact["digest"].tobytes(), dtype=np.uint8)[::16] % NUM_PARTITIONS)
+
+    if near:
+        keys = np.frombuffer(b"".join(result[2] for _, result in pending), dtype=np.uint64)
+        band_records = np.empty(len(keys), dtype=BAND_RECORD)
+        band_records["key"] = keys
+        band_records["line"] = np.repeat(lines, bands)
+        band_spill.write(band_records, (keys % np.uint64(NUM_PARTITIONS)).astype(np.int64))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove exact and near-duplicate conversations")
+    parser.add_argument(
+        "input_file", help="Path to input JSONL file")
+    parser.add_argument(
+        "output_file", help="Path to save the deduplicated JSONL file")
+    parser.add_argument(
+        "--mode", choices=["exact", "near"], default="near", help="Deduplication mode")
+    parser.add_argument(
+        "--threshold", type=float, default=0.8, help="Estimated Jaccard similarity for near-duplicates")
+    parser.add_argument(
+        "--num_perm", type=int, default=128, help="Number of MinHash permutations")
+    parser.add_argument(
+        "--bands", type=int, default=16, help="Number of LSH bands (must divide num_perm)")
+    parser.add_argument(
+        "--shingle_size", type=int, default=5, help="Number of words per shingle")
+    parser.add_argument(
+        "--report", help="Path to save the cluster report (default: <output_file>.report.jsonl)")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument(
+        "--tmp_dir", help="Directory for the spill files")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("dedup_conversations", [args.input_file], args.metrics_out, args.profile)
+    dedup_conversations(args.input_file, args.output_file, args.mode, args.threshold, args.num_perm, args.bands,
+                        args.shingle_size, args.report, args.workers, args.tmp_dir, args.compression_level, metrics)
@@ -1,23 +1,276 @@
-import datasets
+"""
+Random Sample Extractor
+
+Extracts a reproducible random sample from a local JSONL, Parquet or Arrow IPC file or a Hugging Face dataset in a
+single streaming pass. Sampling uses a reservoir (Algorithm L), so only the sampled rows are ever held in
+memory and JSONL lines are only parsed when they are picked.
+
+With --stratify_by, the sample is split across the values of the given field in proportion to how often
+they occur. The input is read twice: once to count the values, then to sample each value with a
+reservoir holding only its share. Nested fields use dots, with list positions as numbers
+(e.g. 'source' or 'messages.0.role').
+
+If a JSONL file has a fresh line index (see jsonl_index.py), unstratified samples are drawn from the
+index directly and only the sampled rows are read, regardless of the file's length. Arrow IPC files
+(see compile_arrow.py) are memory-mapped and sampled the same way: only the sampled rows are ever read.
+Both go through the same reservoir over the non-empty rows, so a seed picks the same sample with or
+without an index.
+
+Sampled rows are written in their original order.
+
+Usage: python extract_random_samples.py <input> <output_file> [--num_samples <num_samples>] [--seed <seed>] [--stratify_by <field>] [--split <split>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input: Local JSONL, Parquet or Arrow IPC file, or Hugging Face dataset name (loaded from the local cache)
+- output_file: Path to save the sampled rows as JSONL
+- num_samples: Optional number of rows to sample (default: 1000)
+- seed: Optional random seed (default: 42)
+- stratify_by: Optional field to stratify the sample by
+- split: Optional Hugging Face dataset split (default: train)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python extract_random_samples.py Kkordik/persona-based-chat-messages random_samples.jsonl --num_samples 1062
+python extract_random_samples.py train.jsonl sample.jsonl --num_samples 500 --stratify_by source
+"""
+
+import argparse
 import json
+import math
+import os
 import random
+from itertools import islice
+
+from batch_io import DEFAULT_BATCH_SIZE, detect_format, iter_record_batches, json_default, read_arrow_table
+from compressed_io import add_compression_arguments, open_file
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_index import JsonlIndex, is_index_fresh
+
+
+class Reservoir:
+    """Uniform sample of at most k items from a stream seen in batches (Algorithm L)."""
+
+    def __init__(self, k, rng):
+        self.k = k
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+        self.w = math.exp(math.log(rng.random()) / k) if k else 0.0
+        self.next_index = k + self._skip()
+
+    def _skip(self):
+        if not self.k:
+            return math.inf
+        return math.floor(math.log(self.rng.random()) / math.log(1 - self.w))
+
+    def picks(self, batch_size):
+        """Returns (position in batch, reservoir slot) for each item of the next batch that is kept."""
+        picks = []
+        start = self.seen
+        end = start + batch_size
+
+        # Fill the reservoir first
+        while len(self.items) + len(picks) < self.k and start + len(picks) < end:
+            picks.append((len(picks), len(self.items) + len(picks)))
+
+        while self.next_index < end:
+            picks.append((self.next_index - start, self.rng.randrange(self.k)))
+            self.w *= math.exp(math.log(self.rng.random()) / self.k)
+            self.next_index += self._skip() + 1
+
+        self.seen = end
+        return picks
+
+    def offer(self, batch_size, take):
+        """Keeps the picked items of the next batch, fetched with take(positions) -> list of items."""
+        picks = self.picks(batch_size)
+        if not picks:
+            return
+        taken = take([position for position, _ in picks])
+        for (_, slot), item in zip(picks, taken):
+            if slot == len(self.items):
+                self.items.append(item)
+            else:
+                self.items[slot] = item
+
+
+class JsonlBatch:
+    def __init__(self, lines):
+        self.lines = lines
+        self.num_rows = len(lines)
+
+    def take(self, positions):
+        return [self.lines[position].rstrip('\r\n') for position in positions]
+
+    def records(self):
+        return [json.loads(line) for line in self.lines]
+
+
+class ArrowBatch:
+    def __init__(self, batch):
+        self.batch = batch
+        self.num_rows = batch.num_rows
+
+    def take(self, positions):
+        return [json.dumps(row, default=json_default) for row in self.batch.take(positions).to_pylist()]
+
+    def column(self, name):
+        return self.batch.column(name).to_pylist()
+
+    def records(self):
+        return self.batch.to_pylist()
+
+
+def iter_batches(input_path, split="train", batch_size=DEFAULT_BATCH_SIZE):
+    if os.path.isfile(input_path):
+        if detect_format(input_path) == "jsonl":
+            with open_file(input_path) as f:
+                while True:
+                    lines = [line for line in islice(f, batch_size) if line.strip()]
+                    if not lines:
+                        break
+                    yield JsonlBatch(lines)
+        else:
+            for batch in iter_record_batches(input_path, batch_size=batch_size):
+                yield ArrowBatch(batch)
+    else:
+        from datasets import load_dataset
+
+        # Map-style datasets are memory-mapped from the local cache, so iterating them stays out of RAM
+        dataset = load_dataset(input_path, split=split).with_format("arrow")
+        for table in dataset.iter(batch_size=batch_size):
+            for batch in table.to_batches():
+                yield ArrowBatch(batch)
+
+
+def get_field(record, field):
+    value = record
+    for key in field.split('.'):
+        if isinstance(value, list):
+            value = value[int(key)] if -len(value) <= int(key) < len(value) else None
+        elif isinstance(value, dict):
+            value = value.get(key)
+        else:
+            return None
+    return value
+
+
+def field_values(batch, field):
+    if isinstance(batch, ArrowBatch) and '.' not in field and field in batch.batch.schema.names:
+        values = batch.column(field)
+    else:
+        values = [get_field(record, field) for record in batch.records()]
+    # Lists and dicts cannot be dictionary keys
+    return [json.dumps(value, sort_keys=True) if isinstance(value, (list, dict)) else value for value in values]
+
+
+def sample_rows(input_path, num_samples, seed=42, split="train", metrics=None):
+    """Returns (row index, JSON line) for a uniform sample of the non-empty rows of the dataset."""
+    metrics = metrics or Metrics("extract_random_samples", progress=False)
+    reservoir = Reservoir(num_samples, random.Random(seed))
+    if os.path.isfile(input_path) and detect_format(input_path) == "jsonl" and is_index_fresh(input_path):
+        with metrics.phase("sample"), JsonlIndex(input_path) as index:
+            rows = index.non_empty_rows()
+            reservoir.offer(len(rows), lambda positions: [(position, index.get_line(int(rows[position])))
+                                                          for position in positions])
+            return sorted(reservoir.items)
+    if os.path.isfile(input_path) and detect_format(input_path) == "arrow":
+        with metrics.phase("sample"):
+            table = read_arrow_table(input_path)
+            reservoir.offer(table.num_rows, lambda positions: take_numbered(ArrowBatch(table), positions, 0))
+            return sorted(reservoir.items)
+
+    total = 0
+    for batch in metrics.timed(iter_batches(input_path, split), "read"):
+        with metrics.phase("sample"):
+            reservoir.offer(batch.num_rows, lambda positions: take_numbered(batch, positions, total))
+        total += batch.num_rows
+        metrics.add(rows=batch.num_rows)
+    return sorted(reservoir.items)
+
+
+def sample_rows_stratified(input_path, num_samples, field, seed=42, split="train", metrics=None):
+    """Returns (row index, JSON line) for a sample split across the values of field in proportion to their counts."""
+    metrics = metrics or Metrics("extract_random_samples", progress=False)
+    counts = {}
+    for batch in metrics.timed(iter_batches(input_path, split), "read"):
+        with metrics.phase("count"):
+            for value in field_values(batch, field):
+                counts[value] = counts.get(value, 0) + 1
+
+    # Each stratum only keeps as many rows as it is allocated
+    rng = random.Random(seed)
+    reservoirs = {value: Reservoir(quota, rng) for value, quota in allocate(num_samples, counts).items()}
+    total = 0
+    for batch in metrics.timed(iter_batches(input_path, split), "read"):
+        with metrics.phase("sample"):
+            groups = {}
+            for position, value in enumerate(field_values(batch, field)):
+                groups.setdefault(value, []).append(position)
+            for value, positions in groups.items():
+                reservoirs[value].offer(len(positions), lambda picked: take_numbered(
+                    batch, [positions[p] for p in picked], total))
+        total += batch.num_rows
+        metrics.add(rows=batch.num_rows)
+
+    return sorted(sample for reservoir in reservoirs.values() for sample in reservoir.items)
+
+
+def take_numbered(batch, positions, first_index):
+    return list(zip((first_index + position for position in positions), batch.take(positions)))
+
+
+def allocate(num_samples, counts):
+    """Splits num_samples across strata in proportion to their counts (largest remainder method)."""
+    total = sum(counts.values())
+    if not total:
+        return {}
+    num_samples = min(num_samples, total)
+    exact = {value: num_samples * count / total for value, count in counts.items()}
+    quotas = {value: math.floor(share) for value, share in exact.items()}
+    by_remainder = sorted(exact, key=lambda value: exact[value] - quotas[value], reverse=True)
+    for value in by_remainder[:num_samples - sum(quotas.values())]:
+        quotas[value] += 1
+    return quotas
+
 
-# Load the dataset from Hugging Face
-dataset = datasets.load_dataset("Kkordik/persona-based-chat-messages")
+def extract_random_samples(input_path, output_file, num_samples=1000, seed=42, stratify_by=None, split="train",
+                           compression_level=None, metrics=None):
+    metrics = metrics or Metrics("extract_random_samples", [input_path], unit="rows")
+    if stratify_by:
+        samples = sample_rows_stratified(input_path, num_samples, stratify_by, seed, split, metrics)
+    else:
+        samples = sample_rows(input_path, num_samples, seed, split, metrics)
 
-# Get the total number of rows
-total_rows = len(dataset['train'])
+    # Save the random samples to a new JSONL file
+    with metrics.phase("write"), open_file(output_file, 'w', compression_level) as f:
+        f.write("".join(line + '\n' for _, line in samples))
 
-# Generate 1062 unique random indices
-random_indices = random.sample(range(total_rows), 1062)
+    metrics.count("samples", len(samples))
+    metrics.finish()
+    print(f"{len(samples)} random samples have been extracted and saved to '{output_file}'")
 
-# Extract the random samples
-random_samples = [dataset['train'][i] for i in random_indices]
 
-# Save the random samples to a new JSONL file
-with open('random_samples.jsonl', 'w') as f:
-    for sample in random_samples:
-        json.dump(sample, f)
-        f.write('\n')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract random samples from a dataset")
+    parser.add_argument(
+        "input_path", help="Local JSONL, Parquet or Arrow IPC file, or Hugging Face dataset name")
+    parser.add_argument(
+        "output_file", help="Path to save the sampled rows as JSONL")
+    parser.add_argument(
+        "--num_samples", type=int, default=1000, help="Number of rows to sample")
+    parser.add_argument(
+        "--seed", type=int, default=42, help="Random seed")
+    parser.add_argument(
+        "--stratify_by", help="Field to stratify the sample by (dots for nested fields, e.g. messages.0.role)")
+    parser.add_argument(
+        "--split", default="train", help="Hugging Face dataset split")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
 
-print("1062 random samples have been extracted and saved to 'random_samples.jsonl'")
+    metrics = Metrics("extract_random_samples", [args.input_path], args.metrics_out, args.profile, unit="rows")
+    extract_random_samples(args.input_path, args.output_file, args.num_samples, args.seed, args.stratify_by, args.split,
+                           args.compression_level, metrics)
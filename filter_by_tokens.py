@@ -0,0 +1,146 @@
+"""
+Token Budget Filter
+
+Drops conversations that go over a token budget, or truncates them to the longest run of whole messages
+that fits. Messages are never split.
+
+Tokens are counted over the content of every message, one message at a time, and counting stops as soon
+as the conversation goes over the budget. Every token covers at least one byte, so conversations whose
+content is no longer in bytes than the budget are kept without tokenizing them at all, and long messages
+are encoded in growing prefixes so huge outliers are never fully tokenized.
+
+Usage: python filter_by_tokens.py <input_file> <output_file> --max_tokens <max_tokens> [--truncate] [--end_on_assistant] [--encoding <encoding>] [--workers <workers>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input_file: Path to the input JSONL file
+- output_file: Path to save the filtered JSONL file
+- max_tokens: Token budget of each conversation
+- truncate: Optional flag to cut conversations over the budget after the last whole message that fits instead of dropping them
+- end_on_assistant: Optional flag to remove trailing messages until the conversation ends on an assistant message
+- encoding: Optional tiktoken encoding name (default: cl100k_base)
+- workers: Optional number of worker processes (default: 1)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python filter_by_tokens.py train.jsonl train_4k.jsonl --max_tokens 4096 --truncate --end_on_assistant --workers 16
+
+Input JSONL Example (--max_tokens 10 --truncate --end_on_assistant):
+{"messages": [{"content": "Hello", "role": "user"}, {"content": "Hi there!", "role": "assistant"}, {"content": "Tell me a long story", "role": "user"}, {"content": "Once upon a time ...", "role": "assistant"}]}
+
+Output JSONL Example:
+{"messages": [{"content": "Hello", "role": "user"}, {"content": "Hi there!", "role": "assistant"}]}
+"""
+
+import json
+import argparse
+from functools import partial
+from compressed_io import add_compression_arguments, open_file
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_lines
+from token_counter import DEFAULT_ENCODING, TokenCounter
+
+def fit_messages(messages, counter, max_tokens, truncate=False, end_on_assistant=False):
+    """Returns (messages that fit, status), with messages set to None when the conversation is dropped."""
+    kept = messages
+    status = 'kept'
+
+    # Tokens never outnumber bytes, so only count when the content could be over the budget
+    if sum(len((message['content'] or "").encode('utf-8')) for message in messages) > max_tokens:
+        used = 0
+        for i, message in enumerate(messages):
+            tokens = counter.count_up_to(message['content'] or "", max_tokens - used)
+            if tokens is None:
+                if not truncate:
+                    return None, 'over_budget'
+                kept = messages[:i]
+                status = 'truncated'
+                break
+            used += tokens
+
+    if end_on_assistant:
+        end = len(kept)
+        while end and kept[end - 1]['role'] != 'assistant':
+            end -= 1
+        if not end:
+            return None, 'no_assistant'
+        kept = kept[:end]
+
+    # A conversation with no more than a system prompt has nothing to train on, it is only over the budget
+    # if truncation cut it down to that
+    if not any(message['role'] != 'system' for message in kept):
+        return None, 'over_budget' if status == 'truncated' else 'no_content'
+    return kept, status
+
+def process_line(line, max_tokens, truncate=False, end_on_assistant=False, encoding_name=DEFAULT_ENCODING):
+    """Returns (status, JSON line or None)."""
+    if not line.strip():
+        return 'empty', None
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        return 'invalid_json', None
+
+    counter = TokenCounter(encoding_name, num_threads=1)
+    messages, status = fit_messages(data.get('messages', []), counter, max_tokens, truncate, end_on_assistant)
+    if messages is None:
+        return status, None
+    data['messages'] = messages
+    return status, json.dumps(data)
+
+def filter_by_tokens(input_file, output_file, max_tokens, truncate=False, end_on_assistant=False,
+                     encoding_name=DEFAULT_ENCODING, workers=1, compression_level=None, metrics=None):
+    metrics = metrics or Metrics("filter_by_tokens", [input_file])
+    line_func = partial(process_line, max_tokens=max_tokens, truncate=truncate,
+                        end_on_assistant=end_on_assistant, encoding_name=encoding_name)
+    counts = {'kept': 0, 'truncated': 0, 'over_budget': 0, 'no_assistant': 0, 'no_content': 0, 'invalid_json': 0,
+              'empty': 0}
+
+    with open_file(output_file, 'w', compression_level) as outfile:
+        results = map_lines(input_file, line_func, workers, on_range=metrics.add_bytes)
+        for line_number, (status, output) in metrics.timed(results, "process"):
+            metrics.add(rows=1)
+            counts[status] += 1
+            if status == 'invalid_json':
+                print(f"Skipping invalid JSON at line {line_number}")
+            if output is not None:
+                with metrics.phase("write"):
+                    outfile.write(output + '\n')
+
+    print(f"\nKept {counts['kept']} conversations within {max_tokens} tokens")
+    if truncate:
+        print(f"Truncated {counts['truncated']} conversations")
+    print(f"Dropped {counts['over_budget']} conversations over the budget")
+    if end_on_assistant:
+        print(f"Dropped {counts['no_assistant']} conversations without an assistant message")
+    if counts['no_content']:
+        print(f"Dropped {counts['no_content']} conversations without any message besides a system prompt")
+    for status, count in counts.items():
+        metrics.count(status, count)
+    metrics.finish()
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop or truncate conversations over a token budget")
+    parser.add_argument(
+        "input_file", help="Path to input JSONL file")
+    parser.add_argument(
+        "output_file", help="Path to save the filtered JSONL file")
+    parser.add_argument(
+        "--max_tokens", type=int, required=True, help="Token budget of each conversation")
+    parser.add_argument(
+        "--truncate", action="store_true", help="Cut conversations after the last whole message that fits instead of dropping them")
+    parser.add_argument(
+        "--end_on_assistant", action="store_true", help="Remove trailing messages until the conversation ends on an assistant message")
+    parser.add_argument(
+        "--encoding", default=DEFAULT_ENCODING, help="tiktoken encoding name")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("filter_by_tokens", [args.input_file], args.metrics_out, args.profile)
+    filter_by_tokens(args.input_file, args.output_file, args.max_tokens, args.truncate, args.end_on_assistant,
+                     args.encoding, args.workers, args.compression_level, metrics)
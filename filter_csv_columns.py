@@ -1,44 +1,113 @@
 """
 CSV Column Filter
 
-Filters a CSV file to keep only selected columns.
+Filters a CSV, JSONL, Parquet or Arrow IPC file to keep only selected columns, and optionally only the
+rows matching one or more predicates.
 
-Usage: python filter_csv_columns.py <input_file> <output_file> <columns_to_keep>
+Only the selected columns (and the columns the predicates use) are read: Parquet files read just those
+column chunks, Arrow IPC files (see compile_arrow.py) are memory-mapped so just those columns are ever
+touched, CSV files convert just those columns and JSONL rows keep just those fields. Predicates are
+pushed down to Parquet files, whose row groups are skipped when their statistics rule the predicates out.
+The file is processed one record batch at a time, so memory stays flat whatever its size.
 
-Input: Path to the input CSV file
-Output: Path to save the filtered CSV file
-Columns to Keep: Comma-separated list of columns to keep
+Usage: python filter_csv_columns.py <input_file> <output_file> [<columns_to_keep>] [--where <predicate>] [--batch_size <batch_size>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input: Path to the input file (CSV, JSONL, Parquet, or Arrow IPC)
+Output: Path to save the filtered file (CSV, JSONL, Parquet, or Arrow IPC)
+Columns to Keep: Optional comma-separated list of columns to keep (default: all columns)
+Where: Optional row predicate, may be repeated to keep rows matching all of them (see row_predicates.py for the syntax)
+Batch Size: Optional number of rows per record batch (default: 10000)
+Compression Level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+Metrics Out: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+Profile: Optional path prefix to save cProfile stats of each phase
 
 Example:
 python filter_csv_columns.py input.csv output.csv name,age
+python filter_csv_columns.py export.parquet subset.jsonl id,prompt,response --where "label == true" --where "len(response) > 50"
 """
 
-import pandas as pd
 import argparse
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from batch_io import DEFAULT_BATCH_SIZE, detect_format, iter_record_batches, open_batch_writer
+from compressed_io import add_compression_arguments
+from instrumentation import Metrics, add_metrics_arguments
+from row_predicates import combine_predicates
+
+def count_row_groups(input_file, expression):
+    """Returns (row groups the statistics cannot rule out, total row groups) of a Parquet file."""
+    fragments = list(ds.dataset(input_file, format="parquet").get_fragments())
+    total = sum(fragment.metadata.num_row_groups for fragment in fragments)
+    kept = sum(len(fragment.split_by_row_group(expression)) for fragment in fragments)
+    return kept, total
+
+def filter_batches(batches, predicate, columns_to_keep, metrics):
+    """Filters batches read with the predicate's columns, the predicate is compiled for the first batch's schema."""
+    expression = None
+    for batch in batches:
+        metrics.count("rows_read", batch.num_rows)
+        with metrics.phase("filter"):
+            if expression is None:
+                expression = predicate.expression(batch.schema)
+            batch = batch.filter(expression)
+            if columns_to_keep is not None:
+                batch = batch.select(columns_to_keep)
+        if batch.num_rows:
+            yield batch
 
-def keep_selected_columns(input_file, output_file, columns_to_keep):
-    # Read the input CSV file
-    data = pd.read_csv(input_file)
+def keep_selected_columns(input_file, output_file, columns_to_keep=None, predicates=None, batch_size=DEFAULT_BATCH_SIZE,
+                          compression_level=None, metrics=None):
+    metrics = metrics or Metrics("filter_csv_columns", [input_file], unit="rows")
+    input_format = detect_format(input_file)
+    predicate = combine_predicates(predicates or [])
 
-    # Filter the data to keep only the selected columns
-    filtered_data = data[columns_to_keep]
+    if predicate is None:
+        batches = iter_record_batches(input_file, input_format, batch_size, columns_to_keep)
+    elif input_format == "parquet":
+        # Pushed down to the reader, which also reads the predicate's columns it needs
+        expression = predicate.expression(pq.read_schema(input_file))
+        row_groups_read, row_groups = count_row_groups(input_file, expression)
+        metrics.count("row_groups_read", row_groups_read)
+        metrics.count("row_groups_skipped", row_groups - row_groups_read)
+        print(f"Skipping {row_groups - row_groups_read} of {row_groups} row groups from their statistics")
+        batches = iter_record_batches(input_file, input_format, batch_size, columns_to_keep, expression)
+    else:
+        read_columns = None
+        if columns_to_keep is not None:
+            read_columns = columns_to_keep + [column for column in predicate.columns if column not in columns_to_keep]
+        batches = filter_batches(iter_record_batches(input_file, input_format, batch_size, read_columns),
+                                 predicate, columns_to_keep, metrics)
 
-    # Write the filtered data to the output CSV file
-    filtered_data.to_csv(output_file, index=False)
+    # Write the filtered batches as they are read
+    with open_batch_writer(output_file, compression_level=compression_level) as writer:
+        for batch in metrics.timed(batches, "read"):
+            with metrics.phase("write"):
+                writer.write_batch(batch)
+            metrics.add(rows=batch.num_rows)
 
-    print(f"Selected columns have been written to {output_file}")
+    print(f"{writer.rows_written} rows of the selected columns have been written to {output_file}")
+    metrics.count("rows_written", writer.rows_written)
+    metrics.finish()
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Filter CSV columns")
+    parser = argparse.ArgumentParser(description="Filter the columns and rows of a CSV, JSONL, Parquet or Arrow IPC file")
+    parser.add_argument(
+        "input_file", help="Path to input file (CSV, JSONL, Parquet, or Arrow IPC)")
+    parser.add_argument(
+        "output_file", help="Path to save the filtered file (CSV, JSONL, Parquet, or Arrow IPC)")
     parser.add_argument(
-        "input_file", help="Path to input CSV file")
+        "columns_to_keep", nargs="?", help="Comma-separated list of columns to keep (default: all columns)")
     parser.add_argument(
-        "output_file", help="Path to save the filtered CSV file")
+        "--where", action="append", default=[], help="Row predicate, e.g. \"len(response) > 50\" (may be repeated)")
     parser.add_argument(
-        "columns_to_keep", help="Comma-separated list of columns to keep")
+        "--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Number of rows per record batch")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     # Convert the columns_to_keep argument from a string to a list
-    columns_to_keep = args.columns_to_keep.split(',')
+    columns_to_keep = args.columns_to_keep.split(',') if args.columns_to_keep else None
 
-    keep_selected_columns(args.input_file, args.output_file, columns_to_keep)
+    metrics = Metrics("filter_csv_columns", [args.input_file], args.metrics_out, args.profile, unit="rows")
+    keep_selected_columns(args.input_file, args.output_file, columns_to_keep, args.where, args.batch_size,
+                          args.compression_level, metrics)
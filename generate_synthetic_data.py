@@ -0,0 +1,143 @@
+"""
+Synthetic Dataset Generator
+
+Generates deterministic synthetic datasets in every input shape the tools accept, for benchmarks and
+quick experiments. The same shape, sizes and seed always produce byte-identical files.
+
+Shapes:
+- chatml: {"messages": [{"role": ..., "content": ...}]} (JSONL)
+- nested: {"conv_id": ..., "messages": {"messages": [...]}} as read by transform_dataset.py (JSONL)
+- sharegpt: {"conversations": [{"from": ..., "value": ...}]} as read by convert_dataset.py (JSONL)
+- kto: {"query": ..., "response": ..., "label": ...} (JSONL)
+- wide: flat table of int, float and string columns (CSV, JSONL or Parquet, chosen by extension)
+
+Usage: python generate_synthetic_data.py <shape> <output_file> [--rows <rows>] [--turns <turns>] [--content_length <content_length>] [--columns <columns>] [--seed <seed>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- shape: One of chatml, nested, sharegpt, kto, wide
+- output_file: Path to save the generated dataset
+- rows: Optional number of rows (default: 10000)
+- turns: Optional number of user/assistant turns per conversation (default: 4)
+- content_length: Optional average number of characters per message or string cell (default: 400)
+- columns: Optional number of columns of the wide shape (default: 32)
+- seed: Optional random seed (default: 42)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python generate_synthetic_data.py chatml chatml_100k.jsonl --rows 100000 --turns 6 --content_length 800
+python generate_synthetic_data.py wide wide_1m.parquet --rows 1000000 --columns 64
+"""
+
+import argparse
+import json
+import random
+
+import pyarrow as pa
+
+from batch_io import DEFAULT_BATCH_SIZE, open_batch_writer
+from compressed_io import add_compression_arguments, open_file
+from instrumentation import Metrics, add_metrics_arguments
+
+SHAPES = ["chatml", "nested", "sharegpt", "kto", "wide"]
+
+WORDS = (
+    "the of and to in is that for it as was with be by on not he this are or his from at which but have an they "
+    "you were her she there one all we their can has been if more when will would who so no model data train "
+    "token answer question assistant user system example value result function list string number python code "
+    "error file line output input format language learning network layer weight batch epoch loss sample"
+).split()
+
+
+def random_text(rng, content_length):
+    # Vary the length around the average so rows are not all the same size
+    target = rng.randint(content_length // 2, content_length * 3 // 2)
+    words = rng.choices(WORDS, k=max(1, target // 6))
+    return " ".join(words)[:max(target, 1)]
+
+
+def generate_messages(rng, turns, content_length):
+    messages = [{"role": "system", "content": random_text(rng, content_length // 4)}]
+    for _ in range(turns):
+        messages.append({"role": "user", "content": random_text(rng, content_length)})
+        messages.append({"role": "assistant", "content": random_text(rng, content_length)})
+    return messages
+
+
+def generate_record(shape, index, rng, turns, content_length):
+    if shape == "chatml":
+        return {"messages": generate_messages(rng, turns, content_length)}
+    if shape == "nested":
+        return {"conv_id": str(index), "messages": {"messages": generate_messages(rng, turns, content_length)}}
+    if shape == "sharegpt":
+        role_names = {"system": "system", "user": "human", "assistant": "gpt"}
+        return {"conversations": [{"from": role_names[message["role"]], "value": message["content"]}
+                                  for message in generate_messages(rng, turns, content_length)]}
+    if shape == "kto":
+        return {"query": random_text(rng, content_length), "response": random_text(rng, content_length),
+                "label": rng.random() < 0.5}
+    raise ValueError(f"Unknown shape {shape!r}, expected one of {', '.join(SHAPES)}")
+
+
+def generate_wide_batch(rng, start, rows, columns, content_length):
+    data = {"id": list(range(start, start + rows))}
+    for column in range(columns):
+        kind = column % 3
+        if kind == 0:
+            data[f"int_{column}"] = [rng.randint(0, 1_000_000) for _ in range(rows)]
+        elif kind == 1:
+            data[f"float_{column}"] = [rng.random() * 1000 for _ in range(rows)]
+        else:
+            data[f"str_{column}"] = [random_text(rng, content_length) for _ in range(rows)]
+    return pa.RecordBatch.from_pydict(data)
+
+
+def generate_synthetic_data(shape, output_file, rows=10_000, turns=4, content_length=400, columns=32, seed=42,
+                            compression_level=None, metrics=None):
+    metrics = metrics or Metrics("generate_synthetic_data", unit="rows", total=rows)
+    rng = random.Random(seed)
+
+    if shape == "wide":
+        with open_batch_writer(output_file, compression_level=compression_level) as writer:
+            for start in range(0, rows, DEFAULT_BATCH_SIZE):
+                batch_rows = min(DEFAULT_BATCH_SIZE, rows - start)
+                with metrics.phase("generate"):
+                    batch = generate_wide_batch(rng, start, batch_rows, columns, content_length // 4)
+                with metrics.phase("write"):
+                    writer.write_batch(batch)
+                metrics.add(rows=batch_rows)
+    else:
+        with metrics.phase("generate"), open_file(output_file, 'w', compression_level) as f:
+            for index in range(rows):
+                f.write(json.dumps(generate_record(shape, index, rng, turns, content_length)) + "\n")
+                metrics.add(rows=1)
+
+    print(f"Generated {rows} {shape} rows in {output_file}")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic datasets")
+    parser.add_argument(
+        "shape", choices=SHAPES, help="Shape of the generated rows")
+    parser.add_argument(
+        "output_file", help="Path to save the generated dataset")
+    parser.add_argument(
+        "--rows", type=int, default=10_000, help="Number of rows")
+    parser.add_argument(
+        "--turns", type=int, default=4, help="Number of user/assistant turns per conversation")
+    parser.add_argument(
+        "--content_length", type=int, default=400, help="Average number of characters per message or string cell")
+    parser.add_argument(
+        "--columns", type=int, default=32, help="Number of columns of the wide shape")
+    parser.add_argument(
+        "--seed", type=int, default=42, help="Random seed")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("generate_synthetic_data", metrics_out=args.metrics_out, profile=args.profile, unit="rows",
+                      total=args.rows)
+    generate_synthetic_data(args.shape, args.output_file, args.rows, args.turns, args.content_length,
+                            args.columns, args.seed, args.compression_level, metrics)
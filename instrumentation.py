@@ -0,0 +1,194 @@
+"""
+Run Instrumentation
+
+Shared timing, throughput and memory instrumentation for the tools. A Metrics object tracks:
+- time spent in each named phase (e.g. read, decode, transform, encode, write)
+- rows processed, input bytes, and rows and MB per second
+- peak RSS of the tool's process and of its worker processes
+- any tool-specific counters (e.g. rows dropped)
+
+Interactive runs show a tqdm progress bar on stderr. With --metrics_out (or --metrics-out) the tool writes
+the metrics as one JSON record, and with --profile each phase is profiled with cProfile and saved as
+<profile>.<phase>.prof (view with `python -m pstats` or snakeviz). Sampling profilers such as py-spy
+attach to a running tool without any hook.
+
+With worker processes, the time workers spend decoding and transforming rows shows up in the phase that
+waits for their results, and --profile only covers the main process.
+
+Example:
+from instrumentation import Metrics
+
+metrics = Metrics("my_tool", [input_file], metrics_out="metrics.json")
+for batch in metrics.timed(read_batches(input_file), "read"):
+    with metrics.phase("transform"):
+        rows = transform(batch)
+    with metrics.phase("write"):
+        write(rows)
+    metrics.add(rows=len(rows), nbytes=batch_bytes)
+metrics.finish()
+
+Metrics Record Example:
+{"tool": "convert_file_format", "inputs": ["train.csv"], "elapsed_seconds": 12.41, "rows": 1000000,
+ "input_bytes": 734003200, "rows_per_sec": 80580.2, "mb_per_sec": 56.41,
+ "phases": {"read": 7.92, "write": 4.38}, "peak_rss_mb": 212.4, "peak_rss_children_mb": 0.0, "counters": {}}
+"""
+
+import cProfile
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from tqdm import tqdm
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_rss_mb(children: bool = False) -> Optional[float]:
+    """Returns the peak resident set size of this process (or of its finished child processes) in MB."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(usage.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def add_metrics_arguments(parser):
+    """Adds the --metrics_out and --profile options shared by every tool."""
+    parser.add_argument(
+        "--metrics_out", "--metrics-out", help="Path to save a JSON record of phase timings, throughput and peak memory")
+    parser.add_argument(
+        "--profile", help="Path prefix to save cProfile stats of each phase as <profile>.<phase>.prof")
+
+
+class _Phase:
+    __slots__ = ("metrics", "name", "profiler", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.profiler = metrics._profiler(name)
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        phases = self.metrics.phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+
+
+class Metrics:
+    def __init__(self, tool: str, input_paths: Iterable[str] = (), metrics_out: str = None, profile: str = None,
+                 unit: str = "bytes", total: int = None, progress: bool = None):
+        """
+        unit is what the progress bar counts: "bytes" (of the input files, reported through add(nbytes=...))
+        or "rows". total defaults to the size of the input files for bytes.
+        progress defaults to showing the bar only when stderr is a terminal.
+        """
+        self.tool = tool
+        self.input_paths = [path for path in input_paths if path]
+        self.input_bytes = sum(os.path.getsize(path) for path in self.input_paths if os.path.isfile(path))
+        self.metrics_out = metrics_out
+        self.profile = profile
+        self.unit = unit
+        self.rows = 0
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self._profilers: Dict[str, cProfile.Profile] = {}
+        self._started = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+
+        if progress is None:
+            progress = sys.stderr.isatty()
+        if unit == "bytes":
+            self._bar = tqdm(total=total or self.input_bytes or None, unit="B", unit_scale=True, unit_divisor=1024,
+                             desc=tool, disable=not progress, leave=False)
+        else:
+            self._bar = tqdm(total=total, unit=" rows", unit_scale=True, desc=tool, disable=not progress, leave=False)
+
+    def _profiler(self, name):
+        if not self.profile:
+            return None
+        if name not in self._profilers:
+            self._profilers[name] = cProfile.Profile()
+        return self._profilers[name]
+
+    def phase(self, name: str) -> _Phase:
+        """Context manager adding the time spent inside it to a phase. Phases must not be nested."""
+        return _Phase(self, name)
+
+    def timed(self, iterable: Iterable, name: str) -> Iterator:
+        """Yields the items of iterable, counting the time spent producing them as a phase."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add(self, rows: int = 0, nbytes: int = 0):
+        """Counts processed rows and input bytes and advances the progress bar."""
+        self.rows += rows
+        step = nbytes if self.unit == "bytes" else rows
+        if step:
+            self._bar.update(step)
+
+    def add_bytes(self, nbytes: int):
+        """Advances the progress bar by input bytes, e.g. as the on_range callback of jsonl_executor."""
+        self.add(nbytes=nbytes)
+
+    def count(self, name: str, value: float = 1):
+        """Adds to a tool-specific counter included in the metrics record."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self) -> dict:
+        elapsed = time.perf_counter() - self._start
+        return {
+            "tool": self.tool,
+            "inputs": self.input_paths,
+            "started": self._started.isoformat(timespec="seconds"),
+            "elapsed_seconds": round(elapsed, 4),
+            "rows": self.rows,
+            "input_bytes": self.input_bytes,
+            "rows_per_sec": round(self.rows / elapsed, 1) if elapsed else None,
+            "mb_per_sec": round(self.input_bytes / (1 << 20) / elapsed, 3) if elapsed else None,
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_rss_children_mb": peak_rss_mb(children=True),
+            "counters": self.counters,
+            "profiles": self._dump_profiles(),
+        }
+
+    def _dump_profiles(self) -> List[str]:
+        paths = []
+        for name, profiler in self._profilers.items():
+            path = f"{self.profile}.{name}.prof"
+            profiler.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def finish(self) -> dict:
+        """Closes the progress bar, writes the metrics record if requested and returns it."""
+        self._bar.close()
+        record = self.record()
+        if self.metrics_out:
+            with open(self.metrics_out, 'w') as f:
+                json.dump(record, f, indent=2)
+        if not self._bar.disable:
+            phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in record["phases"].items())
+            print(f"{self.tool}: {record['rows']} rows in {record['elapsed_seconds']:.2f}s "
+                  f"({record['rows_per_sec'] or 0:.0f} rows/s, {record['mb_per_sec'] or 0:.2f} MB/s, "
+                  f"peak RSS {record['peak_rss_mb']} MB){'; ' + phases if phases else ''}", file=sys.stderr)
+        return record
@@ -0,0 +1,242 @@
+"""
+Parallel JSONL Executor
+
+Splits a JSONL file into newline-aligned byte ranges and runs a function over the lines of each range in
+a process pool. Results are merged back in the original order, numbered with the same 1-based line
+numbers a single-threaded `for line in file` loop would give.
+
+If the file has a fresh line index (see jsonl_index.py), the ranges are taken from it instead of
+seeking through the file.
+
+Compressed files (see compressed_io.py) cannot be split into byte ranges, so they are decompressed in
+the main process and their blocks of lines are sent to the workers instead.
+
+Arrow IPC files (see compile_arrow.py) are split by record batch instead: each worker memory-maps the
+file and reads its batches in place, so nothing is parsed again (map_arrow_rows).
+
+Lines are passed to the function without their trailing newline (map_blocks passes the raw bytes of each
+block of whole lines instead, e.g. for a columnar parser). Functions must be defined at module level (or
+wrapped with functools.partial) so they can be sent to the worker processes.
+
+Example:
+from jsonl_executor import map_lines
+
+for line_number, data in map_lines("input.jsonl", json.loads, workers=8):
+    ...
+"""
+
+import os
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from batch_io import open_arrow
+from compressed_io import is_compressed, iter_line_blocks
+from jsonl_index import JsonlIndex, is_index_fresh
+
+DEFAULT_CHUNK_BYTES = 8 << 20
+
+
+def split_ranges(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES, start: int = 0) -> List[Tuple[int, int]]:
+    """
+    Returns (start, end) byte ranges of about chunk_bytes that each begin at the start of a line, from the
+    start offset (which must be the start of a line) to the end of the file.
+    """
+    if is_index_fresh(path):
+        return _split_ranges_from_index(path, chunk_bytes, start)
+
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + chunk_bytes
+            if end < size:
+                # Move the boundary forward to the start of the next line
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            end = min(end, size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _split_ranges_from_index(path, chunk_bytes, start):
+    # Snap each boundary to the first line starting at or after it, without touching the file
+    with JsonlIndex(path) as index:
+        size = int(index.offsets[-1])
+        targets = np.arange(start + chunk_bytes, size, chunk_bytes, dtype=np.uint64)
+        boundaries = np.unique(index.offsets[np.searchsorted(index.offsets, targets)]).tolist()
+    points = [start] + [b for b in boundaries if start < b < size] + [size]
+    return [(start, end) for start, end in zip(points, points[1:]) if start < end]
+
+
+def read_range(path: str, start: int, end: int) -> bytes:
+    """Returns the raw bytes of a byte range of the file."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def read_range_lines(path: str, start: int, end: int) -> List[str]:
+    """Returns the lines in a newline-aligned byte range, without line terminators."""
+    return split_lines(read_range(path, start, end))
+
+
+def split_lines(data: bytes) -> List[str]:
+    """Returns the lines of a block of whole lines, without line terminators."""
+    lines = data.decode('utf-8').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return [line[:-1] if line.endswith('\r') else line for line in lines]
+
+
+def _apply_range(path, start, end, block_func):
+    return block_func(read_range(path, start, end))
+
+
+def _apply_block(data, block_func):
+    return block_func(data)
+
+
+def _process_block(data, batch_func):
+    lines = split_lines(data)
+    results = batch_func(lines) if lines else []
+    if len(results) != len(lines):
+        raise ValueError(f"Batch function returned {len(results)} results for {len(lines)} lines")
+    return results
+
+
+def _apply_each(func, lines):
+    return [func(line) for line in lines]
+
+
+def _skip_line_blocks(blocks, start):
+    # Decompressed blocks before the start offset are dropped, the block it falls in is cut at it
+    position = 0
+    for data, nbytes in blocks:
+        if position + len(data) > start:
+            yield data[max(start - position, 0):], nbytes, position + len(data)
+        position += len(data)
+
+
+def map_blocks(path: str, block_func: Callable[[bytes], Any], workers: int = 1, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+               on_range: Callable[[int], None] = None, start: int = 0,
+               on_offset: Callable[[int], None] = None) -> Iterator[Any]:
+    """
+    Runs block_func over the raw bytes of each block of whole lines and yields its results in file order.
+
+    on_range, if given, is called with the size in bytes of the file each block covers once its result was
+    consumed (e.g. to advance a progress bar).
+    start is the offset of the line to start from, in the decompressed content for compressed files (which
+    are still decompressed from their start). on_offset, if given, is called with the offset of the next
+    unprocessed line once a block's result was consumed (e.g. to checkpoint, see checkpoint.py).
+    """
+    # Each task is (function, arguments, (bytes of the file it covers, offset of the line after it))
+    if is_compressed(path):
+        tasks = ((_apply_block, (data, block_func), (nbytes, end))
+                 for data, nbytes, end in _skip_line_blocks(iter_line_blocks(path, chunk_bytes), start))
+    else:
+        tasks = ((_apply_range, (path, range_start, end, block_func), (end - range_start, end))
+                 for range_start, end in split_ranges(path, chunk_bytes, start))
+
+    for result, (nbytes, end) in _run_tasks(tasks, workers):
+        yield result
+        if on_range is not None:
+            on_range(nbytes)
+        if on_offset is not None:
+            on_offset(end)
+
+
+def _run_tasks(tasks, workers):
+    if workers <= 1:
+        for func, args, info in tasks:
+            yield func(*args), info
+        return
+
+    # Keep a bounded window of tasks in flight so finished results never pile up in memory
+    with Pool(workers) as pool:
+        pending = deque()
+        for func, args, info in tasks:
+            pending.append((pool.apply_async(func, args), info))
+            if len(pending) >= workers * 2:
+                result, info = pending.popleft()
+                yield result.get(), info
+        while pending:
+            result, info = pending.popleft()
+            yield result.get(), info
+
+
+def map_items(func: Callable[[Any], Any], items: Iterable[Any], workers: int = 1) -> Iterator[Any]:
+    """
+    Runs func over each item of an iterable (e.g. the batches of a dataset that is not a JSONL file) and
+    yields its results in order, with the same bounded window of tasks in flight as map_blocks.
+    """
+    for result, _ in _run_tasks(((func, (item,), None) for item in items), workers):
+        yield result
+
+
+def map_line_batches(path: str, batch_func: Callable[[List[str]], List[Any]], workers: int = 1,
+                     chunk_bytes: int = DEFAULT_CHUNK_BYTES, on_range: Callable[[int], None] = None, start: int = 0,
+                     on_offset: Callable[[int], None] = None, line_number: int = 0) -> Iterator[Tuple[int, Any]]:
+    """
+    Runs batch_func over the lines of each byte range and yields (line_number, result) in file order.
+
+    batch_func receives every line of a range at once and must return one result per line.
+    on_range, if given, is called with the size in bytes of each range once all its results were yielded
+    (e.g. to advance a progress bar). start and on_offset work as in map_blocks, line_number is the
+    number of lines before start so numbering carries on from there.
+    """
+    for results in map_blocks(path, partial(_process_block, batch_func=batch_func), workers, chunk_bytes, on_range,
+                              start, on_offset):
+        for result in results:
+            line_number += 1
+            yield line_number, result
+
+
+def map_lines(path: str, func: Callable[[str], Any], workers: int = 1, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+              on_range: Callable[[int], None] = None, start: int = 0, on_offset: Callable[[int], None] = None,
+              line_number: int = 0) -> Iterator[Tuple[int, Any]]:
+    """Runs func on every line and yields (line_number, result) in file order."""
+    return map_line_batches(path, partial(_apply_each, func), workers, chunk_bytes, on_range, start, on_offset,
+                            line_number)
+
+
+def _apply_arrow_batch(path, index, columns, batch_func):
+    batch = open_arrow(path).get_batch(index)
+    if columns is not None:
+        batch = batch.select(columns)
+    results = batch_func(batch) if batch.num_rows else []
+    if len(results) != batch.num_rows:
+        raise ValueError(f"Batch function returned {len(results)} results for {batch.num_rows} rows")
+    return results
+
+
+def map_arrow_rows(path: str, batch_func: Callable[[Any], List[Any]], workers: int = 1, columns: List[str] = None,
+                   on_range: Callable[[int], None] = None, start: int = 0, on_offset: Callable[[int], None] = None,
+                   row_number: int = 0) -> Iterator[Tuple[int, Any]]:
+    """
+    Runs batch_func over each record batch of an Arrow IPC file and yields (row_number, result) in file
+    order, the counterpart of map_line_batches.
+
+    batch_func receives a pyarrow RecordBatch (of just the given columns) and must return one result per
+    row. on_range is called with an even share of the file size per batch. start is the index of the
+    record batch to start from, on_offset is called with the index of the next unprocessed batch and
+    row_number is the number of rows before start.
+    """
+    num_batches = open_arrow(path).num_record_batches
+    size = os.path.getsize(path)
+    tasks = ((_apply_arrow_batch, (path, index, columns, batch_func),
+              (size * (index + 1) // num_batches - size * index // num_batches, index + 1))
+             for index in range(start, num_batches))
+    for results, (nbytes, end) in _run_tasks(tasks, workers):
+        for result in results:
+            row_number += 1
+            yield row_number, result
+        if on_range is not None:
+            on_range(nbytes)
+        if on_offset is not None:
+            on_offset(end)
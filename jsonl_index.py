@@ -0,0 +1,212 @@
+"""
+JSONL Line Index
+
+Builds a sidecar index of line start offsets for a JSONL file and reads any row or row range in constant
+time through memory maps, without parsing the rows before it.
+
+The index is saved next to the file as <input_file>.idx: a small header holding the size and
+modification time of the indexed file, followed by one little-endian uint64 start offset per line (plus
+the end offset of the last line). An index whose recorded size or modification time no longer matches
+the file is stale and is rebuilt (or rejected) when opened.
+
+Compressed files (see compressed_io.py) cannot be indexed, as their rows have no byte offsets to seek to.
+
+Rows are numbered from 1 on the command line, matching the row and line numbers reported by
+check_message_order.py and validate_jsonl.py. Empty lines count as rows.
+
+Usage:
+python jsonl_index.py build <input_file> [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+python jsonl_index.py get <input_file> <row> [<end_row>]
+
+Input:
+- input_file: Path to the input JSONL file
+- row: First row to print
+- end_row: Optional last row to print (inclusive)
+- metrics_file: Optional path to save phase timings, throughput and peak memory of the build as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of the build
+
+Example:
+python jsonl_index.py build persona-based-chat-messages-1k-augmented-cleaned.jsonl
+python jsonl_index.py get persona-based-chat-messages-1k-augmented-cleaned.jsonl 682
+
+Python Example:
+from jsonl_index import JsonlIndex
+
+with JsonlIndex("train.jsonl") as index:
+    row = index.get_record(681)
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from compressed_io import is_compressed
+from instrumentation import Metrics, add_metrics_arguments
+
+MAGIC = b"JSONLIX1"
+HEADER = struct.Struct("<8sQqQ")  # magic, file size, mtime in ns, line count
+BLOCK_SIZE = 16 << 20
+
+
+def index_path_for(path: str) -> str:
+    return path + ".idx"
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_index(path: str, index_path: str = None) -> int:
+    """Writes the line offset index for a JSONL file and returns the number of lines."""
+    if is_compressed(path):
+        raise ValueError(f"Cannot index {path}: compressed files have no row offsets to seek to")
+    index_path = index_path or index_path_for(path)
+    size, mtime_ns = _file_signature(path)
+    line_count = 0
+    position = 0
+    ends_with_newline = True
+
+    tmp_path = index_path + ".tmp"
+    with open(path, 'rb') as f, open(tmp_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, 0, 0, 0))
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            # A new line starts wherever the previous block ended on a newline
+            if ends_with_newline:
+                out.write(np.array([position], dtype='<u8').tobytes())
+                line_count += 1
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            starts = newlines[:-1] + 1 if block.endswith(b"\n") else newlines + 1
+            out.write((starts + position).astype('<u8').tobytes())
+            line_count += len(starts)
+            ends_with_newline = block.endswith(b"\n")
+            position += len(block)
+
+        out.write(np.array([position], dtype='<u8').tobytes())
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, size, mtime_ns, line_count))
+
+    os.replace(tmp_path, index_path)
+    return line_count
+
+
+def is_index_fresh(path: str, index_path: str = None) -> bool:
+    """Returns True if the index exists and matches the current size and modification time of the file."""
+    index_path = index_path or index_path_for(path)
+    try:
+        with open(index_path, 'rb') as f:
+            magic, size, mtime_ns, _ = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    return magic == MAGIC and (size, mtime_ns) == _file_signature(path)
+
+
+class JsonlIndex:
+    """Constant-time access to the rows of an indexed JSONL file (rows are 0-based here)."""
+
+    def __init__(self, path: str, index_path: str = None, rebuild: bool = True):
+        self.path = path
+        self.index_path = index_path or index_path_for(path)
+        if not is_index_fresh(path, self.index_path):
+            if not rebuild:
+                raise ValueError(f"Index {self.index_path} is missing or stale, rebuild it with: "
+                                 f"python jsonl_index.py build {path}")
+            build_index(path, self.index_path)
+
+        with open(self.index_path, 'rb') as f:
+            self._index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, self.line_count = HEADER.unpack_from(self._index_map)
+        self.offsets = np.frombuffer(self._index_map, dtype='<u8', count=self.line_count + 1, offset=HEADER.size)
+
+        with open(path, 'rb') as f:
+            # mmap cannot map an empty file
+            self._data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __len__(self):
+        return self.line_count
+
+    def _check_row(self, row):
+        if not 0 <= row < self.line_count:
+            raise IndexError(f"Row {row} out of range for {self.path} with {self.line_count} rows")
+
+    def get_bytes(self, start: int, stop: int = None) -> bytes:
+        """Returns the raw bytes of rows start..stop-1 (a single row if stop is omitted)."""
+        stop = start + 1 if stop is None else min(stop, self.line_count)
+        self._check_row(start)
+        return self._data_map[int(self.offsets[start]):int(self.offsets[stop])]
+
+    def get_line(self, row: int) -> str:
+        """Returns one row without its line terminator."""
+        return self.get_bytes(row).decode('utf-8').rstrip('\r\n')
+
+    def get_lines(self, start: int, stop: int) -> list:
+        """Returns rows start..stop-1 without their line terminators."""
+        stop = min(stop, self.line_count)
+        if start >= stop:
+            return []
+        lines = self.get_bytes(start, stop).decode('utf-8').split('\n')[:stop - start]
+        return [line.rstrip('\r') for line in lines]
+
+    def non_empty_rows(self) -> np.ndarray:
+        """Returns the numbers of the rows that are not blank, reading only the first byte of most rows."""
+        data = np.frombuffer(self._data_map, dtype=np.uint8)
+        first_bytes = data[self.offsets[:-1].astype(np.int64)]
+        # Rows starting with a printable character hold data, only the others need decoding
+        suspects = np.flatnonzero((first_bytes <= 0x20) | (first_bytes >= 0x7f))
+        blank = [row for row in suspects.tolist() if not self.get_line(row).strip()]
+        return np.delete(np.arange(self.line_count), blank)
+
+    def get_record(self, row: int):
+        return json.loads(self.get_line(row))
+
+    def close(self):
+        # Drop the numpy view first, the index map cannot close while it is exported
+        self.offsets = None
+        self._index_map.close()
+        if isinstance(self._data_map, mmap.mmap):
+            self._data_map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or read a JSONL line offset index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the index for a JSONL file")
+    build_parser.add_argument(
+        "input_file", help="Path to input JSONL file")
+    add_metrics_arguments(build_parser)
+
+    get_parser = subparsers.add_parser("get", help="Print rows of a JSONL file using its index")
+    get_parser.add_argument(
+        "input_file", help="Path to input JSONL file")
+    get_parser.add_argument(
+        "row", type=int, help="First row to print (1-based)")
+    get_parser.add_argument(
+        "end_row", type=int, nargs="?", help="Last row to print (1-based, inclusive)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        metrics = Metrics("jsonl_index", [args.input_file], args.metrics_out, args.profile)
+        with metrics.phase("index"):
+            line_count = build_index(args.input_file)
+        metrics.add(rows=line_count, nbytes=metrics.input_bytes)
+        metrics.finish()
+        print(f"Indexed {line_count} rows of {args.input_file} into {index_path_for(args.input_file)}")
+    else:
+        with JsonlIndex(args.input_file) as index:
+            end_row = args.end_row or args.row
+            for line in index.get_lines(args.row - 1, end_row):
+                print(line)
@@ -1,66 +1,147 @@
 """
 Dataset Merger
 
-Merges multiple datasets from Hugging Face into a single DataFrame and saves it as a Parquet file.
+Merges multiple datasets from Hugging Face (or local Parquet/JSONL files) into a single Parquet file.
 
-Usage: python merge_datasets.py <dataset_names> <output_file> [--rename_columns <rename_columns>] [--drop_columns <drop_columns>]
+Each source is streamed to the output as Arrow record batches, so the combined table is never built in
+memory. The rename/drop mappings are applied per batch, and the source schemas are widened into one up
+front: columns missing from a source are filled with nulls and column types are promoted (e.g. int32 and
+int64 to int64, int to double, differing types to text) so every batch fits the one output schema. A JSONL
+batch that still does not fit widens the output as it is written (see batch_io.py).
+
+Usage: python merge_datasets.py <dataset_names> <output_file> [--rename_columns <rename_columns>] [--drop_columns <drop_columns>] [--batch_size <batch_size>] [--shard_rows <rows>] [--shard_bytes <size>] [--splits <splits>] [--split_key <column>] [--split_seed <seed>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
 
 Input:
-- dataset_names: Comma-separated list of Hugging Face dataset names
+- dataset_names: Comma-separated list of Hugging Face dataset names or local Parquet/JSONL files
 - output_file: Path to save the merged dataset as a Parquet file
 - rename_columns: Optional JSON string to rename columns (e.g., '{"old_name": "new_name"}')
 - drop_columns: Optional comma-separated list of columns to drop
+- batch_size: Optional number of rows per record batch (default: 10000)
+- shard_rows: Optional maximum number of rows per output shard, writes numbered Parquet shards and a manifest instead of a single file (see sharded_writer.py)
+- shard_bytes: Optional maximum in-memory size of the rows of each output shard (e.g. 512MB)
+- splits: Optional split fractions, each row is assigned by a stable hash (e.g. train=0.98,val=0.01,test=0.01)
+- split_key: Optional column hashed to assign splits (default: the whole row)
+- split_seed: Optional seed mixed into the split hash
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
 
 Example:
 python merge_datasets.py 'Norquinal/claude_multi_instruct_1k,Norquinal/claude_evol_instruct_100k,flozi00/reflection-llama3.1-70b-alpaca-170924' instruct.parquet --rename_columns '{"input": "instruction"}' --drop_columns 'system,reflection'
 """
 
-import pandas as pd
-from datasets import load_dataset
 import argparse
 import json
+import os
+from functools import reduce
+from itertools import chain
 
-def merge_datasets(dataset_names, rename_columns=None, drop_columns=None):
-    combined_df = pd.DataFrame()
-
-    for dataset_name in dataset_names:
-        # Load the dataset
-        dataset = load_dataset(dataset_name, cache_dir='.')
-
-        # Convert to pandas DataFrame
-        df = dataset['train'].to_pandas()
-
-        # Rename columns if specified
-        if rename_columns:
-            df = df.rename(columns=rename_columns)
-
-        # Drop columns if specified
-        if drop_columns:
-            df = df.drop(columns=drop_columns, errors='ignore')
-
-        # Concatenate with the combined DataFrame
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
+import pyarrow as pa
+from datasets import load_dataset
 
-    return combined_df
+from batch_io import DEFAULT_BATCH_SIZE, ParquetBatchWriter, cast_column, iter_record_batches, widen_schema
+from instrumentation import Metrics, add_metrics_arguments
+from sharded_writer import ShardedWriter, add_shard_arguments, manifest_path, shard_options
+
+class Source:
+    """A dataset to merge: its Arrow schema plus a way to stream its record batches."""
+
+    def __init__(self, name, schema, batches):
+        self.name = name
+        self.schema = schema
+        self.batches = batches
+
+def open_source(dataset_name, batch_size=DEFAULT_BATCH_SIZE):
+    if os.path.isfile(dataset_name):
+        batches = iter_record_batches(dataset_name, batch_size=batch_size)
+        # Peek at the first batch for the schema (JSONL schemas are only known once read)
+        first = next(batches, None)
+        if first is None:
+            return Source(dataset_name, pa.schema([]), iter(()))
+        return Source(dataset_name, first.schema, chain([first], batches))
+
+    # Load the dataset, its Arrow table is memory-mapped from the cache
+    dataset = load_dataset(dataset_name, cache_dir='.')['train'].with_format("arrow")
+    batches = (batch for table in dataset.iter(batch_size=batch_size) for batch in table.to_batches())
+    return Source(dataset_name, dataset.features.arrow_schema, batches)
+
+def renamed(names, rename_columns=None):
+    return [rename_columns.get(name, name) for name in names] if rename_columns else list(names)
+
+def mapped_schema(schema, rename_columns=None, drop_columns=None):
+    """Returns the schema a source ends up with after renaming and dropping columns."""
+    fields = [field.with_name(name) for field, name in zip(schema, renamed(schema.names, rename_columns))]
+    return pa.schema([field for field in fields if not drop_columns or field.name not in drop_columns])
+
+def conform_batch(batch, target_schema, rename_columns=None):
+    """Renames the columns of a batch, then drops, adds and casts columns to match the target schema."""
+    columns = dict(zip(renamed(batch.schema.names, rename_columns), batch.columns))
+    arrays = []
+    for field in target_schema:
+        column = columns.get(field.name)
+        if column is None:
+            arrays.append(pa.nulls(batch.num_rows, type=field.type))
+        else:
+            arrays.append(cast_column(column, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=target_schema)
+
+def merge_datasets(dataset_names, output_file, rename_columns=None, drop_columns=None, batch_size=DEFAULT_BATCH_SIZE,
+                   shards=None, metrics=None):
+    """
+    Streams every source into output_file as one Parquet file (or as Parquet shards, given ShardedWriter
+    options) and returns the number of rows written.
+    """
+    metrics = metrics or Metrics("merge_datasets", dataset_names, unit="rows")
+    with metrics.phase("read"):
+        sources = [open_source(dataset_name, batch_size) for dataset_name in dataset_names]
+
+    # Widen the schemas of all sources into one so the writer can be opened once, JSONL and CSV sources
+    # may still widen it further as they are read (see batch_io.py)
+    schemas = [mapped_schema(source.schema, rename_columns, drop_columns).remove_metadata() for source in sources]
+    target_schema = reduce(widen_schema, schemas[1:], schemas[0]) if schemas else pa.schema([])
+
+    rows = 0
+    if shards:
+        writer = ShardedWriter(output_file, "parquet", schema=target_schema, **shards)
+    else:
+        writer = ParquetBatchWriter(output_file, target_schema)
+    with writer:
+        for source in sources:
+            for batch in metrics.timed(source.batches, "read"):
+                with metrics.phase("transform"):
+                    target_schema = widen_schema(target_schema, mapped_schema(batch.schema, rename_columns, drop_columns))
+                    conformed = conform_batch(batch, target_schema, rename_columns)
+                with metrics.phase("write"):
+                    writer.write_batch(conformed)
+                rows += batch.num_rows
+                metrics.add(rows=batch.num_rows)
+    metrics.finish()
+    return rows
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Merge datasets from Hugging Face")
     parser.add_argument(
-        "dataset_names", help="Comma-separated list of Hugging Face dataset names")
+        "dataset_names", help="Comma-separated list of Hugging Face dataset names or local Parquet/JSONL files")
     parser.add_argument(
         "output_file", help="Path to save the merged dataset as a Parquet file")
     parser.add_argument(
         "--rename_columns", type=str, help="JSON string to rename columns (e.g., '{\"old_name\": \"new_name\"}')")
     parser.add_argument(
         "--drop_columns", type=str, help="Comma-separated list of columns to drop")
+    parser.add_argument(
+        "--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Number of rows per record batch")
+    add_shard_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     dataset_names = args.dataset_names.split(',')
     rename_columns = json.loads(args.rename_columns) if args.rename_columns else None
     drop_columns = args.drop_columns.split(',') if args.drop_columns else None
 
-    result = merge_datasets(dataset_names, rename_columns=rename_columns, drop_columns=drop_columns)
-
-    # Save the result to a parquet file
-    result.to_parquet(args.output_file, index=False)
-    print(f"Merged dataset saved to {args.output_file}")
+    metrics = Metrics("merge_datasets", dataset_names, args.metrics_out, args.profile, unit="rows")
+    rows = merge_datasets(dataset_names, args.output_file, rename_columns=rename_columns,
+                          drop_columns=drop_columns, batch_size=args.batch_size, shards=shard_options(args),
+                          metrics=metrics)
+    if shard_options(args):
+        print(f"Merged dataset with {rows} rows saved as shards listed in {manifest_path(args.output_file)}")
+    else:
+        print(f"Merged dataset with {rows} rows saved to {args.output_file}")
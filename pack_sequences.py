@@ -0,0 +1,221 @@
+"""
+Token-Budget Sequence Packer
+
+Packs whole conversations from a JSONL file into bins of at most max_tokens tokens (e.g. 4096, 8192 or
+32768 token context windows) and reports how full the bins are.
+
+Tokens are counted with tiktoken over the content of every message, in parallel over the file. Bins are
+filled with first-fit-decreasing: conversations are placed from longest to shortest, each into the first
+bin that still has room. The first bin with room is found through a segment tree over the remaining
+capacity of the bins, so each placement costs O(log n) instead of a scan over all open bins.
+Conversations longer than max_tokens can never fit and are skipped.
+
+The packed bins are streamed to the output one per line, reading the conversations back through the
+line index of the input file (see jsonl_index.py). Compressed inputs cannot be indexed, so the packed
+conversations are read back into memory in one pass over the file instead.
+
+Usage: python pack_sequences.py <input_file> <output_file> --max_tokens <max_tokens> [--encoding <encoding>] [--workers <workers>] [--cache [<cache_file>]] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input_file: Path to the input JSONL file
+- output_file: Path to save the packed JSONL file
+- max_tokens: Token budget of each bin
+- encoding: Optional tiktoken encoding name (default: cl100k_base)
+- workers: Optional number of worker processes (default: 1)
+- cache: Optional token count cache file, reused across runs (default when given without a path: token_cache.sqlite)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python pack_sequences.py train.jsonl train_packed_8k.jsonl --max_tokens 8192 --workers 16
+
+Input JSONL Example:
+{"messages": [{"content": "Hello", "role": "user"}, {"content": "Hi there!", "role": "assistant"}]}
+
+Output JSONL Example:
+{"num_tokens": 8170, "rows": [12, 5, 873], "conversations": [{"messages": [...]}, {"messages": [...]}, {"messages": [...]}]}
+
+Output Report Example:
+Packed 835 conversations (619749 tokens) into 76 bins of 8192 tokens
+Fill efficiency: 99.54%
+Skipped 2 conversations longer than 8192 tokens
+"""
+
+import argparse
+import json
+import uuid
+from contextlib import contextmanager
+from functools import partial
+from typing import List, Optional
+
+import numpy as np
+
+from compressed_io import add_compression_arguments, is_compressed, open_file
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_line_batches
+from jsonl_index import JsonlIndex
+from token_cache import DEFAULT_CACHE_PATH, TokenCache, format_cache_stats, open_token_cache
+from token_counter import DEFAULT_ENCODING, TokenCounter
+
+
+def count_conversation_tokens(lines, encoding_name=DEFAULT_ENCODING, num_threads=8, cache_path=None,
+                              run_id=None) -> List[Optional[int]]:
+    """Returns the token count of every message content of each JSONL line, or None for unusable lines."""
+    contents = []
+    for line in lines:
+        try:
+            messages = json.loads(line)['messages']
+            contents.append([message['content'] or "" for message in messages])
+        except (json.JSONDecodeError, KeyError, TypeError):
+            contents.append(None)
+
+    cache = open_token_cache(cache_path, run_id) if cache_path else None
+    counter = TokenCounter(encoding_name, num_threads, cache)
+    counts = iter(counter.count_conversations([texts for texts in contents if texts is not None]).conversation_tokens)
+    return [None if texts is None else next(counts) for texts in contents]
+
+
+class CapacityTree:
+    """Segment tree over the remaining capacity of the bins, answering "first bin with room" in O(log n)."""
+
+    def __init__(self, num_bins: int, capacity: int):
+        size = 1
+        while size < max(num_bins, 1):
+            size *= 2
+        self.size = size
+        # Unopened bins hold the full capacity, so the first fit naturally opens the next new bin
+        self.tree = [capacity] * (2 * size)
+
+    def first_fit(self, tokens: int) -> int:
+        """Returns the index of the first bin with at least tokens of room left."""
+        tree = self.tree
+        node = 1
+        while node < self.size:
+            node *= 2
+            if tree[node] < tokens:
+                node += 1
+        return node - self.size
+
+    def take(self, bin_index: int, tokens: int):
+        tree = self.tree
+        node = bin_index + self.size
+        tree[node] -= tokens
+        node //= 2
+        while node:
+            left = tree[2 * node]
+            right = tree[2 * node + 1]
+            tree[node] = left if left > right else right
+            node //= 2
+
+
+def first_fit_decreasing(token_counts: np.ndarray, max_tokens: int) -> List[List[int]]:
+    """Returns the bins as lists of item indices, placing the largest items first."""
+    order = np.argsort(-token_counts, kind='stable')
+    tree = CapacityTree(len(token_counts), max_tokens)
+    bins = []
+    for item, tokens in zip(order.tolist(), token_counts[order].tolist()):
+        bin_index = tree.first_fit(tokens)
+        tree.take(bin_index, tokens)
+        if bin_index == len(bins):
+            bins.append([])
+        bins[bin_index].append(item)
+    return bins
+
+
+@contextmanager
+def open_records(input_file, rows):
+    """Yields a function returning the parsed record of any of the given rows (0-based) of input_file."""
+    if not is_compressed(input_file):
+        with JsonlIndex(input_file) as index:
+            yield index.get_record
+        return
+
+    wanted = set(rows)
+    lines = {}
+    with open_file(input_file, 'rb') as f:
+        for row, line in enumerate(f):
+            if row in wanted:
+                lines[row] = line
+    yield lambda row: json.loads(lines.pop(row))
+
+
+def pack_sequences(input_file, output_file, max_tokens, encoding_name=DEFAULT_ENCODING, workers=1, cache_path=None,
+                   compression_level=None, metrics=None):
+    metrics = metrics or Metrics("pack_sequences", [input_file])
+    run_id = uuid.uuid4().hex
+    # Let each worker use a single tokenizer thread so processes do not oversubscribe the cores
+    batch_func = partial(count_conversation_tokens, encoding_name=encoding_name,
+                         num_threads=8 if workers <= 1 else 1, cache_path=cache_path, run_id=run_id)
+
+    rows = []
+    token_counts = []
+    skipped_invalid = 0
+    skipped_oversized = 0
+    results = map_line_batches(input_file, batch_func, workers, on_range=metrics.add_bytes)
+    for line_number, tokens in metrics.timed(results, "count"):
+        metrics.add(rows=1)
+        if tokens is None:
+            skipped_invalid += 1
+        elif tokens > max_tokens:
+            skipped_oversized += 1
+        else:
+            rows.append(line_number - 1)
+            token_counts.append(tokens)
+
+    with metrics.phase("pack"):
+        token_counts = np.array(token_counts, dtype=np.int64)
+        bins = first_fit_decreasing(token_counts, max_tokens)
+
+    with metrics.phase("write"), open_records(input_file, rows) as get_record, \
+            open_file(output_file, 'w', compression_level) as f:
+        for items in bins:
+            bin_rows = [rows[item] for item in items]
+            packed = {
+                "num_tokens": int(token_counts[items].sum()),
+                "rows": [row + 1 for row in bin_rows],
+                "conversations": [get_record(row) for row in bin_rows],
+            }
+            f.write(json.dumps(packed, ensure_ascii=False) + "\n")
+
+    total_tokens = int(token_counts.sum())
+    print(f"Packed {len(rows)} conversations ({total_tokens} tokens) into {len(bins)} bins of {max_tokens} tokens")
+    if bins:
+        print(f"Fill efficiency: {total_tokens / (len(bins) * max_tokens):.2%}")
+    if skipped_oversized:
+        print(f"Skipped {skipped_oversized} conversations longer than {max_tokens} tokens")
+    if skipped_invalid:
+        print(f"Skipped {skipped_invalid} lines without valid JSON messages")
+    if cache_path:
+        with TokenCache(cache_path, run_id=run_id) as cache:
+            hits, misses = cache.finish_run()
+        print(format_cache_stats(hits, misses))
+        metrics.count("cache_hits", hits)
+        metrics.count("cache_misses", misses)
+    metrics.count("bins", len(bins))
+    metrics.count("tokens", total_tokens)
+    metrics.finish()
+    return len(bins)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack whole conversations into fixed token budget bins")
+    parser.add_argument(
+        "input_file", help="Path to input JSONL file")
+    parser.add_argument(
+        "output_file", help="Path to save the packed JSONL file")
+    parser.add_argument(
+        "--max_tokens", type=int, required=True, help="Token budget of each bin")
+    parser.add_argument(
+        "--encoding", default=DEFAULT_ENCODING, help="tiktoken encoding name")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument(
+        "--cache", nargs="?", const=DEFAULT_CACHE_PATH, help="Token count cache file reused across runs")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("pack_sequences", [args.input_file], args.metrics_out, args.profile)
+    pack_sequences(args.input_file, args.output_file, args.max_tokens, args.encoding, args.workers, args.cache,
+                   args.compression_level, metrics)
@@ -0,0 +1,293 @@
+"""
+Dataset Profiler
+
+Profiles a JSONL dataset of conversations ('messages' lists of role/content messages) in a single
+streaming pass: turns per conversation, the role mix, character and token lengths per role and per
+conversation, the share of empty contents and the share of system messages.
+
+Percentiles come from KLL sketches (see quantile_sketch.py), so memory stays flat whatever the size of the
+dataset. Each worker process profiles its own blocks of lines and the partial profiles are merged in file
+order, so the report does not depend on the number of workers.
+
+Usage: python profile_dataset.py <input_file> [--report <report_file>] [--encoding <encoding>] [--no_tokens] [--sketch_size <k>] [--workers <workers>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input_file: Path to the input JSONL file
+- report_file: Optional path to save the JSON report (default: print to stdout after the summary)
+- encoding: Optional tiktoken encoding name (default: cl100k_base)
+- no_tokens: Optional flag to skip tokenizing, only characters are measured
+- sketch_size: Optional k of the quantile sketches, larger is more accurate (default: 200, about 1.7% rank error)
+- workers: Optional number of worker processes (default: 1)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python profile_dataset.py train.jsonl.zst --report train_profile.json --workers 16
+
+Input JSONL Example:
+{"messages": [{"content": "You are a helpful assistant.", "role": "system"}, {"content": "Hello", "role": "user"}, {"content": "Hi there!", "role": "assistant"}]}
+
+Output:
+Profile of train.jsonl.zst: 100000 conversations, 0 invalid JSON, 0 without a messages list, 0 empty lines
+Messages: 612408 (6.12 per conversation), 0.41% empty
+System messages: 8.17% of messages, in 50.01% of conversations
+
+                 mean      p50      p90      p95      p99      max
+turns            6.12        6       10       12       14       16
+chars          2416.9     2210     4120     4580     5310     6912
+tokens          612.3      560     1040     1157     1341     1750
+
+role         messages   share   empty  conversations   chars p50/p90/p99  tokens p50/p90/p99
+user           256201  41.84%   0.00%        100.00%         300/602/698          77/151/175
+assistant      306200  50.00%   0.82%        100.00%        498/902/1010         125/226/253
+system          50007   8.17%   0.00%         50.01%         108/170/180            27/43/45
+
+Report Example:
+{"file": "train.jsonl.zst", "encoding": "cl100k_base", "lines": 100000, "conversations": 100000, "invalid_json": 0, "invalid_messages": 0, "empty_lines": 0,
+ "messages": 612408, "empty_messages": 2511, "empty_share": 0.0041, "system_messages": 50007, "system_share": 0.0817, "conversations_with_system": 50007, "conversations_with_system_share": 0.5001,
+ "turns": {"count": 100000, "mean": 6.12, "min": 2.0, "max": 16.0, "p50": 6.0, "p90": 10.0, "p95": 12.0, "p99": 14.0}, "chars": {...}, "tokens": {...},
+ "roles": {"user": {"messages": 256201, "share": 0.4184, "empty": 0, "empty_share": 0.0, "conversations": 100000, "conversations_share": 1.0, "chars": {...}, "tokens": {...}}, ...}}
+"""
+
+import argparse
+import json
+from collections import Counter
+from functools import partial
+
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_blocks, split_lines
+from quantile_sketch import DEFAULT_K, KLLSketch
+from token_counter import DEFAULT_ENCODING, TokenCounter
+
+COUNTS = ("lines", "conversations", "invalid_json", "invalid_messages", "empty_lines", "messages",
+          "empty_messages", "system_messages", "conversations_with_system")
+
+
+class RoleProfile:
+    def __init__(self, k=DEFAULT_K):
+        self.messages = 0
+        self.empty = 0
+        self.conversations = 0
+        self.chars = KLLSketch(k)
+        self.tokens = KLLSketch(k)
+
+    def merge(self, other):
+        self.messages += other.messages
+        self.empty += other.empty
+        self.conversations += other.conversations
+        self.chars.merge(other.chars)
+        self.tokens.merge(other.tokens)
+
+
+class DatasetProfile:
+    def __init__(self, k=DEFAULT_K):
+        self.k = k
+        self.counts = Counter({name: 0 for name in COUNTS})
+        self.roles = {}
+        self.turns = KLLSketch(k)
+        self.chars = KLLSketch(k)
+        self.tokens = KLLSketch(k)
+
+    def role(self, name):
+        if name not in self.roles:
+            self.roles[name] = RoleProfile(self.k)
+        return self.roles[name]
+
+    def merge(self, other: "DatasetProfile"):
+        """Adds a partial profile (e.g. of another block of lines) to this one."""
+        self.counts.update(other.counts)
+        for name, role in other.roles.items():
+            self.role(name).merge(role)
+        self.turns.merge(other.turns)
+        self.chars.merge(other.chars)
+        self.tokens.merge(other.tokens)
+
+    def report(self) -> dict:
+        counts = self.counts
+        report = dict(counts)
+        report["empty_share"] = _share(counts["empty_messages"], counts["messages"])
+        report["system_share"] = _share(counts["system_messages"], counts["messages"])
+        report["conversations_with_system_share"] = _share(counts["conversations_with_system"], counts["conversations"])
+        report["turns"] = self.turns.summary()
+        report["chars"] = self.chars.summary()
+        report["tokens"] = self.tokens.summary() if self.tokens.count else None
+        # Roles from the most to the least common
+        report["roles"] = {
+            name: {
+                "messages": role.messages,
+                "share": _share(role.messages, counts["messages"]),
+                "empty": role.empty,
+                "empty_share": _share(role.empty, role.messages),
+                "conversations": role.conversations,
+                "conversations_share": _share(role.conversations, counts["conversations"]),
+                "chars": role.chars.summary(),
+                "tokens": role.tokens.summary() if role.tokens.count else None,
+            }
+            for name, role in sorted(self.roles.items(), key=lambda item: -item[1].messages)
+        }
+        return report
+
+
+def _share(count, total):
+    return count / total if total else 0.0
+
+
+def _content_text(content):
+    if content is None or isinstance(content, str):
+        return content or ""
+    # e.g. a list of content parts
+    return json.dumps(content, ensure_ascii=False)
+
+
+def profile_block(data, encoding_name=DEFAULT_ENCODING, count_tokens=True, k=DEFAULT_K):
+    """Returns the DatasetProfile of a block of JSONL lines."""
+    profile = DatasetProfile(k)
+    counts = profile.counts
+    conversations = []
+    for line in split_lines(data):
+        counts["lines"] += 1
+        if not line.strip():
+            counts["empty_lines"] += 1
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            counts["invalid_json"] += 1
+            continue
+        messages = row.get('messages') if isinstance(row, dict) else None
+        if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+            counts["invalid_messages"] += 1
+            continue
+        conversations.append([(str(message.get('role')), _content_text(message.get('content')))
+                              for message in messages])
+
+    # Every non-empty content of the block is tokenized in one batch
+    texts = [text for conversation in conversations for _, text in conversation if text]
+    token_counts = iter(TokenCounter(encoding_name, num_threads=1).count_batch(texts) if count_tokens else [])
+
+    role_chars, role_tokens = {}, {}
+    turns, chars, tokens = [], [], []
+    for conversation in conversations:
+        conversation_chars = conversation_tokens = 0
+        for name, text in conversation:
+            role = profile.role(name)
+            role.messages += 1
+            message_tokens = next(token_counts) if count_tokens and text else 0
+            if not text:
+                role.empty += 1
+            role_chars.setdefault(name, []).append(len(text))
+            role_tokens.setdefault(name, []).append(message_tokens)
+            conversation_chars += len(text)
+            conversation_tokens += message_tokens
+        for name in {name for name, _ in conversation}:
+            profile.role(name).conversations += 1
+        turns.append(len(conversation))
+        chars.append(conversation_chars)
+        tokens.append(conversation_tokens)
+
+    counts["conversations"] = len(conversations)
+    counts["messages"] = sum(turns)
+    counts["empty_messages"] = sum(role.empty for role in profile.roles.values())
+    if "system" in profile.roles:
+        counts["system_messages"] = profile.roles["system"].messages
+        counts["conversations_with_system"] = profile.roles["system"].conversations
+
+    # Each sketch takes the whole block at once
+    profile.turns.update(turns)
+    profile.chars.update(chars)
+    for name, lengths in role_chars.items():
+        profile.roles[name].chars.update(lengths)
+    if count_tokens:
+        profile.tokens.update(tokens)
+        for name, lengths in role_tokens.items():
+            profile.roles[name].tokens.update(lengths)
+    return profile
+
+
+def profile_dataset(input_file, encoding_name=DEFAULT_ENCODING, count_tokens=True, k=DEFAULT_K, workers=1,
+                    metrics=None) -> dict:
+    """Profiles the dataset in one pass and returns the report."""
+    metrics = metrics or Metrics("profile_dataset", [input_file])
+    profile = DatasetProfile(k)
+    block_func = partial(profile_block, encoding_name=encoding_name, count_tokens=count_tokens, k=k)
+    for block_profile in metrics.timed(map_blocks(input_file, block_func, workers, on_range=metrics.add_bytes),
+                                       "profile"):
+        with metrics.phase("merge"):
+            profile.merge(block_profile)
+        metrics.add(rows=block_profile.counts["lines"])
+
+    report = {"file": input_file, "encoding": encoding_name if count_tokens else None}
+    report.update(profile.report())
+    for name in ("conversations", "invalid_json", "invalid_messages", "empty_lines"):
+        metrics.count(name, report[name])
+    metrics.finish()
+    return report
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    return f"{value:.0f}"
+
+
+def format_summary(report) -> str:
+    """Returns a compact text summary of a report."""
+    conversations = report["conversations"]
+    lines = [
+        f"Profile of {report['file']}: {conversations} conversations, {report['invalid_json']} invalid JSON, "
+        f"{report['invalid_messages']} without a messages list, {report['empty_lines']} empty lines",
+        f"Messages: {report['messages']} ({_share(report['messages'], conversations):.2f} per conversation), "
+        f"{report['empty_share']:.2%} empty",
+        f"System messages: {report['system_share']:.2%} of messages, "
+        f"in {report['conversations_with_system_share']:.2%} of conversations",
+        "",
+        f"{'':<12}" + "".join(f"{column:>9}" for column in ("mean", "p50", "p90", "p95", "p99", "max")),
+    ]
+    for name in ("turns", "chars", "tokens"):
+        stats = report[name]
+        if stats is None or not stats["count"]:
+            continue
+        mean = f"{stats['mean']:.2f}" if name == "turns" else f"{stats['mean']:.1f}"
+        lines.append(f"{name:<12}{mean:>9}" + "".join(f"{_format_value(stats[column]):>9}"
+                                                     for column in ("p50", "p90", "p95", "p99", "max")))
+
+    if report["roles"]:
+        lines.append("")
+        lines.append(f"{'role':<12}{'messages':>9}{'share':>8}{'empty':>8}{'conversations':>15}"
+                     f"{'chars p50/p90/p99':>20}{'tokens p50/p90/p99':>20}")
+        for name, role in report["roles"].items():
+            lengths = ["/".join(_format_value(stats[column]) for column in ("p50", "p90", "p99"))
+                       if stats is not None else "-" for stats in (role["chars"], role["tokens"])]
+            lines.append(f"{name[:12]:<12}{role['messages']:>9}{role['share']:>8.2%}{role['empty_share']:>8.2%}"
+                         f"{role['conversations_share']:>15.2%}{lengths[0]:>20}{lengths[1]:>20}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the conversations of a JSONL dataset in one pass")
+    parser.add_argument(
+        "input_file", help="Path to input JSONL file")
+    parser.add_argument(
+        "--report", help="Path to save the JSON report (default: print to stdout after the summary)")
+    parser.add_argument(
+        "--encoding", default=DEFAULT_ENCODING, help="tiktoken encoding name")
+    parser.add_argument(
+        "--no_tokens", action="store_true", help="Skip tokenizing, only measure characters")
+    parser.add_argument(
+        "--sketch_size", type=int, default=DEFAULT_K, help="k of the quantile sketches, larger is more accurate")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("profile_dataset", [args.input_file], args.metrics_out, args.profile)
+    report = profile_dataset(args.input_file, args.encoding, not args.no_tokens, args.sketch_size, args.workers,
+                             metrics)
+    print(format_summary(report))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {args.report}")
+    else:
+        print()
+        print(json.dumps(report, indent=2))
@@ -3,11 +3,15 @@ JSONL Processor
 
 Processes a JSONL file by removing the last message if it is from the user.
 
-Usage: python process_jsonl_file.py <input_file> <output_file>
+Usage: python process_jsonl_file.py <input_file> <output_file> [--workers <workers>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
 
 Input:
 - input_file: Path to the input JSONL file
 - output_file: Path to save the processed JSONL file
+- workers: Optional number of worker processes (default: 1)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
 
 Example:
 python process_jsonl_file.py augmented_conversations_hf.jsonl augmented_conversations_hf_modified.jsonl
@@ -21,23 +25,34 @@ Output JSONL Example:
 
 import json
 import argparse
+from compressed_io import add_compression_arguments, open_file
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_lines
 
-def process_jsonl_file(input_file, output_file):
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-        for line in infile:
-            data = json.loads(line.strip())
-            messages = data.get('messages', [])
+def remove_last_user_message(data):
+    messages = data.get('messages', [])
 
-            # Remove the last message if it's from the user
-            if messages and messages[-1]['role'] == 'user':
-                messages.pop()
+    # Remove the last message if it's from the user
+    if messages and messages[-1]['role'] == 'user':
+        messages.pop()
 
-            # Update the messages in the data
-            data['messages'] = messages
+    # Update the messages in the data
+    data['messages'] = messages
+    return data
 
+def process_line(line):
+    return json.dumps(remove_last_user_message(json.loads(line.strip())))
+
+def process_jsonl_file(input_file, output_file, workers=1, compression_level=None, metrics=None):
+    metrics = metrics or Metrics("remove_last_user_message", [input_file])
+    with open_file(output_file, 'w', compression_level) as outfile:
+        results = map_lines(input_file, process_line, workers, on_range=metrics.add_bytes)
+        for _, processed in metrics.timed(results, "process"):
             # Write the modified data to the output file
-            json.dump(data, outfile)
-            outfile.write('\n')
+            with metrics.phase("write"):
+                outfile.write(processed + '\n')
+            metrics.add(rows=1)
+    metrics.finish()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process JSONL file by removing the last user message")
@@ -45,6 +60,11 @@ if __name__ == "__main__":
         "input_file", help="Path to input JSONL file")
     parser.add_argument(
         "output_file", help="Path to save the processed JSONL file")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    process_jsonl_file(args.input_file, args.output_file)
+    metrics = Metrics("remove_last_user_message", [args.input_file], args.metrics_out, args.profile)
+    process_jsonl_file(args.input_file, args.output_file, args.workers, args.compression_level, metrics)
@@ -0,0 +1,97 @@
+"""
+Role Sequence Patterns
+
+Compiles a set of role-sequence patterns into a single regular expression over a one-character-per-role
+encoding of each conversation, so every conversation is scanned once whatever the number of patterns.
+Each pattern sits in its own lookahead, so all patterns are tested at every message position in the
+same pass, and matches report the index of the message where they start.
+
+Pattern syntax:
+- role names ('system', 'user', 'assistant', 'tool', or any other role) match one message with that role
+- '.' matches a message with any role
+- quantifiers '{m}', '{m,}', '{m,n}', '+', '*', '?' apply to the preceding role or group
+- '(' ')' group and '|' separates alternatives
+- '^' and '$' anchor to the start and end of the conversation
+- whitespace between tokens is optional
+
+Examples: 'assistant{2,}user', '^user', 'user user', '^system? (user assistant)+$'
+
+Python Example:
+from role_patterns import RolePatternSet
+
+patterns = RolePatternSet({"double_assistant": "assistant{2,}user", "starts_with_user": "^user"})
+patterns.scan(["user", "assistant", "assistant", "user"])  # [('starts_with_user', 0), ('double_assistant', 1)]
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+ROLE_CODES = {"system": "s", "user": "u", "assistant": "a", "tool": "t", "function": "f"}
+
+# Roles not named by any pattern all encode to this character
+OTHER_ROLE = "\uE000"
+
+_TOKEN = re.compile(r"\s*(?:(?P<role>[A-Za-z_][\w-]*)|(?P<quantifier>\{\d+(?:,\d*)?\}|[+*?])|(?P<symbol>[.()|^$]))")
+
+
+class RolePatternSet:
+    def __init__(self, patterns: Dict[str, str]):
+        self.patterns = dict(patterns)
+        self.role_codes = dict(ROLE_CODES)
+
+        branches = []
+        self._groups = []
+        for i, (name, expression) in enumerate(self.patterns.items()):
+            regex = self._translate(expression)
+            if re.fullmatch(regex, ""):
+                raise ValueError(f"Pattern {name!r} ({expression}) matches an empty conversation")
+            group = f"p{i}"
+            branches.append(f"(?:(?=(?P<{group}>{regex})))?")
+            self._groups.append((name, group))
+
+        # Only stop at positions where at least one of the lookaheads matched
+        at_least_one = "(?!)"
+        for _, group in reversed(self._groups):
+            at_least_one = f"(?({group})|{at_least_one})"
+        self.regex = re.compile("".join(branches) + at_least_one, re.DOTALL)
+
+    def _translate(self, expression):
+        parts = []
+        position = 0
+        expression = expression.strip()
+        while position < len(expression):
+            match = _TOKEN.match(expression, position)
+            if not match or match.end() == position:
+                raise ValueError(f"Invalid role pattern {expression!r} at position {position}")
+            position = match.end()
+            if match.group("role"):
+                parts.append(re.escape(self._role_code(match.group("role"))))
+            elif match.group("quantifier"):
+                parts.append(match.group("quantifier"))
+            else:
+                parts.append(match.group("symbol"))
+        regex = "".join(parts)
+        try:
+            re.compile(regex)
+        except re.error as e:
+            raise ValueError(f"Invalid role pattern {expression!r}: {e}") from e
+        return regex
+
+    def _role_code(self, role):
+        if role not in self.role_codes:
+            self.role_codes[role] = chr(0xE001 + len(self.role_codes))
+        return self.role_codes[role]
+
+    def encode(self, roles: List[str]) -> str:
+        """Returns the one-character-per-role string the patterns are matched against."""
+        codes = self.role_codes
+        return "".join(codes.get(role, OTHER_ROLE) for role in roles)
+
+    def scan(self, roles: List[str]) -> List[Tuple[str, int]]:
+        """Returns (pattern name, start index) for every match, ordered by start index."""
+        matches = []
+        for match in self.regex.finditer(self.encode(roles)):
+            for name, group in self._groups:
+                if match.start(group) != -1:
+                    matches.append((name, match.start()))
+        return matches
@@ -0,0 +1,203 @@
+"""
+Row Predicates
+
+Compiles row filter expressions such as `label == true` or `len(response) > 50` into pyarrow compute
+expressions, so rows are filtered over whole record batches and Parquet readers can skip row groups whose
+statistics rule the predicate out.
+
+Predicate syntax (a subset of Python expressions):
+- column names, with '.' for struct fields ('meta.source') and col("name") for names that are not identifiers
+- literals: numbers, 'strings' or "strings", true/false, null (Python's True/False/None also work)
+- comparisons '==', '!=', '<', '<=', '>', '>=', chained comparisons ('0 < score <= 1')
+- 'x in [...]' and 'x not in [...]' against a list of literals
+- 'x == null', 'x != null' (or 'is' / 'is not') test for missing values
+- 'and', 'or', 'not' and parentheses
+- arithmetic '+', '-', '*', '/'
+- functions: len(x) (characters of a string, items of a list), lower(x), upper(x), contains(x, "text"),
+  startswith(x, "text"), endswith(x, "text")
+
+Rows where the predicate is null (e.g. a comparison with a missing value) are dropped.
+
+Python Example:
+from row_predicates import RowPredicate
+
+predicate = RowPredicate("label == true and len(response) > 50")
+predicate.columns                    # ['label', 'response']
+batch.filter(predicate.expression(batch.schema))
+"""
+
+import ast
+import operator
+from typing import List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+KEYWORDS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+ARITHMETIC = {
+    ast.Add: pc.add,
+    ast.Sub: pc.subtract,
+    ast.Mult: pc.multiply,
+    ast.Div: pc.divide,
+}
+
+STRING_FUNCTIONS = {
+    "contains": pc.match_substring,
+    "startswith": pc.starts_with,
+    "endswith": pc.ends_with,
+}
+
+
+class RowPredicate:
+    def __init__(self, text: str):
+        self.text = text
+        try:
+            self.tree = ast.parse(text.strip(), mode="eval").body
+        except SyntaxError as e:
+            raise ValueError(f"Invalid predicate {text!r}: {e.msg}") from None
+        # Compiling once without a schema checks the syntax and collects the columns it reads
+        self.columns: List[str] = []
+        self._compile(self.tree, None, self.columns)
+
+    def expression(self, schema: Optional[pa.Schema] = None) -> pc.Expression:
+        """Returns the predicate as a pyarrow expression, schema resolves what len() counts."""
+        return _as_expression(self._compile(self.tree, schema, []))
+
+    def _unsupported(self, node):
+        return ValueError(f"Unsupported expression in predicate {self.text!r}: {ast.unparse(node)}")
+
+    def _compile(self, node, schema, columns):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id in KEYWORDS:
+                return KEYWORDS[node.id]
+            return self._field((node.id,), columns)
+        if isinstance(node, ast.Attribute):
+            return self._field(self._field_path(node), columns)
+        if isinstance(node, ast.BoolOp):
+            values = [_as_expression(self._compile(value, schema, columns)) for value in node.values]
+            combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+            result = values[0]
+            for value in values[1:]:
+                result = combine(result, value)
+            return result
+        if isinstance(node, ast.UnaryOp):
+            operand = self._compile(node.operand, schema, columns)
+            if isinstance(node.op, ast.Not):
+                return ~_as_expression(operand)
+            if isinstance(node.op, ast.USub):
+                return pc.negate(operand) if isinstance(operand, pc.Expression) else -operand
+            if isinstance(node.op, ast.UAdd):
+                return operand
+        if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC:
+            return ARITHMETIC[type(node.op)](_as_expression(self._compile(node.left, schema, columns)),
+                                             _as_expression(self._compile(node.right, schema, columns)))
+        if isinstance(node, ast.Compare):
+            left = self._compile(node.left, schema, columns)
+            result = None
+            for i, (op, comparator) in enumerate(zip(node.ops, node.comparators)):
+                test = self._compare(op, left, comparator, schema, columns)
+                result = test if result is None else result & test
+                if i + 1 < len(node.ops):
+                    left = self._compile(comparator, schema, columns)
+            return result
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            return self._call(node, schema, columns)
+        raise self._unsupported(node)
+
+    def _compare(self, op, left, comparator, schema, columns):
+        if isinstance(op, (ast.In, ast.NotIn)):
+            if not isinstance(comparator, (ast.List, ast.Tuple, ast.Set)):
+                raise self._unsupported(comparator)
+            values = [self._compile(item, schema, columns) for item in comparator.elts]
+            if any(isinstance(value, pc.Expression) for value in values):
+                raise self._unsupported(comparator)
+            test = _as_expression(left).isin(values)
+            return ~test if isinstance(op, ast.NotIn) else test
+
+        right = self._compile(comparator, schema, columns)
+        if isinstance(op, (ast.Is, ast.IsNot, ast.Eq, ast.NotEq)) and (left is None or right is None):
+            value = _as_expression(right if left is None else left)
+            return value.is_valid() if isinstance(op, (ast.IsNot, ast.NotEq)) else value.is_null()
+        if type(op) not in COMPARISONS:
+            raise self._unsupported(comparator)
+        return COMPARISONS[type(op)](_as_expression(left), _as_expression(right))
+
+    def _call(self, node, schema, columns):
+        name = node.func.id
+        if name == "col" and len(node.args) == 1 and isinstance(node.args[0], ast.Constant):
+            return self._field((node.args[0].value,), columns)
+        if name == "len" and len(node.args) == 1:
+            value = _as_expression(self._compile(node.args[0], schema, columns))
+            value_type = self._value_type(node.args[0], schema)
+            if value_type is not None and (pa.types.is_list(value_type) or pa.types.is_large_list(value_type)
+                                           or pa.types.is_fixed_size_list(value_type)):
+                return pc.list_value_length(value)
+            if value_type is not None and (pa.types.is_binary(value_type) or pa.types.is_large_binary(value_type)):
+                return pc.binary_length(value)
+            return pc.utf8_length(value)
+        if name in ("lower", "upper") and len(node.args) == 1:
+            value = _as_expression(self._compile(node.args[0], schema, columns))
+            return pc.utf8_lower(value) if name == "lower" else pc.utf8_upper(value)
+        if name in STRING_FUNCTIONS and len(node.args) == 2:
+            pattern = self._compile(node.args[1], schema, columns)
+            if not isinstance(pattern, str):
+                raise self._unsupported(node)
+            return STRING_FUNCTIONS[name](_as_expression(self._compile(node.args[0], schema, columns)), pattern)
+        raise self._unsupported(node)
+
+    def _field_path(self, node):
+        if isinstance(node, ast.Attribute):
+            return self._field_path(node.value) + (node.attr,)
+        if isinstance(node, ast.Name) and node.id not in KEYWORDS:
+            return (node.id,)
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "col"
+                and len(node.args) == 1 and isinstance(node.args[0], ast.Constant)):
+            return (node.args[0].value,)
+        raise self._unsupported(node)
+
+    def _field(self, path, columns):
+        if not all(isinstance(name, str) for name in path):
+            raise ValueError(f"Column names must be strings in predicate {self.text!r}")
+        if path[0] not in columns:
+            columns.append(path[0])
+        return pc.field(*path)
+
+    def _value_type(self, node, schema):
+        """Returns the type of a column reference, or None for other expressions or unknown columns."""
+        if schema is None:
+            return None
+        try:
+            path = self._field_path(node)
+        except ValueError:
+            return None
+        if path[0] not in schema.names:
+            return None
+        value_type = schema.field(path[0]).type
+        for name in path[1:]:
+            if not pa.types.is_struct(value_type) or value_type.get_field_index(name) < 0:
+                return None
+            value_type = value_type.field(name).type
+        return value_type
+
+
+def _as_expression(value):
+    return value if isinstance(value, pc.Expression) else pc.scalar(value)
+
+
+def combine_predicates(texts: List[str]) -> Optional[RowPredicate]:
+    """Returns a predicate that holds when all of the predicates hold, or None for no predicates."""
+    if not texts:
+        return None
+    return RowPredicate(" and ".join(f"({text})" for text in texts))
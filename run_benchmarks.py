@@ -0,0 +1,257 @@
+"""
+Benchmark Suite
+
+Runs every tool on deterministic synthetic datasets (see generate_synthetic_data.py) at several sizes and
+records rows/sec, MB/sec and peak memory as a JSON baseline, so runs before and after a change can be
+compared.
+
+Each benchmark runs its script in a fresh Python process, exactly as from the command line. Wall time
+covers the whole process, including interpreter start-up and imports. Peak RSS is the largest resident
+set size of the script's process or any of its worker processes (measured with os.wait4, so it is not
+available on Windows). Generated datasets are kept in data_dir and reused by later runs with the same
+settings.
+
+Usage: python run_benchmarks.py [--sizes <sizes>] [--only <names>] [--output <output_file>] [--compare <baseline_file>] [--data_dir <data_dir>] [--workers <workers>] [--turns <turns>] [--content_length <content_length>] [--columns <columns>] [--seed <seed>]
+
+Input:
+- sizes: Optional comma-separated list of row counts (default: 1000,10000,100000)
+- only: Optional comma-separated list of benchmark names or name prefixes to run (default: all)
+- output_file: Optional path to save the results as JSON (default: benchmark_results.json)
+- baseline_file: Optional earlier results file to compare this run against
+- data_dir: Optional directory for the generated datasets and outputs (default: benchmark_data)
+- workers: Optional number of worker processes for the tools that support it (default: 1)
+- turns, content_length, columns, seed: Optional settings of the synthetic datasets (see generate_synthetic_data.py)
+
+Example:
+python run_benchmarks.py --sizes 10000,100000 --output baseline.json
+python run_benchmarks.py --sizes 10000,100000 --output after.json --compare baseline.json
+
+Output Example:
+convert_file_format:csv_to_parquet      100000 rows    2.31s    43290 rows/s   61.42 MB/s  peak RSS  212.4 MB
+...
+Comparison with baseline.json:
+convert_file_format:csv_to_parquet      100000 rows   43290 vs 21004 rows/s (2.06x)  peak RSS 212.4 vs 1630.2 MB
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Each benchmark names its input datasets as (shape, extension, seed offset) and the arguments of its
+# script, where {0}, {1}, ... are the input paths, {output} a path prefix for its outputs and
+# {workers} the worker count
+BENCHMARKS = [
+    {"name": "convert_file_format:csv_to_parquet", "inputs": [("wide", "csv", 0)],
+     "args": ["convert_file_format.py", "{0}", "{output}.parquet", "csv_to_parquet"]},
+    {"name": "convert_file_format:parquet_to_jsonl", "inputs": [("wide", "parquet", 0)],
+     "args": ["convert_file_format.py", "{0}", "{output}.jsonl", "parquet_to_jsonl"]},
+    {"name": "convert_file_format:jsonl_to_parquet", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["convert_file_format.py", "{0}", "{output}.parquet", "jsonl_to_parquet"]},
+    {"name": "compile_arrow", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["compile_arrow.py", "{0}", "{output}.arrow", "--workers", "{workers}"]},
+    {"name": "convert_dataset", "inputs": [("sharegpt", "jsonl", 0)],
+     "args": ["convert_dataset.py", "{0}", "{output}.jsonl", "--workers", "{workers}"]},
+    {"name": "transform_dataset", "inputs": [("nested", "jsonl", 0)],
+     "args": ["transform_dataset.py", "{0}", "--workers", "{workers}"]},
+    {"name": "validate_jsonl", "inputs": [("nested", "jsonl", 0)],
+     "args": ["validate_jsonl.py", "{0}", "--workers", "{workers}"]},
+    {"name": "validate_jsonl:schema", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["validate_jsonl.py", "{0}", "--schema", "chatml", "--workers", "{workers}"]},
+    {"name": "convert_format_and_count_tokens", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["convert_format_and_count_tokens.py", "{0}", "{output}.txt", "--quiet", "--workers", "{workers}"]},
+    {"name": "chat_templates", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["chat_templates.py", "{0}", "chatml={output}.chatml.txt", "llama3={output}.llama3.txt", "--workers", "{workers}"]},
+    {"name": "convert_kto_jsonl_to_txt", "inputs": [("kto", "jsonl", 0)],
+     "args": ["convert_kto_jsonl_to_txt.py", "{0}", "{output}.txt", "--workers", "{workers}"]},
+    {"name": "convert_preferences:kto_to_dpo", "inputs": [("kto", "jsonl", 0)],
+     "args": ["convert_preferences.py", "{0}", "{output}.jsonl", "kto_to_dpo"]},
+    {"name": "merge_datasets", "inputs": [("wide", "parquet", 0), ("wide", "parquet", 1)],
+     "args": ["merge_datasets.py", "{0},{1}", "{output}.parquet"]},
+    {"name": "filter_csv_columns", "inputs": [("wide", "csv", 0)],
+     "args": ["filter_csv_columns.py", "{0}", "{output}.csv", "id,int_0,str_2"]},
+    {"name": "filter_csv_columns:parquet_where", "inputs": [("wide", "parquet", 0)],
+     "args": ["filter_csv_columns.py", "{0}", "{output}.parquet", "id,int_0,str_2", "--where", "id < 1000"]},
+    {"name": "profile_dataset", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["profile_dataset.py", "{0}", "--report", "{output}.json", "--workers", "{workers}"]},
+    {"name": "check_message_order", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["check_message_order.py", "{0}", "--counts_only", "--workers", "{workers}"]},
+    {"name": "remove_last_user_message", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["remove_last_user_message.py", "{0}", "{output}.jsonl", "--workers", "{workers}"]},
+    {"name": "extract_random_samples", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["extract_random_samples.py", "{0}", "{output}.jsonl", "--num_samples", "1000"]},
+    {"name": "dedup_conversations", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["dedup_conversations.py", "{0}", "{output}.jsonl", "--workers", "{workers}"]},
+    {"name": "run_pipeline", "inputs": [("sharegpt", "jsonl", 0)],
+     "args": ["run_pipeline.py", "{0}", "{output}.jsonl", "--stages",
+              "convert_dataset,remove_last_user_message,transform_dataset,validate_jsonl:chatml",
+              "--workers", "{workers}"]},
+    {"name": "pack_sequences", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["pack_sequences.py", "{0}", "{output}.jsonl", "--max_tokens", "8192", "--workers", "{workers}"]},
+    {"name": "filter_by_tokens", "inputs": [("chatml", "jsonl", 0)],
+     "args": ["filter_by_tokens.py", "{0}", "{output}.jsonl", "--max_tokens", "1024", "--truncate",
+              "--workers", "{workers}"]},
+]
+
+
+def dataset_path(data_dir, shape, extension, rows, seed, settings):
+    name = f"{shape}_r{rows}_t{settings['turns']}_c{settings['content_length']}"
+    if shape == "wide":
+        name += f"_w{settings['columns']}"
+    return os.path.join(data_dir, f"{name}_s{seed}.{extension}")
+
+
+def ensure_dataset(data_dir, shape, extension, rows, seed, settings):
+    path = dataset_path(data_dir, shape, extension, rows, seed, settings)
+    if not os.path.exists(path):
+        # Generate under a temporary name so an interrupted run never leaves a partial dataset behind
+        tmp_path = path + ".tmp." + extension
+        # Generate in a separate process: Linux carries the peak RSS of this process over into every
+        # benchmark process it starts, so it must stay small
+        subprocess.run([sys.executable, "generate_synthetic_data.py", shape, tmp_path, "--rows", str(rows),
+                        "--turns", str(settings['turns']), "--content_length", str(settings['content_length']),
+                        "--columns", str(settings['columns']), "--seed", str(seed)],
+                       cwd=SCRIPT_DIR, check=True)
+        os.replace(tmp_path, path)
+    return path
+
+
+def run_command(command):
+    """Runs a command and returns (exit code, seconds, peak RSS in MB or None, last lines of stderr)."""
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, stderr=stderr)
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            peak_rss = usage.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+        else:
+            process.wait()
+            peak_rss = None
+        seconds = time.perf_counter() - start
+        stderr.seek(0)
+        error_tail = stderr.read().decode('utf-8', errors='replace').strip().splitlines()[-5:]
+    return process.returncode, seconds, peak_rss, error_tail
+
+
+def run_benchmark(benchmark, rows, data_dir, workers, settings):
+    inputs = [ensure_dataset(data_dir, shape, extension, rows, settings['seed'] + offset, settings)
+              for shape, extension, offset in benchmark['inputs']]
+    output = os.path.join(data_dir, f"out_{benchmark['name'].replace(':', '_')}_r{rows}")
+    command = [sys.executable] + [arg.format(*inputs, output=output, workers=workers) for arg in benchmark['args']]
+
+    returncode, seconds, peak_rss, error_tail = run_command(command)
+    input_mb = sum(os.path.getsize(path) for path in inputs) / (1 << 20)
+    input_rows = rows * len(inputs)
+    result = {
+        "name": benchmark['name'],
+        "rows": input_rows,
+        "input_mb": round(input_mb, 3),
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(input_rows / seconds, 1),
+        "mb_per_sec": round(input_mb / seconds, 3),
+        "peak_rss_mb": None if peak_rss is None else round(peak_rss, 1),
+        "returncode": returncode,
+    }
+    if returncode != 0:
+        result["error"] = "\n".join(error_tail)
+    return result
+
+
+def format_result(result):
+    rss = "n/a" if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:7.1f} MB"
+    line = (f"{result['name']:<40}{result['rows']:>9} rows {result['seconds']:>8.2f}s "
+            f"{result['rows_per_sec']:>10.0f} rows/s {result['mb_per_sec']:>8.2f} MB/s  peak RSS {rss}")
+    if result['returncode'] != 0:
+        line += f"  FAILED (exit code {result['returncode']})"
+    return line
+
+
+def compare_results(results, baseline_file):
+    with open(baseline_file, 'r') as f:
+        baseline = {(result['name'], result['rows']): result for result in json.load(f)['results']}
+
+    print(f"\nComparison with {baseline_file}:")
+    for result in results:
+        old = baseline.get((result['name'], result['rows']))
+        if old is None or old['returncode'] != 0 or result['returncode'] != 0:
+            continue
+        speedup = result['rows_per_sec'] / old['rows_per_sec'] if old['rows_per_sec'] else float('inf')
+        line = (f"{result['name']:<40}{result['rows']:>9} rows {result['rows_per_sec']:>10.0f} vs "
+                f"{old['rows_per_sec']:.0f} rows/s ({speedup:.2f}x)")
+        if result['peak_rss_mb'] is not None and old['peak_rss_mb'] is not None:
+            line += f"  peak RSS {result['peak_rss_mb']:.1f} vs {old['peak_rss_mb']:.1f} MB"
+        print(line)
+
+
+def run_benchmarks(sizes, output_file, only=None, baseline_file=None, data_dir="benchmark_data", workers=1,
+                   turns=4, content_length=400, columns=32, seed=42):
+    settings = {"turns": turns, "content_length": content_length, "columns": columns, "seed": seed}
+    benchmarks = [benchmark for benchmark in BENCHMARKS
+                  if not only or any(benchmark['name'].startswith(name) for name in only)]
+    if not benchmarks:
+        raise ValueError(f"No benchmarks match {', '.join(only)}")
+    os.makedirs(data_dir, exist_ok=True)
+
+    results = []
+    for rows in sizes:
+        for benchmark in benchmarks:
+            result = run_benchmark(benchmark, rows, data_dir, workers, settings)
+            print(format_result(result))
+            results.append(result)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": workers,
+        "sizes": sizes,
+        "settings": settings,
+        "results": results,
+    }
+    with open(output_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output_file}")
+
+    if baseline_file:
+        compare_results(results, baseline_file)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tools on synthetic datasets")
+    parser.add_argument(
+        "--sizes", default="1000,10000,100000", help="Comma-separated list of row counts")
+    parser.add_argument(
+        "--only", help="Comma-separated list of benchmark names or name prefixes to run")
+    parser.add_argument(
+        "--output", default="benchmark_results.json", help="Path to save the results as JSON")
+    parser.add_argument(
+        "--compare", help="Earlier results file to compare this run against")
+    parser.add_argument(
+        "--data_dir", default="benchmark_data", help="Directory for the generated datasets and outputs")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes for the tools that support it")
+    parser.add_argument(
+        "--turns", type=int, default=4, help="Number of user/assistant turns per conversation")
+    parser.add_argument(
+        "--content_length", type=int, default=400, help="Average number of characters per message or string cell")
+    parser.add_argument(
+        "--columns", type=int, default=32, help="Number of columns of the wide datasets")
+    parser.add_argument(
+        "--seed", type=int, default=42, help="Random seed of the generated datasets")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    only = args.only.split(',') if args.only else None
+    run_benchmarks(sizes, args.output, only, args.compare, args.data_dir, args.workers,
+                   args.turns, args.content_length, args.columns, args.seed)
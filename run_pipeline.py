@@ -0,0 +1,205 @@
+"""
+Fused Pipeline Runner
+
+Runs several preparation steps over a JSONL file in one streaming pass: each record is decoded once, goes
+through every stage in order, and is encoded once, instead of every script writing and re-parsing a full
+intermediate file.
+
+Stages (applied in the order given, built from the existing scripts):
+- convert_dataset: 'conversations' to 'messages' (process_dataset from convert_dataset.py)
+- remove_last_user_message: drops a trailing user message (remove_last_user_message.py)
+- transform_dataset: moves the system message first and keeps only 'messages'
+  (reorder_system_first from transform_dataset.py, accepts flat or nested 'messages')
+- validate_jsonl[:<schema>]: drops records that do not match a schema (schema_validator.py, default: chatml)
+
+Invalid JSON lines, records dropped by validation and records a stage cannot process (e.g. a message
+without a role, or a line that is not a JSON object) are counted and reported at the end.
+
+Usage: python run_pipeline.py <input_file> <output_file> --stages <stages> [--workers <workers>] [--compression_level <level>] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
+
+Input:
+- input_file: Path to the input JSONL file
+- output_file: Path to save the result as JSONL or Parquet (chosen by extension)
+- stages: Comma-separated list of stages
+- workers: Optional number of worker processes (default: 1)
+- compression_level: Optional compression level of compressed outputs such as .jsonl.gz or .jsonl.zst (default: the codec's default)
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
+
+Example:
+python run_pipeline.py sharegpt.jsonl train.parquet --stages convert_dataset,remove_last_user_message,transform_dataset,validate_jsonl:chatml --workers 32
+"""
+
+import argparse
+import json
+from functools import lru_cache, partial
+
+from batch_io import DEFAULT_BATCH_SIZE, detect_format, open_batch_writer, rows_to_batch
+from compressed_io import add_compression_arguments, open_file
+from convert_dataset import process_dataset
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_line_batches
+from remove_last_user_message import remove_last_user_message
+from schema_validator import get_validator
+from transform_dataset import reorder_system_first
+
+STAGE_NAMES = ["convert_dataset", "remove_last_user_message", "transform_dataset", "validate_jsonl"]
+
+
+class DropRecord(Exception):
+    """Raised by a stage to drop the current record, with the reason as message."""
+
+
+def transform_stage(record):
+    messages = record.get('messages') or []
+    if isinstance(messages, dict):
+        messages = messages.get('messages') or []
+    return {"messages": reorder_system_first(messages)}
+
+
+def validate_stage(record, schema):
+    error = get_validator(schema)(record)
+    if error is not None:
+        raise DropRecord(f"validate_jsonl:{error}")
+    return record
+
+
+def build_stage(spec):
+    name, _, argument = spec.partition(':')
+    if name == "convert_dataset":
+        return process_dataset
+    if name == "remove_last_user_message":
+        return remove_last_user_message
+    if name == "transform_dataset":
+        return transform_stage
+    if name == "validate_jsonl":
+        schema = argument or "chatml"
+        get_validator(schema)
+        return partial(validate_stage, schema=schema)
+    raise ValueError(f"Unknown stage {name!r}, expected one of {', '.join(STAGE_NAMES)}")
+
+
+@lru_cache(maxsize=None)
+def build_stages(stage_specs):
+    return [build_stage(spec) for spec in stage_specs]
+
+
+def run_stages(lines, stage_specs, encode):
+    """Returns ('ok', output) or ('dropped', reason) for each line, or None for an empty line."""
+    stages = build_stages(stage_specs)
+    results = []
+    for line in lines:
+        if not line.strip():
+            results.append(None)
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            results.append(('dropped', 'invalid_json'))
+            continue
+        stage_name = None
+        try:
+            for spec, stage in zip(stage_specs, stages):
+                stage_name = spec.partition(':')[0]
+                record = stage(record)
+        except DropRecord as e:
+            results.append(('dropped', str(e)))
+            continue
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            # A malformed record (e.g. a message without a role, or a line that is not an object) is dropped
+            # rather than stopping the run
+            results.append(('dropped', f'{stage_name}: {e}'))
+            continue
+        results.append(('ok', json.dumps(record, ensure_ascii=False) if encode else record))
+    return results
+
+
+def run_pipeline(input_file, output_file, stage_specs, workers=1, batch_size=DEFAULT_BATCH_SIZE, compression_level=None,
+                 metrics=None):
+    metrics = metrics or Metrics("run_pipeline", [input_file])
+    stage_specs = tuple(spec.strip() for spec in stage_specs)
+    # Build the stages once up front so unknown stages or schemas fail before any work starts
+    build_stages(stage_specs)
+
+    output_format = detect_format(output_file)
+    encode = output_format == "jsonl"
+    batch_func = partial(run_stages, stage_specs=stage_specs, encode=encode)
+
+    rows_in = 0
+    rows_out = 0
+    dropped = {}
+
+    if encode:
+        with open_file(output_file, 'w', compression_level) as f:
+            buffer = []
+            results = map_line_batches(input_file, batch_func, workers, on_range=metrics.add_bytes)
+            for _, result in metrics.timed(results, "process"):
+                if result is None:
+                    continue
+                rows_in += 1
+                status, value = result
+                if status == 'ok':
+                    buffer.append(value)
+                    rows_out += 1
+                    if len(buffer) >= batch_size:
+                        with metrics.phase("write"):
+                            f.write("\n".join(buffer) + "\n")
+                        buffer = []
+                else:
+                    dropped[value] = dropped.get(value, 0) + 1
+            with metrics.phase("write"):
+                if buffer:
+                    f.write("\n".join(buffer) + "\n")
+    else:
+        with open_batch_writer(output_file, output_format, compression_level) as writer:
+            records = []
+            results = map_line_batches(input_file, batch_func, workers, on_range=metrics.add_bytes)
+            for _, result in metrics.timed(results, "process"):
+                if result is None:
+                    continue
+                rows_in += 1
+                status, value = result
+                if status == 'ok':
+                    records.append(value)
+                    rows_out += 1
+                    if len(records) >= batch_size:
+                        with metrics.phase("encode"):
+                            batch = rows_to_batch(records)
+                        with metrics.phase("write"):
+                            writer.write_batch(batch)
+                        records = []
+                else:
+                    dropped[value] = dropped.get(value, 0) + 1
+            if records:
+                with metrics.phase("encode"):
+                    batch = rows_to_batch(records)
+                with metrics.phase("write"):
+                    writer.write_batch(batch)
+
+    print(f"Processed {rows_in} rows through {', '.join(stage_specs)}: {rows_out} written to {output_file}")
+    for reason, count in sorted(dropped.items(), key=lambda item: -item[1]):
+        print(f"Dropped {count} rows: {reason}")
+        metrics.count(f"dropped:{reason}", count)
+    metrics.add(rows=rows_in)
+    metrics.count("rows_out", rows_out)
+    metrics.finish()
+    return rows_out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several preparation stages over a JSONL file in one pass")
+    parser.add_argument(
+        "input_file", help="Path to input JSONL file")
+    parser.add_argument(
+        "output_file", help="Path to save the result as JSONL or Parquet")
+    parser.add_argument(
+        "--stages", required=True, help=f"Comma-separated list of stages ({', '.join(STAGE_NAMES)})")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = Metrics("run_pipeline", [args.input_file], args.metrics_out, args.profile)
+    run_pipeline(args.input_file, args.output_file, args.stages.split(','), args.workers,
+                 compression_level=args.compression_level, metrics=metrics)
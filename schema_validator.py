@@ -0,0 +1,129 @@
+"""
+Schema Validator
+
+Declarative record schemas for the dataset layouts the tools work with, compiled once into a
+validator function per schema.
+
+A schema is written in JSON-like notation: an object maps required field names to schemas, a
+one-element list means "list whose items all match this schema", and a string names the allowed
+types ('str', 'int', 'float', 'bool', 'null', 'any', or alternatives such as 'str|null').
+
+Built-in schemas:
+- chatml: {"messages": [{"role": "str", "content": "str"}]}
+- nested: {"messages": {"messages": [{"role": "str", "content": "str"}]}}
+- kto: {"query": "str", "response": "str", "label": "bool"}
+- sharegpt: {"conversations": [{"from": "str", "value": "str"}]}
+
+Validators return None for a valid record or an error class such as 'missing:messages' or
+'type:messages[].content:str', which is what reports are aggregated by.
+
+Example:
+from schema_validator import get_validator
+
+validate = get_validator("chatml")
+validate({"messages": [{"role": "user", "content": None}]})  # 'type:messages[].content:str'
+"""
+
+import json
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+MESSAGE_SCHEMA = {"role": "str", "content": "str"}
+
+SCHEMAS = {
+    "chatml": {"messages": [MESSAGE_SCHEMA]},
+    "nested": {"messages": {"messages": [MESSAGE_SCHEMA]}},
+    "kto": {"query": "str", "response": "str", "label": "bool"},
+    "sharegpt": {"conversations": [{"from": "str", "value": "str"}]},
+}
+
+TYPE_NAMES = {
+    "str": (str,),
+    "int": (int,),
+    "float": (float, int),
+    "bool": (bool,),
+    "null": (type(None),),
+}
+
+Validator = Callable[[Any], Optional[str]]
+
+
+def compile_schema(schema) -> Validator:
+    """Compiles a declarative schema into a function returning None or the first error class."""
+    return _compile(schema, "")
+
+
+def _compile(schema, path):
+    if isinstance(schema, dict):
+        return _compile_object(schema, path)
+    if isinstance(schema, list):
+        if len(schema) != 1:
+            raise ValueError(f"List schema at '{path or '<root>'}' must have exactly one item schema")
+        return _compile_list(schema[0], path)
+    if isinstance(schema, str):
+        return _compile_type(schema, path)
+    raise ValueError(f"Invalid schema at '{path or '<root>'}': {schema!r}")
+
+
+def _compile_object(schema, path):
+    type_error = f"type:{path or '<root>'}:object"
+    fields = []
+    for key, field_schema in schema.items():
+        field_path = f"{path}.{key}" if path else key
+        fields.append((key, f"missing:{field_path}", _compile(field_schema, field_path)))
+
+    def validate(value):
+        if type(value) is not dict:
+            return type_error
+        for key, missing_error, validate_field in fields:
+            if key not in value:
+                return missing_error
+            error = validate_field(value[key])
+            if error is not None:
+                return error
+        return None
+
+    return validate
+
+
+def _compile_list(item_schema, path):
+    type_error = f"type:{path or '<root>'}:list"
+    validate_item = _compile(item_schema, f"{path}[]")
+
+    def validate(value):
+        if type(value) is not list:
+            return type_error
+        for item in value:
+            error = validate_item(item)
+            if error is not None:
+                return error
+        return None
+
+    return validate
+
+
+def _compile_type(type_spec, path):
+    names = [name.strip() for name in type_spec.split("|")]
+    if "any" in names:
+        return lambda value: None
+    unknown = [name for name in names if name not in TYPE_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown type {unknown[0]!r} at '{path or '<root>'}'")
+
+    allowed = frozenset(t for name in names for t in TYPE_NAMES[name])
+    type_error = f"type:{path or '<root>'}:{type_spec}"
+
+    def validate(value):
+        # Compare exact types so that True is not accepted as an int and vice versa
+        return None if type(value) in allowed else type_error
+
+    return validate
+
+
+@lru_cache(maxsize=None)
+def get_validator(schema_name: str) -> Validator:
+    """Returns the compiled validator for a built-in schema name or a path to a JSON schema file."""
+    if schema_name in SCHEMAS:
+        return compile_schema(SCHEMAS[schema_name])
+    with open(schema_name, 'r') as f:
+        return compile_schema(json.load(f))
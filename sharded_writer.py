@@ -0,0 +1,383 @@
+"""
+Sharded Output Writer
+
+Fans the rows of one output out across numbered shard files of bounded size, optionally split into
+train/val/test (or any other) splits, and writes a manifest of the shards.
+
+- A shard is closed and the next one started once it holds shard_rows rows or shard_bytes bytes
+- The split of each row comes from a stable hash of a key column (or of the whole row), so a row always
+  lands in the same split whatever else is in the dataset, and no global shuffle is needed. Keys are
+  hashed in a canonical form (numbers and booleans as text, null fields left out), so the types a batch
+  gives a row (1 or 1.0, a null or a missing field) do not move it to another split
+- Every open shard is written by its own thread, so the shards of different splits are encoded and
+  compressed in parallel, and finished shards are checksummed in the background
+- The manifest (<name>.manifest.json next to the shards) lists every shard with its split, row count, byte
+  size and SHA-256. A failed shard write is raised from close(), and no manifest is written when the
+  writer fails or is left on an exception
+
+Shards are named after the output path: data.jsonl.gz with train and val splits becomes
+data-train-00000.jsonl.gz, data-train-00001.jsonl.gz, ..., data-val-00000.jsonl.gz (data-00000.jsonl.gz,
+... without splits). shard_bytes bounds the size of the rows before compression: their JSONL text for
+write_jsonl, their Arrow size for write_batch.
+
+Example:
+from sharded_writer import ShardedWriter
+
+with ShardedWriter("out/data.jsonl.zst", shard_rows=100_000, splits={"train": 0.98, "val": 0.01, "test": 0.01},
+                   split_key="id") as writer:
+    for batch in iter_record_batches("input.parquet"):
+        writer.write_batch(batch)
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pyarrow as pa
+
+from batch_io import BatchWriter, ParquetBatchWriter, detect_format, json_default, open_batch_writer
+from compressed_io import compression_from_extension, open_file, strip_compression_extension
+
+# Writes queued on a shard before the caller waits for it to catch up
+MAX_PENDING_WRITES = 4
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(text: str) -> int:
+    """Parses a byte size such as '500000', '256MB' or '1G'."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*", text.upper())
+    if not match:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_splits(text: str) -> Dict[str, float]:
+    """Parses 'train=0.98,val=0.01,test=0.01' (or weights such as 'train=98,val=1,test=1') into fractions."""
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if not name.strip() or not weight.strip():
+            raise ValueError(f"Invalid split {part!r}, expected name=fraction")
+        weights[name.strip()] = float(weight)
+    total = sum(weights.values())
+    if total <= 0 or any(weight < 0 for weight in weights.values()):
+        raise ValueError(f"Invalid split fractions: {text}")
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def add_shard_arguments(parser):
+    """Adds the sharding and split options shared by the tools that can write sharded outputs."""
+    parser.add_argument(
+        "--shard_rows", type=int, help="Write the output as shards of at most this many rows")
+    parser.add_argument(
+        "--shard_bytes", type=parse_size, help="Write the output as shards of at most this size, e.g. 512MB")
+    parser.add_argument(
+        "--splits", type=parse_splits, help="Split the output by a stable hash, e.g. train=0.98,val=0.01,test=0.01")
+    parser.add_argument(
+        "--split_key", help="Column hashed to pick the split of each row (default: the whole row)")
+    parser.add_argument(
+        "--split_seed", default="", help="Seed mixed into the split hash to draw a different split")
+
+
+def shard_options(args) -> Optional[Dict[str, Any]]:
+    """Returns the ShardedWriter options given on the command line, or None to write a single file."""
+    if args.shard_rows is None and args.shard_bytes is None and args.splits is None:
+        return None
+    return {"shard_rows": args.shard_rows, "shard_bytes": args.shard_bytes, "splits": args.splits,
+            "split_key": args.split_key, "split_seed": args.split_seed}
+
+
+def manifest_path(path: str) -> str:
+    """Returns the manifest path of an output written as shards."""
+    stripped = strip_compression_extension(path)
+    return f"{stripped[:len(stripped) - len(Path(stripped).suffix)]}.manifest.json"
+
+
+def split_hash(key: bytes, seed: str = "") -> float:
+    """Returns a stable, uniformly distributed fraction in [0, 1) for a key."""
+    digest = hashlib.blake2b(key, digest_size=8, key=seed.encode('utf-8')[:64]).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def _canonical(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def _key_bytes(value):
+    value = _canonical(value)
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, bytes):
+        return value
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, default=json_default).encode('utf-8')
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _Shard:
+    """One shard file, written in order by its own thread."""
+
+    def __init__(self, path: str, split: Optional[str], index: int, open_writer):
+        self.path = path
+        self.split = split
+        self.index = index
+        self.rows = 0
+        self.nbytes = 0
+        self._executor = ThreadPoolExecutor(1)
+        self._pending = deque()
+        self._writer = None
+        self._submit(self._open, open_writer)
+
+    def _submit(self, func, *args):
+        future = self._executor.submit(func, *args)
+        self._pending.append(future)
+        while len(self._pending) > MAX_PENDING_WRITES:
+            self._pending.popleft().result()
+        return future
+
+    def _open(self, open_writer):
+        self._writer = open_writer(self.path)
+
+    def _write(self, data):
+        if isinstance(data, str):
+            self._writer.write(data)
+        else:
+            self._writer.write_batch(data)
+
+    def _finish(self, pending):
+        # The earlier writes ran before this on the same thread, only their errors are left to collect
+        try:
+            for future in pending:
+                future.result()
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+        return {"path": os.path.basename(self.path), "split": self.split, "index": self.index, "rows": self.rows,
+                "bytes": os.path.getsize(self.path), "sha256": _file_sha256(self.path)}
+
+    def write(self, data, rows: int, nbytes: int):
+        self.rows += rows
+        self.nbytes += nbytes
+        self._submit(self._write, data)
+
+    def close(self):
+        """Closes and checksums the shard in its thread, returns the future of its manifest entry."""
+        future = self._executor.submit(self._finish, list(self._pending))
+        self._executor.shutdown(wait=False)
+        return future
+
+
+class ShardedWriter(BatchWriter):
+    def __init__(self, path: str, file_format: Optional[str] = None, compression_level: Optional[int] = None,
+                 shard_rows: Optional[int] = None, shard_bytes: Optional[int] = None,
+                 splits: Optional[Dict[str, float]] = None, split_key: Optional[str] = None, split_seed: str = "",
+                 schema: Optional[pa.Schema] = None):
+        """
+        Writes path as shards in the file format implied by it (or given explicitly). splits maps split
+        names to fractions of the rows, schema fixes the schema of Parquet shards.
+        """
+        super().__init__(path)
+        self.file_format = file_format or detect_format(path)
+        self.compression_level = compression_level
+        self.shard_rows = shard_rows
+        self.shard_bytes = shard_bytes
+        self.splits = dict(splits) if splits else {None: 1.0}
+        self.split_key = split_key
+        self.split_seed = split_seed
+        self.schema = schema
+
+        stripped = strip_compression_extension(path)
+        suffix = Path(stripped).suffix
+        self._base = stripped[:len(stripped) - len(suffix)]
+        self._extension = suffix + path[len(stripped):]
+        self.manifest_path = manifest_path(path)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A manifest left by an earlier run would describe shards that are about to be overwritten
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+
+        self._names = list(self.splits)
+        self._bounds = []
+        total = 0.0
+        for name in self._names[:-1]:
+            total += self.splits[name]
+            self._bounds.append(total)
+        self._open = {}
+        self._counts = {name: 0 for name in self._names}
+        self._entries = []
+
+    def shard_path(self, split: Optional[str], index: int) -> str:
+        if split is None:
+            return f"{self._base}-{index:05d}{self._extension}"
+        return f"{self._base}-{split}-{index:05d}{self._extension}"
+
+    def _split_of(self, key: bytes) -> int:
+        if len(self._names) == 1:
+            return 0
+        return bisect.bisect_right(self._bounds, split_hash(key, self.split_seed))
+
+    def _open_batch_writer(self, path):
+        if self.file_format == "parquet":
+            return ParquetBatchWriter(path, self.schema)
+        return open_batch_writer(path, self.file_format, self.compression_level)
+
+    def _open_text_writer(self, path):
+        return open_file(path, 'w', self.compression_level)
+
+    def _shard(self, split, open_writer):
+        shard = self._open.get(split)
+        if shard is None:
+            shard = _Shard(self.shard_path(split, self._counts[split]), split, self._counts[split], open_writer)
+            self._open[split] = shard
+            self._counts[split] += 1
+        return shard
+
+    def _roll_over(self, split):
+        self._entries.append(self._open.pop(split).close())
+
+    def _rows_that_fit(self, shard, sizes):
+        """Returns how many of the next rows (of the given sizes) fit in the shard, at least one in an empty shard."""
+        count = len(sizes)
+        if self.shard_rows is not None:
+            count = min(count, self.shard_rows - shard.rows)
+        if self.shard_bytes is not None:
+            used = shard.nbytes
+            for i in range(count):
+                used += sizes[i]
+                if used > self.shard_bytes:
+                    count = i
+                    break
+        return max(count, 0 if shard.rows else 1)
+
+    def _is_full(self, shard):
+        return ((self.shard_rows is not None and shard.rows >= self.shard_rows)
+                or (self.shard_bytes is not None and shard.nbytes >= self.shard_bytes))
+
+    def _fill(self, split, sizes, take, open_writer):
+        """Writes rows (of the given sizes) to the split's shards, starting a new shard whenever one is full."""
+        start = 0
+        while start < len(sizes):
+            shard = self._shard(split, open_writer)
+            count = self._rows_that_fit(shard, sizes[start:])
+            if count:
+                shard.write(take(start, count), count, sum(sizes[start:start + count]))
+                start += count
+            if count == 0 or self._is_full(shard):
+                self._roll_over(split)
+
+    def _write(self, batch):
+        if self.split_key is not None:
+            keys = [_key_bytes(value) for value in batch.column(self.split_key).to_pylist()]
+        elif len(self._names) > 1:
+            keys = [_key_bytes(row) for row in batch.to_pylist()]
+        else:
+            keys = [b""] * batch.num_rows
+        assigned = [[] for _ in self._names]
+        for i, key in enumerate(keys):
+            assigned[self._split_of(key)].append(i)
+
+        for split, indices in zip(self._names, assigned):
+            if not indices:
+                continue
+            part = batch if len(indices) == batch.num_rows else batch.take(pa.array(indices))
+            row_bytes = part.nbytes / part.num_rows
+            self._fill(split, [row_bytes] * part.num_rows,
+                       lambda start, count, part=part: part.slice(start, count), self._open_batch_writer)
+
+    def write_jsonl(self, text: str):
+        """Writes JSONL text (whole lines) to the shards, one row per line."""
+        lines = text.splitlines(keepends=True)
+        if not lines:
+            return
+        assigned = [[] for _ in self._names]
+        for line in lines:
+            if len(self._names) == 1:
+                split = 0
+            elif self.split_key is not None:
+                split = self._split_of(_key_bytes(json.loads(line).get(self.split_key)))
+            else:
+                split = self._split_of(_key_bytes(json.loads(line)))
+            assigned[split].append(line)
+
+        for split, split_lines in zip(self._names, assigned):
+            if not split_lines:
+                continue
+            sizes = [len(line.encode('utf-8')) for line in split_lines] if self.shard_bytes is not None \
+                else [0] * len(split_lines)
+            self._fill(split, sizes,
+                       lambda start, count, split_lines=split_lines: "".join(split_lines[start:start + count]),
+                       self._open_text_writer)
+        self.rows_written += len(lines)
+
+    def _close_shards(self):
+        for split in list(self._open):
+            self._roll_over(split)
+        futures, self._entries = self._entries, []
+        # Wait for every shard, even after one has failed, so none is left writing
+        entries = []
+        error = None
+        for future in futures:
+            try:
+                entries.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return entries
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Close the shards without a manifest, the original error is the one to report
+            try:
+                self._close_shards()
+            except Exception:
+                pass
+
+    def close(self):
+        entries = self._close_shards()
+        order = {name: i for i, name in enumerate(self._names)}
+        entries.sort(key=lambda entry: (order[entry["split"]], entry["index"]))
+
+        manifest = {
+            "format": self.file_format,
+            "compression": compression_from_extension(self.path),
+            "shard_rows": self.shard_rows,
+            "shard_bytes": self.shard_bytes,
+            "splits": None if self._names == [None] else self.splits,
+            "split_key": self.split_key,
+            "split_seed": self.split_seed,
+            "rows": sum(entry["rows"] for entry in entries),
+            "split_rows": None if self._names == [None] else {
+                name: sum(entry["rows"] for entry in entries if entry["split"] == name) for name in self._names},
+            "shards": entries,
+        }
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.write('\n')
+        self.manifest = manifest
@@ -0,0 +1,82 @@
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from batch_io import iter_record_batches, open_batch_writer
+
+ROWS = 25_000
+
+
+def write_jsonl(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def copy(source, output, batch_size=10_000):
+    with open_batch_writer(str(output)) as writer:
+        for batch in iter_record_batches(str(source), batch_size=batch_size):
+            writer.write_batch(batch)
+
+
+def read_rows(path):
+    return [row for batch in iter_record_batches(str(path)) for row in batch.to_pylist()]
+
+
+def late_drift_rows():
+    # Every drift happens after the first block of 10,000 rows the schema is first inferred from
+    rows = [{"id": i, "score": i, "messages": [{"role": "user", "content": "hi"}]} for i in range(ROWS)]
+    rows[15_000]["score"] = 1.5
+    rows[18_000]["extra"] = "late"
+    rows[20_000]["messages"] = [{"role": "user", "content": "hi", "name": "alice"}]
+    return rows
+
+
+@pytest.mark.parametrize("extension", ["parquet", "arrow", "jsonl", "csv"])
+def test_late_schema_drift_is_kept(tmp_path, extension):
+    source = tmp_path / "input.jsonl"
+    write_jsonl(source, late_drift_rows())
+    output = tmp_path / f"output.{extension}"
+    copy(source, output)
+
+    rows = read_rows(output)
+    assert len(rows) == ROWS
+    assert rows[15_000]["score"] == 1.5
+    assert rows[14_999]["score"] == 14_999
+    assert rows[18_000]["extra"] == "late"
+    assert rows[0].get("extra") is None
+    messages = rows[20_000]["messages"]
+    if extension == "csv":
+        messages = json.loads(messages)
+    assert messages[0]["name"] == "alice"
+
+
+def test_late_csv_values_widen(tmp_path):
+    source = tmp_path / "input.csv"
+    lines = ["id,value"] + [f"{i},{i}" for i in range(300_000)] + ["300000,1.5", "300001,abc"]
+    source.write_text("\n".join(lines) + "\n")
+    output = tmp_path / "output.parquet"
+    copy(source, output)
+
+    values = pq.read_table(output).column("value").to_pylist()
+    assert len(values) == 300_002
+    assert values[:3] == ["0", "1", "2"]
+    assert values[-2:] == ["1.5", "abc"]
+
+
+def test_mixed_types_in_one_block_become_text(tmp_path):
+    source = tmp_path / "input.jsonl"
+    write_jsonl(source, [{"label": True}, {"label": "true"}, {"label": 0}])
+    assert [row["label"] for row in read_rows(source)] == ["true", "true", "0"]
+
+
+def test_large_integers_are_not_rounded(tmp_path):
+    source = tmp_path / "input.jsonl"
+    write_jsonl(source, [{"n": 2 ** 53 + 1}, {"n": 0.5}])
+    # In one block the column is kept as text
+    assert [row["n"] for row in read_rows(source)] == [str(2 ** 53 + 1), "0.5"]
+    # Across blocks the integer block is already typed, widening it to floats fails rather than rounding
+    with pytest.raises(pa.ArrowInvalid, match="not in range"):
+        copy(source, tmp_path / "output.parquet", batch_size=1)
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from batch_io import read_arrow_table
+from compile_arrow import compile_arrow
+
+
+def write_jsonl(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def test_late_drift_is_kept(tmp_path):
+    rows = [{"id": i, "score": i, "messages": [{"role": "user", "content": "hi"}]} for i in range(25_000)]
+    rows[15_000]["score"] = 1.5
+    rows[20_000]["messages"] = [{"role": "user", "content": "hi", "name": "alice"}]
+    write_jsonl(tmp_path / "input.jsonl", rows)
+    compile_arrow(str(tmp_path / "input.jsonl"), str(tmp_path / "output.arrow"))
+
+    compiled = read_arrow_table(str(tmp_path / "output.arrow")).to_pylist()
+    assert len(compiled) == 25_000
+    assert compiled[15_000]["score"] == 1.5
+    assert compiled[14_999]["score"] == 14_999
+    assert compiled[20_000]["messages"] == [{"role": "user", "content": "hi", "name": "alice"}]
+
+
+def test_untyped_messages_raise(tmp_path):
+    rows = [{"messages": [{"role": "user", "content": "hi"}]} for _ in range(20_000)] + [{"messages": "hi"}]
+    write_jsonl(tmp_path / "input.jsonl", rows)
+    with pytest.raises(ValueError, match="not lists of messages"):
+        compile_arrow(str(tmp_path / "input.jsonl"), str(tmp_path / "output.arrow"))
+    assert not (tmp_path / "output.arrow").exists()
+
+
+def test_nested_layout_is_rejected_up_front(tmp_path):
+    rows = [{"messages": {"messages": [{"role": "user", "content": "hi"}]}} for _ in range(100)]
+    write_jsonl(tmp_path / "input.jsonl", rows)
+    with pytest.raises(ValueError, match="nested"):
+        compile_arrow(str(tmp_path / "input.jsonl"), str(tmp_path / "output.arrow"))
+    assert not (tmp_path / "output.arrow").exists()
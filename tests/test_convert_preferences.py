@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from convert_preferences import convert_preferences
+
+LABELS = [True, "true", 1, 1.0, "1.0", False, "false", 0, 0.0, "0"]
+
+
+def write_jsonl(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("num_plain_rows", [0, 20_000])
+def test_mixed_labels(tmp_path, num_plain_rows):
+    rows = [{"query": "plain", "response": str(i), "label": i % 2 == 0} for i in range(num_plain_rows)]
+    rows += [{"query": "mixed", "response": str(label), "label": label} for label in LABELS]
+    write_jsonl(tmp_path / "input.jsonl", rows)
+    convert_preferences(str(tmp_path / "input.jsonl"), str(tmp_path / "output.jsonl"), "kto_to_dpo")
+
+    pairs = [(row["chosen"], row["rejected"]) for row in read_jsonl(tmp_path / "output.jsonl")
+             if row["prompt"] == "mixed"]
+    assert pairs == [("True", "False"), ("true", "false"), ("1", "0"), ("1.0", "0.0"), ("1.0", "0")]
@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+from dedup_conversations import dedup_conversations
+
+
+@pytest.mark.parametrize("mode", ["exact", "near"])
+def test_invalid_json_is_skipped_and_reported(tmp_path, mode):
+    lines = [json.dumps({"messages": [{"role": "user", "content": f"question number {i % 3} about the weather"}]})
+             for i in range(10)]
+    lines[4] = '{"messages": [broken'
+    (tmp_path / "input.jsonl").write_text("\n".join(lines) + "\n")
+
+    counts = dedup_conversations(str(tmp_path / "input.jsonl"), str(tmp_path / "output.jsonl"), mode,
+                                 report_file=str(tmp_path / "report.jsonl"))
+    assert counts["invalid_json"] == 1
+    assert counts["kept"] == 3
+    report = [json.loads(line) for line in (tmp_path / "report.jsonl").read_text().splitlines()]
+    assert {"line": 5, "reason": "invalid_json"} in report
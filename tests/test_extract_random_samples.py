@@ -0,0 +1,64 @@
+import json
+
+from compile_arrow import compile_arrow
+from extract_random_samples import sample_rows, sample_rows_stratified
+from jsonl_index import build_index
+
+
+def write_lines(path, lines, newline="\n"):
+    with open(path, "w", newline="") as f:
+        f.write("".join(line + newline for line in lines))
+
+
+def sampled_lines(samples):
+    return [line for _, line in samples]
+
+
+def test_sample_does_not_depend_on_the_index(tmp_path):
+    lines = []
+    for i in range(5_000):
+        lines.append(json.dumps({"id": i}))
+        if i % 7 == 0:
+            lines.append("" if i % 2 else "   ")
+    path = str(tmp_path / "input.jsonl")
+    write_lines(path, lines)
+
+    without_index = sample_rows(path, 300, seed=3)
+    build_index(path)
+    with_index = sample_rows(path, 300, seed=3)
+    assert sampled_lines(with_index) == sampled_lines(without_index)
+    assert all(line.strip() for line in sampled_lines(with_index))
+
+
+def test_crlf_lines_are_sampled_alike(tmp_path):
+    lines = [json.dumps({"id": i}) for i in range(1_000)]
+    path = str(tmp_path / "input.jsonl")
+    write_lines(path, lines, newline="\r\n")
+
+    without_index = sample_rows(path, 50, seed=1)
+    build_index(path)
+    assert sampled_lines(sample_rows(path, 50, seed=1)) == sampled_lines(without_index)
+    assert all(not line.endswith("\r") for line in sampled_lines(without_index))
+
+
+def test_arrow_sample_matches_jsonl(tmp_path):
+    lines = [json.dumps({"id": i, "messages": [{"role": "user", "content": str(i)}]}) for i in range(2_000)]
+    path = str(tmp_path / "input.jsonl")
+    write_lines(path, lines)
+    compile_arrow(path, str(tmp_path / "input.arrow"))
+
+    jsonl_ids = [json.loads(line)["id"] for line in sampled_lines(sample_rows(path, 100, seed=5))]
+    arrow_ids = [json.loads(line)["id"] for line in sampled_lines(sample_rows(str(tmp_path / "input.arrow"), 100, seed=5))]
+    assert arrow_ids == jsonl_ids
+
+
+def test_stratified_sample_keeps_proportions(tmp_path):
+    lines = [json.dumps({"id": i, "source": "a" if i % 4 else "b"}) for i in range(10_000)]
+    path = str(tmp_path / "input.jsonl")
+    write_lines(path, lines)
+
+    samples = sample_rows_stratified(path, 100, "source", seed=2)
+    sources = [json.loads(line)["source"] for line in sampled_lines(samples)]
+    assert (sources.count("a"), sources.count("b")) == (75, 25)
+    assert [index for index, _ in samples] == sorted({index for index, _ in samples})
+    assert all(json.loads(line)["id"] == index for index, line in samples)
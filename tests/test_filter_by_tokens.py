@@ -0,0 +1,20 @@
+from filter_by_tokens import fit_messages
+
+SYSTEM = {"role": "system", "content": "You are a helpful assistant with a long system prompt."}
+USER = {"role": "user", "content": "one two three four five six seven eight nine ten"}
+
+
+class WordCounter:
+    def count_up_to(self, text, limit):
+        count = len(text.split())
+        return count if count <= limit else None
+
+
+def test_conversations_without_content_are_not_over_budget():
+    assert fit_messages([], WordCounter(), 5) == (None, 'no_content')
+    assert fit_messages([SYSTEM], WordCounter(), 50) == (None, 'no_content')
+
+
+def test_truncation_down_to_the_system_prompt_is_over_budget():
+    assert fit_messages([SYSTEM, USER], WordCounter(), 12, truncate=True) == (None, 'over_budget')
+    assert fit_messages([SYSTEM, USER], WordCounter(), 20, truncate=True) == ([SYSTEM, USER], 'kept')
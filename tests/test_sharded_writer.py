@@ -0,0 +1,85 @@
+import json
+import os
+
+import pyarrow as pa
+import pytest
+
+import sharded_writer
+from sharded_writer import ShardedWriter, manifest_path
+
+
+def jsonl(rows):
+    return "".join(json.dumps(row) + "\n" for row in rows)
+
+
+def fail_second_write(monkeypatch):
+    write = sharded_writer._Shard._write
+    calls = []
+
+    def failing_write(self, data):
+        calls.append(data)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        write(self, data)
+
+    monkeypatch.setattr(sharded_writer._Shard, "_write", failing_write)
+
+
+def test_failed_write_is_raised_without_manifest(tmp_path, monkeypatch):
+    fail_second_write(monkeypatch)
+    path = str(tmp_path / "data.jsonl")
+    writer = ShardedWriter(path, shard_rows=1_000)
+    for start in range(0, 300, 100):
+        writer.write_jsonl(jsonl({"id": i} for i in range(start, start + 100)))
+    with pytest.raises(OSError, match="disk full"):
+        writer.close()
+    assert not os.path.exists(manifest_path(path))
+
+
+def test_no_manifest_when_leaving_on_an_exception(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    with open(manifest_path(path), "w") as f:
+        f.write("{}")
+    with pytest.raises(RuntimeError):
+        with ShardedWriter(path, shard_rows=50) as writer:
+            writer.write_jsonl(jsonl({"id": i} for i in range(100)))
+            raise RuntimeError("stop")
+    assert not os.path.exists(manifest_path(path))
+
+
+def test_manifest_counts_written_rows(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    with ShardedWriter(path, shard_rows=120) as writer:
+        for start in range(0, 300, 100):
+            writer.write_jsonl(jsonl({"id": i} for i in range(start, start + 100)))
+    assert writer.manifest["rows"] == 300
+    assert [shard["rows"] for shard in writer.manifest["shards"]] == [120, 120, 60]
+
+
+def split_ids(directory, batch):
+    with ShardedWriter(str(directory / "data.jsonl"), "jsonl", splits={"a": 0.5, "b": 0.5}) as writer:
+        writer.write_batch(batch)
+    splits = {}
+    for split in ("a", "b"):
+        with open(directory / f"data-{split}-00000.jsonl") as f:
+            for line in f:
+                row = json.loads(line)
+                if row.get("id") is not None:
+                    splits[row["id"]] = split
+    return splits
+
+
+def test_split_does_not_depend_on_batch_types(tmp_path):
+    rows = [{"id": i, "x": i} for i in range(200)]
+    (tmp_path / "narrow").mkdir()
+    (tmp_path / "wide").mkdir()
+    narrow = split_ids(tmp_path / "narrow", pa.RecordBatch.from_pylist(rows))
+    wide = split_ids(tmp_path / "wide", pa.RecordBatch.from_pylist(rows + [{"x": 0.5, "y": "extra"}]))
+    assert wide == narrow
+    assert set(narrow.values()) == {"a", "b"}
+
+    with ShardedWriter(str(tmp_path / "text.jsonl"), splits={"a": 0.5, "b": 0.5}) as writer:
+        writer.write_jsonl(jsonl(rows))
+    for split in ("a", "b"):
+        with open(tmp_path / f"text-{split}-00000.jsonl") as f:
+            assert all(narrow[json.loads(line)["id"]] == split for line in f)
@@ -0,0 +1,38 @@
+import json
+
+from compile_arrow import compile_arrow
+from validate_jsonl import validate_jsonl, validate_schema
+
+HELLO = {"role": "user", "content": "Hello"}
+
+
+def write_jsonl(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def test_compiled_chatml_is_valid_without_schema(tmp_path, capsys):
+    write_jsonl(tmp_path / "input.jsonl", [{"messages": [HELLO]} for _ in range(3_000)])
+    compile_arrow(str(tmp_path / "input.jsonl"), str(tmp_path / "input.arrow"))
+    capsys.readouterr()
+
+    validate_jsonl(str(tmp_path / "input.arrow"))
+    assert "is not a list" not in capsys.readouterr().out
+
+
+def test_arrow_chatml_errors_match_jsonl(tmp_path):
+    rows = [{"messages": [HELLO]} for _ in range(20)]
+    rows[3] = {"messages": [HELLO, {"content": "no role"}]}
+    rows[5] = {"messages": [{"role": "assistant"}]}
+    rows[8] = {"id": 8}
+    rows[11] = {"messages": [HELLO, None]}
+    rows[13] = {"messages": [{"content": "no role"}, {"role": "user"}]}
+    write_jsonl(tmp_path / "input.jsonl", rows)
+    compile_arrow(str(tmp_path / "input.jsonl"), str(tmp_path / "input.arrow"))
+
+    from_jsonl = validate_schema(str(tmp_path / "input.jsonl"), "chatml")
+    from_arrow = validate_schema(str(tmp_path / "input.arrow"), "chatml")
+    assert from_arrow["errors"] == from_jsonl["errors"]
+    assert set(from_jsonl["errors"]) == {"missing:messages", "missing:messages[].role", "missing:messages[].content",
+                                         "type:messages[]:object"}
@@ -0,0 +1,149 @@
+"""
+Token Count Cache
+
+Persistent on-disk cache mapping (encoding name, hash of the text) to its token count, so reruns over
+mostly unchanged datasets only hash and look up each message instead of tokenizing it again.
+
+The cache is a SQLite database in WAL mode, so any number of worker processes can read and write it at
+the same time. Each entry remembers when it was last used; once the cache holds more than max_entries
+entries, the least recently used ones are evicted at the end of a run.
+
+Hits and misses are tallied per run inside the database, so the totals include the counts of every worker
+process of that run.
+
+Example:
+from token_cache import TokenCache
+from token_counter import TokenCounter
+
+with TokenCache("token_cache.sqlite") as cache:
+    counter = TokenCounter("cl100k_base", cache=cache)
+    counter.count_batch(["Hello", "Hi there!"])
+    hits, misses = cache.run_stats()
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+import uuid
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+DEFAULT_CACHE_PATH = "token_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 5_000_000
+
+# Stay well below SQLite's limit on the number of parameters in one statement
+_QUERY_CHUNK = 500
+
+
+def content_digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class TokenCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES, run_id: str = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.run_id = run_id or uuid.uuid4().hex
+
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS token_counts (
+                encoding TEXT NOT NULL,
+                digest BLOB NOT NULL,
+                tokens INTEGER NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (encoding, digest)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS token_counts_last_used ON token_counts (last_used);
+            CREATE TABLE IF NOT EXISTS run_stats (
+                run_id TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL,
+                misses INTEGER NOT NULL
+            );
+        """)
+
+    def get_many(self, encoding_name: str, digests: List[bytes]) -> Dict[bytes, int]:
+        """Returns the cached token count of every digest found in the cache."""
+        found = {}
+        unique = list(set(digests))
+        for i in range(0, len(unique), _QUERY_CHUNK):
+            chunk = unique[i:i + _QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT digest, tokens FROM token_counts WHERE encoding = ? AND digest IN ({placeholders})",
+                [encoding_name, *chunk])
+            found.update(rows)
+        return found
+
+    def update(self, encoding_name: str, hits: Iterable[bytes], new_counts: Iterable[Tuple[bytes, int]],
+               hit_count: int, miss_count: int):
+        """Stores new counts, refreshes the last use of hits and adds to the run's tallies in one transaction."""
+        now = int(time.time())
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO token_counts (encoding, digest, tokens, last_used) VALUES (?, ?, ?, ?)",
+                [(encoding_name, digest, tokens, now) for digest, tokens in new_counts])
+            self.connection.executemany(
+                "UPDATE token_counts SET last_used = ? WHERE encoding = ? AND digest = ? AND last_used < ?",
+                [(now, encoding_name, digest, now) for digest in hits])
+            self.connection.execute(
+                "INSERT INTO run_stats (run_id, hits, misses) VALUES (?, ?, ?) "
+                "ON CONFLICT (run_id) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                (self.run_id, hit_count, miss_count))
+
+    def run_stats(self) -> Tuple[int, int]:
+        """Returns (hits, misses) of this run across every process sharing its run_id."""
+        row = self.connection.execute(
+            "SELECT hits, misses FROM run_stats WHERE run_id = ?", (self.run_id,)).fetchone()
+        return row or (0, 0)
+
+    def evict(self) -> int:
+        """Deletes the least recently used entries beyond max_entries and returns how many were deleted."""
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            count = self.connection.execute("SELECT COUNT(*) FROM token_counts").fetchone()[0]
+            excess = count - self.max_entries
+            if excess <= 0:
+                return 0
+            self.connection.execute(
+                "DELETE FROM token_counts WHERE (encoding, digest) IN "
+                "(SELECT encoding, digest FROM token_counts ORDER BY last_used LIMIT ?)", (excess,))
+        return excess
+
+    def finish_run(self) -> Tuple[int, int]:
+        """Evicts old entries, drops this run's tallies and returns its (hits, misses)."""
+        stats = self.run_stats()
+        self.evict()
+        with self.connection:
+            self.connection.execute("DELETE FROM run_stats WHERE run_id = ?", (self.run_id,))
+        return stats
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@lru_cache(maxsize=None)
+def _open_cache(path, run_id, pid):
+    return TokenCache(path, run_id=run_id)
+
+
+def open_token_cache(path: str, run_id: str) -> TokenCache:
+    """Returns a cache connection for this process, opening it once per process and run."""
+    # Keyed on the process id so forked workers never reuse a connection opened by their parent
+    return _open_cache(path, run_id, os.getpid())
+
+
+def format_cache_stats(hits: int, misses: int) -> str:
+    total = hits + misses
+    rate = hits / total if total else 0.0
+    return f"Token cache: {hits} hits, {misses} misses ({rate:.2%} hit rate)"
@@ -0,0 +1,123 @@
+"""
+Token Counting Engine
+
+Counts tokens with tiktoken for whole batches of texts and conversations. Each encoding is built once
+per process and batches are encoded with tiktoken's multithreaded batch API, so per-message,
+per-conversation and total counts all come out of a single pass.
+
+With a TokenCache (see token_cache.py), texts counted in earlier runs are looked up by their hash
+instead of being tokenized again.
+
+Example:
+from token_counter import TokenCounter
+
+counter = TokenCounter("cl100k_base")
+counts = counter.count_conversations([["Human: Hello\n", "Assistant: Hi there!\n"]])
+
+counts.message_tokens       # tokens per message, per conversation
+counts.conversation_tokens  # tokens per conversation
+counts.total_tokens         # tokens across all conversations
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+import tiktoken
+
+from token_cache import TokenCache, content_digest
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# Characters of a prefix examined for the words whose tokens may change once the rest of the text follows
+TAIL_CHARS = 1024
+_WHITESPACE_RUNS = re.compile(r"(\s+)")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    """Returns the tiktoken encoding, building it only once per process."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+@dataclass
+class TokenCounts:
+    message_tokens: List[List[int]]
+    conversation_tokens: List[int]
+    total_tokens: int
+
+
+class TokenCounter:
+    def __init__(self, encoding_name: str = DEFAULT_ENCODING, num_threads: int = 8, cache: Optional[TokenCache] = None):
+        self.encoding_name = encoding_name
+        self.encoding = get_encoding(encoding_name)
+        self.num_threads = num_threads
+        self.cache = cache
+
+    def count(self, text: str) -> int:
+        """Returns the number of tokens in a single text string."""
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_up_to(self, text: str, limit: int) -> Optional[int]:
+        """
+        Returns the number of tokens in text, or None once it is certain to exceed limit.
+
+        Long texts are encoded in growing prefixes, so a text far over the limit is never fully tokenized.
+        """
+        # Start with a prefix that averages 4 characters per token at the limit
+        window = (limit + 1) * 4
+        while window < len(text):
+            prefix = text[:window]
+            # tiktoken splits text at whitespace before encoding, so only the words at the end of the
+            # prefix can be tokenized differently in the full text
+            tail = "".join(_WHITESPACE_RUNS.split(prefix[-TAIL_CHARS:])[-4:])
+            if self.count(prefix) - self.count(tail) > limit:
+                return None
+            window *= 2
+        tokens = self.count(text)
+        return tokens if tokens <= limit else None
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """Returns the number of tokens in each text, encoding the whole batch at once."""
+        if not texts:
+            return []
+        if self.cache is None:
+            return self._encode_counts(texts)
+
+        digests = [content_digest(text) for text in texts]
+        counts = self.cache.get_many(self.encoding_name, digests)
+        hits = list(counts)
+        hit_count = sum(1 for digest in digests if digest in counts)
+
+        # Tokenize each text missing from the cache only once, even if it repeats in the batch
+        missing = {}
+        for digest, text in zip(digests, texts):
+            if digest not in counts and digest not in missing:
+                missing[digest] = text
+        new_counts = dict(zip(missing, self._encode_counts(list(missing.values()))))
+
+        self.cache.update(self.encoding_name, hits, new_counts.items(), hit_count, len(texts) - hit_count)
+        counts.update(new_counts)
+        return [counts[digest] for digest in digests]
+
+    def _encode_counts(self, texts):
+        if not texts:
+            return []
+        encoded = self.encoding.encode_ordinary_batch(texts, num_threads=self.num_threads)
+        return [len(tokens) for tokens in encoded]
+
+    def count_conversations(self, conversations: List[List[str]]) -> TokenCounts:
+        """Counts every message of every conversation with one batched encode call."""
+        flat_counts = self.count_batch([text for conversation in conversations for text in conversation])
+
+        message_tokens = []
+        conversation_tokens = []
+        position = 0
+        for conversation in conversations:
+            counts = flat_counts[position:position + len(conversation)]
+            position += len(conversation)
+            message_tokens.append(counts)
+            conversation_tokens.append(sum(counts))
+
+        return TokenCounts(message_tokens, conversation_tokens, sum(conversation_tokens))
@@ -3,12 +3,30 @@ JSONL Dataset Transformer
 
 Transforms a JSONL dataset by processing conversations and saving the transformed dataset in Parquet and JSONL formats.
 
-Usage: python transform_dataset.py <input_file>
+Each block of lines is parsed straight into a typed Arrow table (a list of role/content structs per
+conversation), and the system message is moved first with vectorized array operations, one block per
+worker process, which also encodes the block's JSONL output. Every transformed block is written to the
+Parquet and the JSONL output, so both come from the same result and nothing is parsed or encoded
+twice. Blocks with rows that do not fit the schema (invalid JSON, non-string content, empty lines, ...)
+fall back to parsing their lines one at a time.
+
+The rows are the ones the Hugging Face writer used to produce, but the JSONL output is written with json's
+default separators and leaves '/' unescaped, where that writer wrote compact JSON with '/' escaped as '\\/'.
+
+Both outputs only appear once the whole file was transformed, and an interrupted run carries on from its
+last checkpoint when it is rerun.
+
+Usage: python transform_dataset.py <input_file> [--workers <workers>] [--checkpoint_interval <seconds>] [--restart] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
 
 Input: Path to the input JSONL file
+Workers: Optional number of worker processes (default: 1)
+Checkpoint Interval: Optional seconds between checkpoints, an interrupted run resumes from its last checkpoint when rerun (default: 60, see checkpoint.py)
+Restart: Optional flag to ignore the checkpoint of an interrupted run and start over
+Metrics Out: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+Profile: Optional path prefix to save cProfile stats of each phase
 
 Example:
-python transform_dataset.py augmented_train_data.jsonl
+python transform_dataset.py augmented_train_data.jsonl --workers 16
 
 Input JSONL Example:
 {"conv_id": "1", "messages": {"messages": [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi there!"}]}}
@@ -17,107 +35,210 @@ Output JSONL Example:
 {"messages": [{"content": "You are a helpful assistant.", "role": "system"}, {"content": "Hello", "role": "user"}, {"content": "Hi there!", "role": "assistant"}]}
 """
 
+import io
 import json
-from datasets import Dataset
-from typing import Dict, Any, List
+from typing import Dict, List, Optional, Tuple
 import logging
-from tqdm import tqdm
 import argparse
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+
+from batch_io import encode_jsonl
+from checkpoint import DEFAULT_INTERVAL, ResumableRun, add_checkpoint_arguments
+from compressed_io import strip_compression_extension
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_blocks
+
 # Set up logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-def safe_load_json(file_path: str) -> List[Dict[str, Any]]:
-    data = []
-    with open(file_path, 'r') as f:
-        for i, line in enumerate(tqdm(f, desc="Loading JSON")):
-            try:
-                item = json.loads(line)
-                # Convert all values to strings to ensure consistency
-                item = {k: json.dumps(v) for k, v in item.items()}
-                data.append(item)
-            except json.JSONDecodeError:
-                logging.warning(f"Skipping row {i+1}: Invalid JSON")
-    return data
-
-def transform_conversation(example: Dict[str, str]) -> Dict[str, List[Dict[str, str]]]:
-    try:
-        conv_id = example['conv_id']
+INPUT_MESSAGE_TYPE = pa.struct([("role", pa.string()), ("content", pa.string())])
+INPUT_SCHEMA = pa.schema([("messages", pa.struct([("messages", pa.list_(INPUT_MESSAGE_TYPE))]))])
+
+MESSAGE_TYPE = pa.struct([("content", pa.string()), ("role", pa.string())])
+OUTPUT_SCHEMA = pa.schema([("messages", pa.list_(MESSAGE_TYPE))])
 
-        messages = json.loads(example['messages'])['messages']
-        conversations = []
+def reorder_system_first(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    conversations = []
 
-        # Add the system message first (if present)
-        system_message = next(
-            (msg for msg in messages if msg['role'] == 'system'), None)
-        if system_message:
+    # Add the system message first (if present)
+    system_message = next(
+        (msg for msg in messages if msg['role'] == 'system'), None)
+    if system_message:
+        conversations.append({
+            "content": system_message['content'],
+            "role": "system"
+        })
+        logging.debug("Added system message")
+
+    # Add the rest of the messages
+    for msg in messages:
+        if msg['role'] != 'system':
             conversations.append({
-                "content": system_message['content'],
-                "role": "system"
+                "content": msg['content'],
+                "role": msg['role']
             })
-            logging.debug("Added system message")
-
-        # Add the rest of the messages
-        for msg in messages:
-            if msg['role'] != 'system':
-                conversations.append({
-                    "content": msg['content'],
-                    "role": msg['role']
-                })
-
-        logging.debug(f"Processed {len(conversations)} messages")
-        return {"messages": conversations}
-    except Exception as e:
-        logging.error(f"Error processing conversation {conv_id}: {str(e)}")
-        return {"messages": []}
-
-def main(input_file: str):
-    logging.info(f"Starting transformation of {input_file}")
 
-    # Load the dataset using our custom function
-    try:
-        data = safe_load_json(input_file)
-        dataset = Dataset.from_list(data)
-        logging.info(
-            f"Successfully loaded dataset with {len(dataset)} examples")
-    except Exception as e:
-        logging.error(f"Failed to load dataset: {str(e)}")
-        return
-
-    # Transform the dataset
+    logging.debug(f"Processed {len(conversations)} messages")
+    return conversations
+
+def reorder_system_first_array(messages: pa.ListArray) -> pa.ListArray:
+    """
+    reorder_system_first over a whole array of conversations (lists of role/content structs): keeps the
+    first system message of each conversation, moved to the front, and drops any other system message.
+    Null conversations become empty lists.
+    """
+    flat = messages.flatten()
+    parents = pc.list_parent_indices(messages).to_numpy()
+    is_system = pc.fill_null(pc.equal(pc.struct_field(flat, "role"), "system"), False).to_numpy(zero_copy_only=False)
+
+    # Keep every non-system message plus the first system message of each conversation
+    system_positions = np.flatnonzero(is_system)
+    _, first = np.unique(parents[system_positions], return_index=True)
+    keep = ~is_system
+    keep[system_positions[first]] = True
+    kept = np.flatnonzero(keep)
+
+    # A stable sort on (conversation, is not system) moves the system message first, the rest keep their order
+    order = kept[np.argsort(parents[kept] * 2 + ~is_system[kept], kind='stable')]
+    values = flat.take(pa.array(order))
+    values = pa.StructArray.from_arrays([pc.struct_field(values, "content"), pc.struct_field(values, "role")],
+                                        fields=list(MESSAGE_TYPE))
+
+    counts = np.bincount(parents[kept], minlength=len(messages))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+    return pa.ListArray.from_arrays(pa.array(offsets), values)
+
+def transform_conversation(data: Dict) -> Optional[List[Dict[str, str]]]:
+    """Returns the reordered messages of one parsed row, or None if they cannot be transformed."""
     try:
-        transformed_dataset = dataset.map(
-            transform_conversation,
-            remove_columns=dataset.column_names
-        )
-        logging.info(f"Successfully transformed dataset")
-    except Exception as e:
-        logging.error(f"Failed to transform dataset: {str(e)}")
-        return
-
-    # Save the transformed dataset as parquet
-    output_parquet = input_file.replace('.jsonl', '.parquet')
-    try:
-        transformed_dataset.to_parquet(output_parquet)
-        logging.info(f"Saved transformed dataset as parquet: {output_parquet}")
-    except Exception as e:
-        logging.error(f"Failed to save parquet file: {str(e)}")
+        messages = data['messages']['messages']
+        if not all(isinstance(msg['role'], str) and isinstance(msg['content'], (str, type(None)))
+                   for msg in messages):
+            return None
+        return reorder_system_first(messages)
+    except (KeyError, TypeError):
+        return None
+
+def transform_lines(lines: List[bytes]) -> Tuple[pa.RecordBatch, List[int], List[int]]:
+    """Transforms lines one at a time, returns (batch, invalid JSON lines, lines left empty)."""
+    rows = []
+    invalid = []
+    failed = []
+    for i, line in enumerate(lines):
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            invalid.append(i)
+            continue
+        messages = transform_conversation(data) if isinstance(data, dict) else None
+        if messages is None:
+            failed.append(i)
+        rows.append({"messages": messages or []})
+    return pa.RecordBatch.from_pylist(rows, schema=OUTPUT_SCHEMA), invalid, failed
+
+def transform_block(data: bytes) -> Tuple[pa.RecordBatch, str, int, List[int], List[int]]:
+    """
+    Returns (transformed batch, the batch as JSONL, line count, positions of invalid JSON lines, positions
+    of lines whose conversation could not be transformed and was left empty).
+    """
+    batch, line_count, invalid, failed = _transform_block(data)
+    return batch, encode_jsonl(batch), line_count, invalid, failed
+
+def _transform_block(data):
+    lines = data.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    if not lines:
+        return pa.RecordBatch.from_pylist([], schema=OUTPUT_SCHEMA), 0, [], []
 
-    # Save the transformed dataset as jsonl
-    output_jsonl = input_file.replace('.jsonl', '_transformed.jsonl')
     try:
-        transformed_dataset.to_json(output_jsonl)
-        logging.info(f"Saved transformed dataset as JSONL: {output_jsonl}")
-    except Exception as e:
-        logging.error(f"Failed to save JSONL file: {str(e)}")
+        table = pa_json.read_json(
+            io.BytesIO(data),
+            read_options=pa_json.ReadOptions(use_threads=False, block_size=len(data) + 1),
+            parse_options=pa_json.ParseOptions(explicit_schema=INPUT_SCHEMA, unexpected_field_behavior="ignore"))
+    except pa.ArrowInvalid:
+        table = None
+    # The Arrow reader skips empty lines, those rows need the line by line path to be reported
+    if table is None or table.num_rows != len(lines):
+        batch, invalid, failed = transform_lines(lines)
+        return batch, len(lines), invalid, failed
+
+    messages = pc.struct_field(table.column("messages").combine_chunks(), "messages")
+    failed = np.flatnonzero(messages.is_null().to_numpy(zero_copy_only=False)).tolist()
+    reordered = reorder_system_first_array(messages)
+
+    # Arrow reads a missing role or content as null, the line by line path tells a missing field (the
+    # conversation is left empty) from an explicit null content (kept), so those rows go through it
+    flat = messages.flatten()
+    incomplete = pc.fill_null(pc.or_(pc.is_null(pc.struct_field(flat, "role")),
+                                     pc.is_null(pc.struct_field(flat, "content"))), True)
+    recheck = np.unique(pc.list_parent_indices(messages).to_numpy()[incomplete.to_numpy(zero_copy_only=False)])
+    if len(recheck):
+        patched, _, patched_failed = transform_lines([lines[i] for i in recheck])
+        failed = sorted(set(failed) | {int(recheck[i]) for i in patched_failed})
+        # Rows of the vectorized result, with the rechecked ones taken from the patched batch after them
+        positions = np.arange(len(lines))
+        positions[recheck] = len(lines) + np.arange(len(recheck))
+        reordered = pa.concat_arrays([reordered, patched.column("messages")]).take(pa.array(positions))
+    batch = pa.RecordBatch.from_arrays([reordered], schema=OUTPUT_SCHEMA)
+    return batch, len(lines), [], failed
+
+def main(input_file: str, workers: int = 1, checkpoint_interval: float = DEFAULT_INTERVAL, restart: bool = False,
+         metrics: Metrics = None):
+    metrics = metrics or Metrics("transform_dataset", [input_file])
+    logging.info(f"Starting transformation of {input_file}")
 
+    output_parquet = strip_compression_extension(input_file).replace('.jsonl', '.parquet')
+    output_jsonl = strip_compression_extension(input_file).replace('.jsonl', '_transformed.jsonl')
+
+    with ResumableRun("transform_dataset", [input_file], [output_parquet, output_jsonl],
+                      state={"rows": 0, "rows_failed": 0, "line_number": 0},
+                      interval=checkpoint_interval, restart=restart) as run:
+        counts = run.state
+        parquet_writer = run.open_parquet(output_parquet, OUTPUT_SCHEMA)
+        jsonl_file = run.open_text(output_jsonl)
+        results = map_blocks(input_file, transform_block, workers, on_range=metrics.add_bytes,
+                             start=run.offset, on_offset=run.advance)
+        for batch, jsonl, line_count, invalid, failed in metrics.timed(results, "transform"):
+            for i in invalid:
+                logging.warning(f"Skipping row {counts['line_number'] + i + 1}: Invalid JSON")
+            for i in failed:
+                logging.error(f"Error processing conversation at row {counts['line_number'] + i + 1}")
+            counts["line_number"] += line_count
+            counts["rows_failed"] += len(failed)
+
+            # Both outputs are written from the same transformed batch
+            with metrics.phase("write"):
+                parquet_writer.write_batch(batch)
+                jsonl_file.write(jsonl)
+            counts["rows"] += batch.num_rows
+            metrics.add(rows=batch.num_rows)
+
+        with metrics.phase("write"):
+            run.commit()
+
+    rows, rows_failed = counts["rows"], counts["rows_failed"]
+    logging.info(f"Successfully transformed {rows} conversations ({rows_failed} left empty)")
+    logging.info(f"Saved transformed dataset as parquet: {output_parquet}")
+    logging.info(f"Saved transformed dataset as JSONL: {output_jsonl}")
     logging.info("Transformation complete.")
+    metrics.count("failed", rows_failed)
+    metrics.finish()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Transform JSONL dataset")
     parser.add_argument(
         "input_file", help="Path to input JSONL file")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    add_checkpoint_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    main(args.input_file)
+    main(args.input_file, args.workers, args.checkpoint_interval, args.restart,
+         Metrics("transform_dataset", [args.input_file], args.metrics_out, args.profile))
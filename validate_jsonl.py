@@ -3,13 +3,32 @@ JSONL Validator
 
 Validates a JSONL file to ensure each line contains valid JSON and that the 'messages' field is a list.
 
-Usage: python validate_jsonl.py <input_file>
+With --schema, every line is checked against a declarative schema instead (see schema_validator.py) and
+a JSON report is written with the number of lines per error class and a capped sample of offending line
+numbers. The exit status is 1 when any line is invalid.
+
+Arrow IPC files compiled with compile_arrow.py are read memory-mapped, one record batch per task, and
+their rows are checked without decoding any JSON; line numbers are then row numbers. They hold flat ChatML,
+so without --schema their 'messages' column itself must be a list. A chatml schema over the typed
+'messages' column is checked with vectorized null tests over whole batches. An Arrow file stores an absent
+field and a null one alike, so both are reported as the missing field there (e.g. 'missing:messages[].role').
+
+Usage: python validate_jsonl.py <input_file> [--workers <workers>] [--schema <schema>] [--report <report_file>] [--max_samples <max_samples>] [--fail_fast] [--metrics_out <metrics_file>] [--profile <profile_prefix>]
 
 Input:
-- input_file: Path to the input JSONL file
+- input_file: Path to the input JSONL file (or Arrow IPC file, see compile_arrow.py)
+- workers: Optional number of worker processes (default: 1)
+- schema: Optional built-in schema ('chatml', 'nested', 'kto', 'sharegpt') or path to a JSON schema file
+- report_file: Optional path to save the JSON report (default: print to stdout)
+- max_samples: Optional number of offending line numbers kept per error class (default: 10)
+- fail_fast: Optional flag to stop at the first invalid line
+- metrics_file: Optional path to save phase timings, throughput and peak memory as JSON (see instrumentation.py)
+- profile_prefix: Optional path prefix to save cProfile stats of each phase
 
 Example:
 python validate_jsonl.py augmented_train_data.jsonl
+python validate_jsonl.py train.jsonl --schema chatml --workers 16 --report train_report.json
+python validate_jsonl.py train.arrow --schema chatml --workers 16
 
 Input JSONL Example:
 {"messages": [{"content": "You are a helpful assistant.", "role": "system"}, {"content": "Hello", "role": "user"}, {"content": "Hi there!", "role": "assistant"}]}
@@ -19,33 +38,189 @@ Warning: Empty line at line 2
 Error in line 3: 'messages' is not a list
 Content: {"messages": "invalid"}
 ---
+
+Schema Report Example:
+{"file": "train.jsonl", "schema": "chatml", "lines": 1000, "valid": 997, "invalid": 3, "empty": 0, "stopped_at_line": null,
+ "errors": {"type:messages[].content:str": {"count": 2, "sample_lines": [17, 512]}, "invalid_json": {"count": 1, "sample_lines": [40]}}}
 """
 
 import json
+import sys
 import argparse
+from functools import partial
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from batch_io import is_arrow_file, json_default
+from instrumentation import Metrics, add_metrics_arguments
+from jsonl_executor import map_arrow_rows, map_lines
+from schema_validator import get_validator
+
+def check_record(data, content):
+    """Returns None if the record's 'messages' holds a 'messages' list, or (label, detail, content)."""
+    messages = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(messages, dict) or not isinstance(messages.get('messages'), list):
+        return ('Error', "'messages' is not a list", content)
+    return None
+
+def validate_line(line):
+    """Returns None for a valid line, ('empty',) for an empty one, or (label, detail, content) for an invalid one."""
+    line = line.strip()
+    if not line:
+        return ('empty',)
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError as e:
+        return ('JSON decode error', str(e), line)
+    return check_record(data, line)
+
+def validate_rows(batch):
+    """validate_line over the rows of an Arrow record batch, which hold flat ChatML (see compile_arrow.py)."""
+    return [None if isinstance(row.get('messages'), list)
+            else ('Error', "'messages' is not a list", json.dumps(row, default=json_default))
+            for row in batch.to_pylist()]
+
+def validate_jsonl(file_path, workers=1, metrics=None):
+    metrics = metrics or Metrics("validate_jsonl", [file_path])
+    if is_arrow_file(file_path):
+        results = map_arrow_rows(file_path, validate_rows, workers, on_range=metrics.add_bytes)
+    else:
+        results = map_lines(file_path, validate_line, workers, on_range=metrics.add_bytes)
+    for line_number, problem in metrics.timed(results, "process"):
+        metrics.add(rows=1)
+        if problem is None:
+            continue
+        metrics.count(problem[0])
+        if problem[0] == 'empty':
+            print(f"Warning: Empty line at line {line_number}")
+            continue
+        label, detail, content = problem
+        print(f"{label} in line {line_number}: {detail}")
+        print(f"Content: {content}")
+        print("---")
+    metrics.finish()
+
+def check_line(line, schema):
+    """Returns None for a valid line, 'empty' for an empty one, or the error class of an invalid one."""
+    line = line.strip()
+    if not line:
+        return 'empty'
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        return 'invalid_json'
+    return get_validator(schema)(data)
+
+def is_typed_chatml(schema):
+    """Returns whether a batch schema has the typed messages column of compile_arrow.py."""
+    if "messages" not in schema.names:
+        return False
+    messages_type = schema.field("messages").type
+    if not pa.types.is_list(messages_type) or not pa.types.is_struct(messages_type.value_type):
+        return False
+    fields = {field.name: field.type for field in messages_type.value_type}
+    return fields.get("role") == pa.string() and fields.get("content") == pa.string()
+
+def check_chatml_batch(batch):
+    """
+    The chatml validator over a typed messages column, with the same error classes. A null field is
+    reported as missing, as the column cannot tell it from an absent one.
+    """
+    messages = batch.column("messages")
+    errors = [None] * batch.num_rows
+    for row in np.flatnonzero(messages.is_null().to_numpy(zero_copy_only=False)):
+        errors[row] = 'missing:messages'
+
+    # The first message of each row that is null or lacks a role or a content decides its error
+    values = messages.flatten()
+    parents = pc.list_parent_indices(messages).to_numpy()
+    message_null = values.is_null().to_numpy(zero_copy_only=False)
+    role_null = pc.struct_field(values, "role").is_null().to_numpy(zero_copy_only=False)
+    content_null = pc.struct_field(values, "content").is_null().to_numpy(zero_copy_only=False)
+    bad = np.flatnonzero(message_null | role_null | content_null)
+    rows, first = np.unique(parents[bad], return_index=True)
+    for row, position in zip(rows.tolist(), bad[first].tolist()):
+        if message_null[position]:
+            errors[row] = 'type:messages[]:object'
+        elif role_null[position]:
+            errors[row] = 'missing:messages[].role'
+        else:
+            errors[row] = 'missing:messages[].content'
+    return errors
 
-def validate_jsonl(file_path):
-    with open(file_path, 'r') as file:
-        for line_number, line in enumerate(file, 1):
-            line = line.strip()
-            if not line:
-                print(f"Warning: Empty line at line {line_number}")
-                continue
-            try:
-                data = json.loads(line)
-                if not isinstance(data.get('messages', {}).get('messages'), list):
-                    print(f"Error in line {line_number}: 'messages' is not a list")
-                    print(f"Content: {line}")
-                    print("---")
-            except json.JSONDecodeError as e:
-                print(f"JSON decode error in line {line_number}: {e}")
-                print(f"Content: {line}")
-                print("---")
+def check_batch(batch, schema):
+    """check_line over the rows of an Arrow record batch."""
+    if schema == "chatml" and is_typed_chatml(batch.schema):
+        return check_chatml_batch(batch)
+    validate = get_validator(schema)
+    return [validate(row) for row in batch.to_pylist()]
+
+def validate_schema(file_path, schema, workers=1, max_samples=10, fail_fast=False, metrics=None):
+    """Validates every line against a schema and returns the aggregated report."""
+    metrics = metrics or Metrics("validate_jsonl", [file_path])
+    # Compile up front so a bad schema fails before any work is sent to the workers
+    get_validator(schema)
+
+    report = {"file": file_path, "schema": schema, "lines": 0, "valid": 0, "invalid": 0, "empty": 0,
+              "stopped_at_line": None, "errors": {}}
+    errors = report["errors"]
+
+    if is_arrow_file(file_path):
+        results = map_arrow_rows(file_path, partial(check_batch, schema=schema), workers, on_range=metrics.add_bytes)
+    else:
+        results = map_lines(file_path, partial(check_line, schema=schema), workers, on_range=metrics.add_bytes)
+    for line_number, error in metrics.timed(results, "process"):
+        metrics.add(rows=1)
+        report["lines"] += 1
+        if error is None:
+            report["valid"] += 1
+            continue
+        if error == 'empty':
+            report["empty"] += 1
+            continue
+
+        report["invalid"] += 1
+        entry = errors.setdefault(error, {"count": 0, "sample_lines": []})
+        entry["count"] += 1
+        if len(entry["sample_lines"]) < max_samples:
+            entry["sample_lines"].append(line_number)
+
+        if fail_fast:
+            report["stopped_at_line"] = line_number
+            break
+
+    for name in ("valid", "invalid", "empty"):
+        metrics.count(name, report[name])
+    metrics.finish()
+    return report
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Validate JSONL file")
     parser.add_argument(
-        "input_file", help="Path to input JSONL file")
+        "input_file", help="Path to input JSONL file (or Arrow IPC file)")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument(
+        "--schema", help="Built-in schema name (chatml, nested, kto, sharegpt) or path to a JSON schema file")
+    parser.add_argument(
+        "--report", help="Path to save the JSON report (default: print to stdout)")
+    parser.add_argument(
+        "--max_samples", type=int, default=10, help="Number of offending line numbers kept per error class")
+    parser.add_argument(
+        "--fail_fast", action="store_true", help="Stop at the first invalid line")
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    validate_jsonl(args.input_file)
\ No newline at end of file
+    metrics = Metrics("validate_jsonl", [args.input_file], args.metrics_out, args.profile)
+    if args.schema is None:
+        validate_jsonl(args.input_file, args.workers, metrics)
+    else:
+        report = validate_schema(args.input_file, args.schema, args.workers, args.max_samples, args.fail_fast,
+                                 metrics)
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
+        else:
+            print(json.dumps(report, indent=2))
+        sys.exit(1 if report["invalid"] else 0)